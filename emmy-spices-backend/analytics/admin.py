@@ -1,3 +1,66 @@
+from collections import Counter
+
 from django.contrib import admin
+from django.utils.html import format_html
+
+from .models import RequestProfile
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = [
+        'created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count',
+        'db_time_ms', 'mode', 'trigger', 'user'
+    ]
+    list_filter = ['mode', 'trigger', 'method', 'status_code', 'created_at']
+    search_fields = ['path', 'route', 'user__username']
+    ordering = ['-created_at']
+    date_hierarchy = 'created_at'
+
+    fieldsets = (
+        ('Request', {
+            'fields': ('method', 'path', 'route', 'status_code', 'user', 'created_at')
+        }),
+        ('Timings', {
+            'fields': ('duration_ms', 'db_time_ms', 'query_count', 'sample_count')
+        }),
+        ('Profile', {
+            'fields': (
+                'mode', 'trigger', 'collapsed_file', 'speedscope_file', 'pstats_file',
+                'formatted_report'
+            )
+        }),
+        ('SQL', {
+            'fields': ('repeated_queries', 'formatted_sql_log'),
+            'classes': ('collapse',)
+        })
+    )
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields] + [
+            'formatted_report', 'repeated_queries', 'formatted_sql_log'
+        ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def formatted_report(self, obj):
+        return format_html('<pre>{}</pre>', obj.report)
+    formatted_report.short_description = 'Report'
+
+    def repeated_queries(self, obj):
+        counts = Counter(entry['sql'] for entry in obj.sql_log)
+        lines = [f'{count:5d} x  {sql}' for sql, count in counts.most_common(10) if count > 1]
+        return format_html('<pre>{}</pre>', '\n'.join(lines) or 'None')
+    repeated_queries.short_description = 'Repeated statements'
 
-# Register your models here.
+    def formatted_sql_log(self, obj):
+        lines = [
+            f"{entry['duration_ms']:8.3f} ms  {entry['sql']}"
+            for entry in obj.sql_log
+        ]
+        return format_html('<pre>{}</pre>', '\n'.join(lines))
+    formatted_sql_log.short_description = 'Statements'
@@ -0,0 +1,289 @@
+"""
+Clickstream ingestion for WebsiteAnalytics and UserAnalytics.
+
+Beacon requests append raw events to an in-memory ring buffer (and optionally
+to an append-only NDJSON log). A background thread drains the buffer on an
+interval, aggregates the events into per-day counters and writes them with
+one bulk upsert per table, so ingesting events never costs a database write
+per event. A flush that fails is logged and its events are kept in memory
+for the next one. The NDJSON log is an archive of the raw events for
+offline reprocessing; it is not read back by the flusher.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import math
+import threading
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+
+EVENT_TYPES = ('session_start', 'page_view', 'product_view', 'add_to_cart')
+DEVICE_TYPES = ('desktop', 'mobile', 'tablet')
+
+
+class HyperLogLog:
+    """Fixed-size sketch estimating the number of distinct visitor ids"""
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers:
+            self.registers = bytearray(registers)
+        else:
+            self.registers = bytearray(self.size)
+
+    def add(self, value):
+        """Add a value to the sketch"""
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        x = int.from_bytes(digest, 'big')
+        index = x >> (64 - self.precision)
+        remaining = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Merge another sketch of the same precision into this one"""
+        for i, rank in enumerate(other.registers):
+            if rank > self.registers[i]:
+                self.registers[i] = rank
+
+    def count(self):
+        """Estimate the number of distinct values added"""
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+
+class _DayAggregate:
+    """Counters accumulated for one day between flushes"""
+
+    def __init__(self):
+        self.page_views = 0
+        self.sessions = 0
+        self.devices = defaultdict(int)
+        self.visitors = HyperLogLog()
+        self.users = defaultdict(lambda: defaultdict(int))
+
+
+class ClickstreamBuffer:
+    """Bounded ring buffer of raw events with an interval flusher"""
+
+    def __init__(self, maxlen, flush_interval, log_path=None):
+        self.events = deque(maxlen=maxlen)
+        self.flush_interval = flush_interval
+        self.log_path = log_path
+        self.received = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+        # Events of a failed flush, written with the next one
+        self.retry = []
+        self._log_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def record(self, events):
+        """Append a batch of normalized events to the buffer"""
+        overflow = len(self.events) + len(events) - self.events.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+        self.events.extend(events)
+        self.received += len(events)
+        if self.log_path:
+            lines = ''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in events)
+            with self._log_lock, open(self.log_path, 'a') as log:
+                log.write(lines)
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name='clickstream-flusher', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            # Replace a connection broken by an earlier flush
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                # The events are kept for the next interval
+                logger.exception('Clickstream flush failed; %d events kept for retry', len(self.retry))
+
+    def stop(self):
+        """Stop the flusher thread and write out anything still buffered"""
+        self._stop.set()
+        self.flush()
+
+    def drain(self):
+        """Remove and return every buffered event"""
+        events = []
+        popleft = self.events.popleft
+        try:
+            while True:
+                events.append(popleft())
+        except IndexError:
+            pass
+        return events
+
+    def flush(self):
+        """
+        Aggregate buffered events and upsert them; returns events written.
+
+        When the write fails the events are kept, up to the buffer size,
+        and written with the next flush.
+        """
+        with self._flush_lock:
+            events = self.retry + self.drain()
+            self.retry = []
+            if not events:
+                return 0
+            try:
+                write_aggregates(aggregate(events))
+            except Exception:
+                self.failed_flushes += 1
+                overflow = len(events) - self.events.maxlen
+                if overflow > 0:
+                    self.dropped += overflow
+                    events = events[overflow:]
+                self.retry = events
+                raise
+            self.flushed += len(events)
+            return len(events)
+
+    def stats(self):
+        return {
+            'buffered': len(self.events) + len(self.retry),
+            'received': self.received,
+            'dropped': self.dropped,
+            'flushed': self.flushed,
+            'failed_flushes': self.failed_flushes,
+        }
+
+
+def normalize_event(event, user_id=None, received_at=None):
+    """Validate a raw beacon event and reduce it to the fields we aggregate"""
+    if not isinstance(event, dict):
+        return None
+    event_type = event.get('type')
+    if event_type not in EVENT_TYPES:
+        return None
+    visitor_id = event.get('visitor_id')
+    if not visitor_id:
+        return None
+    device = event.get('device')
+    return {
+        'type': event_type,
+        'visitor_id': str(visitor_id)[:64],
+        'device': device if device in DEVICE_TYPES else 'desktop',
+        'path': str(event.get('path', ''))[:200],
+        'user_id': user_id,
+        'date': (received_at or timezone.now()).date().isoformat(),
+    }
+
+
+def aggregate(events):
+    """Fold raw events into per-day counters"""
+    days = defaultdict(_DayAggregate)
+    for event in events:
+        day = days[event['date']]
+        day.visitors.add(event['visitor_id'])
+        event_type = event['type']
+        if event_type == 'session_start':
+            day.sessions += 1
+            day.devices[event['device']] += 1
+        elif event_type == 'page_view':
+            day.page_views += 1
+        user_id = event['user_id']
+        if user_id is not None:
+            day.users[user_id][event_type] += 1
+    return days
+
+
+def write_aggregates(days):
+    """Merge per-day counters into WebsiteAnalytics and UserAnalytics"""
+    from .models import WebsiteAnalytics, UserAnalytics
+
+    dates = list(days)
+    with transaction.atomic():
+        existing = {
+            row.date.isoformat(): row
+            for row in WebsiteAnalytics.objects.select_for_update().filter(date__in=dates)
+        }
+        website_rows = []
+        for date, day in days.items():
+            row = existing.get(date) or WebsiteAnalytics(date=date)
+            sketch = HyperLogLog(registers=row.visitor_sketch or None)
+            sketch.merge(day.visitors)
+            row.visitor_sketch = sketch.to_bytes()
+            row.unique_visitors = sketch.count()
+            row.total_visitors += day.sessions
+            row.page_views += day.page_views
+            row.desktop_visitors += day.devices['desktop']
+            row.mobile_visitors += day.devices['mobile']
+            row.tablet_visitors += day.devices['tablet']
+            if row.total_visitors:
+                row.average_pages_per_session = round(row.page_views / row.total_visitors, 2)
+            website_rows.append(row)
+        WebsiteAnalytics.objects.bulk_create(
+            website_rows,
+            update_conflicts=True,
+            unique_fields=['date'],
+            update_fields=[
+                'visitor_sketch', 'unique_visitors', 'total_visitors', 'page_views',
+                'desktop_visitors', 'mobile_visitors', 'tablet_visitors',
+                'average_pages_per_session', 'updated_at',
+            ],
+        )
+
+        keys = [(user_id, date) for date, day in days.items() for user_id in day.users]
+        if not keys:
+            return
+        existing = {
+            (row.user_id, row.date.isoformat()): row
+            for row in UserAnalytics.objects.select_for_update().filter(
+                user_id__in={user_id for user_id, _ in keys}, date__in=dates
+            )
+        }
+        user_rows = []
+        for user_id, date in keys:
+            counts = days[date].users[user_id]
+            row = existing.get((user_id, date)) or UserAnalytics(user_id=user_id, date=date)
+            row.page_views += counts['page_view']
+            row.products_viewed += counts['product_view']
+            row.products_added_to_cart += counts['add_to_cart']
+            user_rows.append(row)
+        UserAnalytics.objects.bulk_create(
+            user_rows,
+            update_conflicts=True,
+            unique_fields=['user', 'date'],
+            update_fields=['page_views', 'products_viewed', 'products_added_to_cart', 'updated_at'],
+        )
+
+
+buffer = ClickstreamBuffer(
+    maxlen=getattr(settings, 'CLICKSTREAM_BUFFER_SIZE', 100000),
+    flush_interval=getattr(settings, 'CLICKSTREAM_FLUSH_INTERVAL', 5),
+    log_path=getattr(settings, 'CLICKSTREAM_LOG_PATH', None),
+)
+atexit.register(buffer.stop)
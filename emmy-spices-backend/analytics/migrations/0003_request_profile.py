@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_website_visitor_sketch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('route', models.CharField(blank=True, max_length=255)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('mode', models.CharField(choices=[('sample', 'Stack sampler'), ('cprofile', 'cProfile')], max_length=10)),
+                ('trigger', models.CharField(choices=[('requested', 'Requested with ?profile='), ('sampled', 'Random sample')], max_length=10)),
+                ('duration_ms', models.FloatField()),
+                ('db_time_ms', models.FloatField(default=0)),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('report', models.TextField(blank=True)),
+                ('sql_log', models.JSONField(blank=True, default=list)),
+                ('collapsed_file', models.FileField(blank=True, upload_to='profiles/%Y/%m/%d/')),
+                ('speedscope_file', models.FileField(blank=True, upload_to='profiles/%Y/%m/%d/')),
+                ('pstats_file', models.FileField(blank=True, upload_to='profiles/%Y/%m/%d/')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='request_profiles', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='analytics_r_created_c245ea_idx')],
+            },
+        ),
+    ]
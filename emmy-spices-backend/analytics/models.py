@@ -1,7 +1,10 @@
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import datetime, timedelta
+from emmy_spices_backend.replicas import replica_reads
 from products.models import Product
 from orders.models import Order
 
@@ -47,53 +50,56 @@ class SalesAnalytics(models.Model):
         """Calculate metrics for this date"""
         from django.db.models import Sum, Count, Avg
         
-        # Get orders for this date
-        orders = Order.objects.filter(
-            created_at__date=self.date,
-            status__in=['delivered', 'shipped', 'processing']
-        )
+        # Heavy aggregations, fine to read from a (slightly stale) replica
+        with replica_reads():
+            # Get orders for this date
+            orders = Order.objects.filter(
+                created_at__date=self.date,
+                status__in=['delivered', 'shipped', 'processing']
+            )
         
-        # Calculate revenue
-        self.total_revenue = orders.aggregate(total=Sum('total_amount'))['total'] or 0
-        self.total_orders = orders.count()
+            # Calculate revenue
+            self.total_revenue = orders.aggregate(total=Sum('total_amount'))['total'] or 0
+            self.total_orders = orders.count()
         
-        # Calculate order types
-        self.retail_orders = orders.filter(order_type='retail').count()
-        self.wholesale_orders = orders.filter(order_type='wholesale').count()
+            # Calculate order types
+            self.retail_orders = orders.filter(order_type='retail').count()
+            self.wholesale_orders = orders.filter(order_type='wholesale').count()
         
-        # Calculate revenue by type
-        self.retail_revenue = orders.filter(order_type='retail').aggregate(
-            total=Sum('total_amount'))['total'] or 0
-        self.wholesale_revenue = orders.filter(order_type='wholesale').aggregate(
-            total=Sum('total_amount'))['total'] or 0
+            # Calculate revenue by type
+            self.retail_revenue = orders.filter(order_type='retail').aggregate(
+                total=Sum('total_amount'))['total'] or 0
+            self.wholesale_revenue = orders.filter(order_type='wholesale').aggregate(
+                total=Sum('total_amount'))['total'] or 0
         
-        # Calculate average order value
-        if self.total_orders > 0:
-            self.average_order_value = self.total_revenue / self.total_orders
+            # Calculate average order value
+            if self.total_orders > 0:
+                self.average_order_value = self.total_revenue / self.total_orders
         
-        # Calculate customer metrics
-        unique_customers = orders.values('user').distinct().count()
-        new_customers = User.objects.filter(
-            date_joined__date=self.date
-        ).count()
-        self.new_customers = new_customers
-        self.returning_customers = unique_customers - new_customers
+            # Calculate customer metrics
+            unique_customers = orders.values('user').distinct().count()
+            new_customers = User.objects.filter(
+                date_joined__date=self.date
+            ).count()
+            self.new_customers = new_customers
+            # New customers who did not order would otherwise make this negative
+            self.returning_customers = max(unique_customers - new_customers, 0)
         
-        # Calculate product metrics
-        from orders.models import OrderItem
-        order_items = OrderItem.objects.filter(
-            order__created_at__date=self.date
-        )
-        self.total_products_sold = order_items.aggregate(
-            total=Sum('quantity'))['total'] or 0
+            # Calculate product metrics
+            from orders.models import OrderItem
+            order_items = OrderItem.objects.filter(
+                order__created_at__date=self.date
+            )
+            self.total_products_sold = order_items.aggregate(
+                total=Sum('quantity'))['total'] or 0
         
-        # Find top product
-        top_product_data = order_items.values('product').annotate(
-            total_quantity=Sum('quantity')
-        ).order_by('-total_quantity').first()
+            # Find top product
+            top_product_data = order_items.values('product').annotate(
+                total_quantity=Sum('quantity')
+            ).order_by('-total_quantity').first()
         
-        if top_product_data:
-            self.top_product_id = top_product_data['product']
+            if top_product_data:
+                self.top_product_id = top_product_data['product']
         
         self.save()
 
@@ -180,6 +186,9 @@ class WebsiteAnalytics(models.Model):
     mobile_visitors = models.PositiveIntegerField(default=0)
     tablet_visitors = models.PositiveIntegerField(default=0)
     
+    # HyperLogLog registers behind unique_visitors, merged on each clickstream flush
+    visitor_sketch = models.BinaryField(null=True, blank=True, editable=False)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -229,7 +238,62 @@ class InventoryAnalytics(models.Model):
             self.days_of_inventory = self.closing_stock / (self.stock_sold / 30)  # Assuming 30 days
         
         # Set alerts
-        self.low_stock_alert = self.closing_stock < 50
+        self.low_stock_alert = self.closing_stock < self.product.effective_reorder_threshold
         self.out_of_stock_alert = self.closing_stock == 0
         
         self.save()
+
+
+class RequestProfile(models.Model):
+    """Profile of a single request (see analytics.profiling)"""
+    MODE_CHOICES = [
+        ('sample', 'Stack sampler'),
+        ('cprofile', 'cProfile'),
+    ]
+    TRIGGER_CHOICES = [
+        ('requested', 'Requested with ?profile='),
+        ('sampled', 'Random sample'),
+    ]
+    
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    route = models.CharField(max_length=255, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='request_profiles'
+    )
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES)
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    
+    # Timings
+    duration_ms = models.FloatField()
+    db_time_ms = models.FloatField(default=0)
+    query_count = models.PositiveIntegerField(default=0)
+    sample_count = models.PositiveIntegerField(default=0)
+    
+    # Results
+    report = models.TextField(blank=True)
+    sql_log = models.JSONField(default=list, blank=True)
+    collapsed_file = models.FileField(upload_to='profiles/%Y/%m/%d/', blank=True)
+    speedscope_file = models.FileField(upload_to='profiles/%Y/%m/%d/', blank=True)
+    pstats_file = models.FileField(upload_to='profiles/%Y/%m/%d/', blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+@receiver(post_delete, sender=RequestProfile)
+def delete_request_profile_files(sender, instance, **kwargs):
+    """Remove the stored profile files along with the row"""
+    for field in ('collapsed_file', 'speedscope_file', 'pstats_file'):
+        stored = getattr(instance, field)
+        if stored:
+            stored.delete(save=False)
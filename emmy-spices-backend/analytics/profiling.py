@@ -0,0 +1,340 @@
+"""
+Opt-in per-request profiling.
+
+Staff users, signed in or sending a staff API token, can add ``?profile=1``
+(or ``?profile=sample`` / ``?profile=cprofile``) to any request, and
+PROFILING_SAMPLE_RATE profiles a random fraction of API traffic. Whether a
+request may be profiled is decided before it runs: ``?profile=`` from anyone
+else is ignored, so it cannot make the server pay for a profiler.
+
+A profiled request runs either under a stack sampler, which produces
+collapsed stacks (for flamegraph.pl) and a speedscope file, or under
+cProfile, which produces a pstats dump. The SQL statements of the request
+are logged in both modes, and the result is saved as a RequestProfile that
+can be browsed from the admin.
+
+Under ASGI a profiled request is run on a worker thread, and only what runs
+on that thread is profiled: the sync views, but not the awaiting parts of
+async views.
+"""
+import cProfile
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections
+from rest_framework import exceptions
+
+from emmy_spices_backend.async_api import aauthenticate
+from users.authentication import requesting_user
+
+
+logger = logging.getLogger(__name__)
+
+REQUESTED_MODES = {
+    'sample': 'sample',
+    'cprofile': 'cprofile',
+}
+
+
+def _call_view(get_response, request):
+    # Sampled stacks are cut at this frame, so they start at the view
+    return get_response(request)
+
+
+def _short_path(filename):
+    base_dir = str(settings.BASE_DIR)
+    if filename.startswith(base_dir):
+        return os.path.relpath(filename, base_dir)
+    marker = 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return filename
+
+
+class StackSampler:
+    """Sample the call stack of one thread at a fixed interval"""
+
+    def __init__(self, thread_id, interval, root_code=_call_view.__code__):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root_code = root_code
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root_code:
+                code = frame.f_code
+                stack.append((code.co_name, _short_path(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[tuple(stack)] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope"""
+        lines = []
+        for stack, count in self.stacks.most_common():
+            frames = ';'.join(f'{name} ({filename}:{line})' for name, filename, line in stack)
+            lines.append(f'{frames} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self, name):
+        """Stacks as a speedscope sampled profile, weighted in milliseconds"""
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        interval_ms = self.interval * 1000
+        for stack, count in self.stacks.items():
+            sample = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                sample.append(frame_index[frame])
+            samples.append(sample)
+            weights.append(count * interval_ms)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'emmy-spices-backend',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+
+    def report(self, limit=25):
+        """Functions with the most samples, by self and inclusive time"""
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for frame in set(stack):
+                inclusive[frame] += count
+        total = self.samples or 1
+        lines = [
+            f'{self.samples} samples every {self.interval * 1000:g} ms',
+            '',
+            f'{"self %":>7} {"total %":>8}  function',
+        ]
+        for frame, count in inclusive.most_common(limit):
+            name, filename, line = frame
+            lines.append(
+                f'{own[frame] * 100 / total:7.1f} {count * 100 / total:8.1f}  '
+                f'{name} ({filename}:{line})'
+            )
+        return '\n'.join(lines) + '\n'
+
+
+class SQLLog:
+    """
+    Database execute wrapper keeping the statements of one request.
+
+    Only the SQL text and timings are kept: parameters hold token keys,
+    password hashes and session keys, which must not end up in the admin.
+    """
+
+    def __init__(self, limit=1000):
+        self.limit = limit
+        self.entries = []
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if len(self.entries) < self.limit:
+                self.entries.append({
+                    'sql': sql,
+                    'many': many,
+                    'duration_ms': round(elapsed * 1000, 3),
+                })
+
+
+async def arequesting_user(request):
+    """``requesting_user`` for async requests"""
+    try:
+        user, _ = await aauthenticate(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    return user if user.is_authenticated else None
+
+
+def run_profiled(get_response, request, mode):
+    """
+    Get the response for ``request`` under the given profiler.
+
+    Returns ``(response, result)`` where ``result`` holds what
+    ``save_profile`` needs to store.
+    """
+    sql_log = SQLLog(getattr(settings, 'PROFILING_MAX_QUERIES', 1000))
+    interval = getattr(settings, 'PROFILING_SAMPLE_INTERVAL_MS', 5) / 1000
+    profiler = None
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(sql_log))
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            response = profiler.runcall(get_response, request)
+        else:
+            profiler = StackSampler(threading.get_ident(), interval)
+            profiler.start()
+            try:
+                response = _call_view(get_response, request)
+            finally:
+                profiler.stop()
+    duration = time.perf_counter() - started
+    return response, {
+        'mode': mode,
+        'profiler': profiler,
+        'sql_log': sql_log,
+        'duration': duration,
+    }
+
+
+def save_profile(request, response, result, trigger):
+    """Store a profiled request as a RequestProfile"""
+    from .models import RequestProfile
+
+    mode = result['mode']
+    profiler = result['profiler']
+    sql_log = result['sql_log']
+    match = request.resolver_match
+    user = getattr(request, 'user', None)
+
+    profile = RequestProfile(
+        method=request.method,
+        path=request.get_full_path()[:500],
+        route=match.route if match else '',
+        status_code=response.status_code,
+        user=user if user is not None and user.is_authenticated else None,
+        mode=mode,
+        trigger=trigger,
+        duration_ms=result['duration'] * 1000,
+        query_count=sql_log.count,
+        db_time_ms=sql_log.duration * 1000,
+        sql_log=sql_log.entries,
+    )
+    name = f'{time.strftime("%H%M%S")}-{secrets.token_hex(4)}'
+    if mode == 'cprofile':
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats('cumulative').print_stats(40)
+        profile.report = output.getvalue()
+        # Same format as Stats.dump_stats, readable by pstats and snakeviz
+        profile.pstats_file.save(f'{name}.prof', ContentFile(marshal.dumps(stats.stats)), save=False)
+    else:
+        title = f'{request.method} {profile.path}'
+        profile.sample_count = profiler.samples
+        profile.report = profiler.report()
+        profile.collapsed_file.save(
+            f'{name}.collapsed', ContentFile(profiler.collapsed().encode()), save=False
+        )
+        profile.speedscope_file.save(
+            f'{name}.speedscope.json',
+            ContentFile(json.dumps(profiler.speedscope(title)).encode()),
+            save=False
+        )
+    profile.save()
+    return profile
+
+
+class ProfilingMiddleware:
+    """Profile requests asking for it with ``?profile=``, plus a random sample"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.path_prefixes = tuple(getattr(settings, 'PROFILING_PATH_PREFIXES', ['/api/']))
+        self.default_mode = getattr(settings, 'PROFILING_DEFAULT_MODE', 'sample')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        user = requesting_user(request) if self.is_requested(request) else None
+        mode, trigger = self.get_mode(request, user)
+        if mode is None:
+            return self.get_response(request)
+        return self.profile(request, self.get_response, mode, trigger)
+
+    async def __acall__(self, request):
+        user = await arequesting_user(request) if self.is_requested(request) else None
+        mode, trigger = self.get_mode(request, user)
+        if mode is None:
+            return await self.get_response(request)
+        # The profilers follow one thread
+        return await sync_to_async(self.profile)(request, async_to_sync(self.get_response), mode, trigger)
+
+    def profile(self, request, get_response, mode, trigger):
+        """Get the response under the profiler and save the profile"""
+        response, result = run_profiled(get_response, request, mode)
+        try:
+            profile = save_profile(request, response, result, trigger)
+        except Exception:
+            logger.exception('Could not save the profile of %s %s', request.method, request.path)
+            return response
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+    def is_requested(self, request):
+        return request.GET.get('profile') not in (None, '', '0', 'false')
+
+    def get_mode(self, request, user):
+        """
+        Get the ``(mode, trigger)`` to profile with, or ``(None, None)``.
+
+        ``?profile=`` is only honoured for staff ``user``; for everyone
+        else it is ignored before the request runs.
+        """
+        if self.is_requested(request) and user is not None and user.is_staff:
+            return REQUESTED_MODES.get(request.GET['profile'], self.default_mode), 'requested'
+        if (self.sample_rate and request.path.startswith(self.path_prefixes)
+                and random.random() < self.sample_rate):
+            return 'sample', 'sampled'
+        return None, None
@@ -74,6 +74,15 @@ class InventoryAnalyticsSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
+class ClickstreamBatchSerializer(serializers.Serializer):
+    """Serializer for a batch of storefront clickstream events"""
+    events = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=500
+    )
+
+
 class DashboardSummarySerializer(serializers.Serializer):
     """Serializer for dashboard summary"""
     total_revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
@@ -0,0 +1,9 @@
+from jobs.queue import task
+from .models import SalesAnalytics
+
+
+@task
+def refresh_sales_analytics(date):
+    """Recompute the sales rollup of ``date`` (an ISO date)"""
+    analytics, _ = SalesAnalytics.objects.get_or_create(date=date)
+    analytics.calculate_daily_metrics()
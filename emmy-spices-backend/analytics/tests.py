@@ -1,3 +1,226 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .clickstream import ClickstreamBuffer, HyperLogLog, aggregate, normalize_event
+from jobs.models import Job
+from orders.models import Order
+from products.models import Category, Product
+from .models import RequestProfile, SalesAnalytics, UserAnalytics, WebsiteAnalytics
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def token_header(self, **user_fields):
+        user = User.objects.create_user(f'user{User.objects.count()}', **user_fields)
+        return {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=user).key}'}
+
+    def test_anonymous_and_non_staff_requests_are_not_profiled(self):
+        for headers in ({}, self.token_header(), {'HTTP_AUTHORIZATION': 'Token bogus'}):
+            with self.subTest(headers=headers):
+                response = self.client.get('/api/products/api/products/?profile=cprofile', **headers)
+                self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_staff_token_profiles_without_sql_params(self):
+        response = self.client.get(
+            '/api/products/api/products/?profile=cprofile&search=secret', **self.token_header(is_staff=True)
+        )
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.mode, 'cprofile')
+        self.assertTrue(profile.sql_log)
+        for entry in profile.sql_log:
+            self.assertEqual(set(entry), {'sql', 'many', 'duration_ms'})
+
+    async def test_async_requests_are_decided_up_front(self):
+        response = await self.async_client.get('/api/products/api/async/products/?profile=1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(await RequestProfile.objects.aexists())
+
+
+class HyperLogLogTests(SimpleTestCase):
+    def test_estimates_distinct_values_within_a_few_percent(self):
+        for distinct in (10, 1000, 50000):
+            with self.subTest(distinct=distinct):
+                sketch = HyperLogLog()
+                for i in range(distinct):
+                    sketch.add(f'visitor-{i}')
+                    sketch.add(f'visitor-{i}')
+                self.assertAlmostEqual(sketch.count(), distinct, delta=max(1, distinct * 0.05))
+
+    def test_merged_sketches_count_the_union(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            first.add(i)
+        for i in range(2000, 5000):
+            second.add(i)
+        first.merge(second)
+        restored = HyperLogLog(registers=first.to_bytes())
+        self.assertAlmostEqual(restored.count(), 5000, delta=250)
+
+
+def beacon_events(date='2026-10-19'):
+    events = [
+        {'type': 'session_start', 'visitor_id': 'a', 'device': 'mobile'},
+        {'type': 'page_view', 'visitor_id': 'a'},
+        {'type': 'page_view', 'visitor_id': 'a'},
+        {'type': 'session_start', 'visitor_id': 'b', 'device': 'smart-fridge'},
+        {'type': 'product_view', 'visitor_id': 'b'},
+        {'type': 'add_to_cart', 'visitor_id': 'b'},
+        {'type': 'purchase', 'visitor_id': 'b'},
+        {'type': 'page_view'},
+    ]
+    normalized = [normalize_event(event) for event in events]
+    for event in normalized:
+        if event is not None:
+            event['date'] = date
+    return normalized
+
+
+class ClickstreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('browser')
+
+    def events(self):
+        events = [event for event in beacon_events() if event is not None]
+        for event in events[3:]:
+            event['user_id'] = self.user.id
+        return events
+
+    def test_invalid_events_are_rejected(self):
+        self.assertEqual(beacon_events()[-2:], [None, None])
+
+    def test_aggregate_folds_events_per_day(self):
+        day = aggregate(self.events())['2026-10-19']
+        self.assertEqual((day.sessions, day.page_views), (2, 2))
+        self.assertEqual(dict(day.devices), {'mobile': 1, 'desktop': 1})
+        self.assertEqual(day.visitors.count(), 2)
+        self.assertEqual(dict(day.users[self.user.id]), {
+            'session_start': 1, 'product_view': 1, 'add_to_cart': 1,
+        })
+
+    def test_flushes_merge_into_existing_rows(self):
+        buffer = ClickstreamBuffer(maxlen=100, flush_interval=60)
+        for _ in range(2):
+            buffer.events.extend(self.events())
+            self.assertEqual(buffer.flush(), 6)
+        website = WebsiteAnalytics.objects.get()
+        self.assertEqual(
+            (website.total_visitors, website.unique_visitors, website.page_views,
+             website.mobile_visitors, website.desktop_visitors),
+            (4, 2, 4, 2, 2)
+        )
+        user = UserAnalytics.objects.get()
+        self.assertEqual((user.products_viewed, user.products_added_to_cart), (2, 2))
+
+    def test_failed_flush_keeps_events_for_the_next_one(self):
+        buffer = ClickstreamBuffer(maxlen=100, flush_interval=60)
+        buffer.events.extend(self.events())
+        with mock.patch('analytics.clickstream.write_aggregates', side_effect=OSError('down')):
+            with self.assertRaises(OSError):
+                buffer.flush()
+        self.assertEqual(buffer.stats()['buffered'], 6)
+        buffer.events.extend(self.events())
+        self.assertEqual(buffer.flush(), 12)
+        self.assertEqual(WebsiteAnalytics.objects.get().total_visitors, 4)
+
+
+class SalesSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst')
+        self.client.force_login(self.user)
+        Order.objects.create(
+            user=self.user, customer_name='Test', customer_email='test@example.com',
+            shipping_address='1 KG Ave', shipping_city='Kigali', shipping_state='Kigali',
+            subtotal=10, total_amount=10, status='processing',
+        )
+
+    def get_today(self):
+        response = self.client.get('/api/analytics/api/sales/summary/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['today']
+
+    def test_missing_row_is_computed_inline(self):
+        self.assertEqual(self.get_today()['total_orders'], 1)
+        self.assertEqual(self.get_today()['total_orders'], 1)
+        self.assertFalse(Job.objects.exists())
+
+    def test_stale_row_is_served_while_a_job_refreshes_it(self):
+        self.get_today()
+        SalesAnalytics.objects.update(updated_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(self.get_today()['total_orders'], 1)
+        self.assertEqual(self.get_today()['total_orders'], 1)
+        job = Job.objects.get()
+        self.assertEqual(job.task, 'analytics.tasks.refresh_sales_analytics')
+
+
+class WebsiteSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.force_login(User.objects.create_user('analyst'))
+        today = timezone.now().date()
+        for days_ago, visitors in ((0, 10), (3, 20), (30, 1000)):
+            WebsiteAnalytics.objects.create(
+                date=today - datetime.timedelta(days=days_ago), total_visitors=visitors,
+                page_views=visitors * 2,
+            )
+
+    def get_summary(self):
+        response = self.client.get('/api/analytics/api/website/summary/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        response = self.client.get('/api/analytics/api/website/summary/')
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_weekly_summary_is_cached(self):
+        summary = self.get_summary()
+        self.assertEqual(summary['today']['total_visitors'], 10)
+        self.assertEqual(summary['weekly_summary']['total_visitors'], 30)
+        self.assertEqual(summary['weekly_summary']['total_page_views'], 60)
+
+        WebsiteAnalytics.objects.filter(total_visitors=20).update(total_visitors=50)
+        self.assertEqual(self.get_summary()['weekly_summary']['total_visitors'], 30)
+        cache.clear()
+        self.assertEqual(self.get_summary()['weekly_summary']['total_visitors'], 60)
+
+
+class InventoryAlertsTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('analyst'))
+        category = Category.objects.create(name='Ground', reorder_threshold=10)
+        for name, stock in (('Empty', 0), ('Low', 4), ('Stocked', 40)):
+            Product.objects.create(
+                name=name, description='Aromatic', category=category,
+                price=Decimal('5.00'), retail_price=Decimal('5.00'),
+                wholesale_price=Decimal('4.00'), stock=stock,
+            )
+
+    def test_alerts_group_products_in_one_query(self):
+        with self.assertNumQueries(3):
+            # Session and user lookups, then the joined product query
+            response = self.client.get('/api/analytics/api/inventory/alerts/')
+        data = response.json()
+        self.assertEqual([product['name'] for product in data['out_of_stock']], ['Empty'])
+        self.assertEqual(data['low_stock'], [{
+            'id': Product.objects.get(name='Low').id, 'name': 'Low', 'stock': 4,
+            'category': 'Ground',
+        }])
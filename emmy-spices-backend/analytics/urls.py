@@ -1,11 +1,17 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SalesAnalyticsViewSet, ProductAnalyticsViewSet, UserAnalyticsViewSet
+from .views import (
+    SalesAnalyticsViewSet, ProductAnalyticsViewSet, UserAnalyticsViewSet,
+    WebsiteAnalyticsViewSet, InventoryAnalyticsViewSet, ClickstreamViewSet
+)
 
 router = DefaultRouter()
 router.register(r'sales', SalesAnalyticsViewSet)
 router.register(r'products', ProductAnalyticsViewSet)
 router.register(r'users', UserAnalyticsViewSet)
+router.register(r'website', WebsiteAnalyticsViewSet)
+router.register(r'inventory', InventoryAnalyticsViewSet)
+router.register(r'beacon', ClickstreamViewSet, basename='beacon')
 
 app_name = 'analytics'
 
@@ -1,33 +1,70 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.core.cache import cache
 from django.db.models import Sum, Count, Avg
 from django.utils import timezone
 from datetime import datetime, timedelta
+import time
+
+from jobs.queue import enqueue
+
+from emmy_spices_backend.metrics import SerializerTimingMixin
 
 from .models import SalesAnalytics, ProductAnalytics, UserAnalytics, WebsiteAnalytics, InventoryAnalytics
 from .serializers import (
     SalesAnalyticsSerializer, ProductAnalyticsSerializer, UserAnalyticsSerializer,
-    WebsiteAnalyticsSerializer, InventoryAnalyticsSerializer
+    WebsiteAnalyticsSerializer, InventoryAnalyticsSerializer, ClickstreamBatchSerializer
 )
+from .tasks import refresh_sales_analytics
+from . import clickstream
+
+
+# How long (in seconds) the dashboard's weekly website aggregate is reused
+# before it is recomputed from the WebsiteAnalytics table.
+WEBSITE_SUMMARY_CACHE_TIMEOUT = 60
+
+# Age (in seconds) after which the sales summary queues a recomputation of
+# today's SalesAnalytics row.
+SALES_SUMMARY_REFRESH_SECONDS = 60
+
+
+def trends_throttle_cost(request):
+    """Charge one token per 30 days of trend data requested"""
+    try:
+        days = int(request.query_params.get('days', 30))
+    except ValueError:
+        days = 30
+    return 1 + max(days, 0) // 30
 
 
-class SalesAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
+class SalesAnalyticsViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for SalesAnalytics model"""
     queryset = SalesAnalytics.objects.all()
     serializer_class = SalesAnalyticsSerializer
     permission_classes = [IsAuthenticated]
+    throttle_costs = {'summary': 5, 'trends': trends_throttle_cost}
 
     @action(detail=False, methods=['get'])
     def summary(self, request):
         """Get sales summary for dashboard"""
         today = timezone.now().date()
         
-        # Get today's analytics
+        # Get today's analytics; a missing row is computed inline, a stale
+        # one is served as is while a background job recomputes it, at most
+        # once per SALES_SUMMARY_REFRESH_SECONDS
         today_analytics, created = SalesAnalytics.objects.get_or_create(date=today)
         if created:
             today_analytics.calculate_daily_metrics()
+        elif timezone.now() - today_analytics.updated_at > timedelta(
+            seconds=SALES_SUMMARY_REFRESH_SECONDS
+        ):
+            bucket = int(time.time() // SALES_SUMMARY_REFRESH_SECONDS)
+            enqueue(
+                refresh_sales_analytics, {'date': today.isoformat()},
+                key=f'sales-analytics:{today.isoformat()}:{bucket}'
+            )
         
         # Get last 30 days summary
         thirty_days_ago = today - timedelta(days=30)
@@ -80,7 +117,7 @@ class SalesAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class ProductAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductAnalyticsViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for ProductAnalytics model"""
     queryset = ProductAnalytics.objects.all()
     serializer_class = ProductAnalyticsSerializer
@@ -113,7 +150,9 @@ class ProductAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
         """Get products with low stock"""
         from products.models import Product
         
-        low_stock_products = Product.objects.filter(stock__lt=50).order_by('stock')
+        low_stock_products = Product.objects.below_threshold().select_related(
+            'category'
+        ).order_by('stock')
         
         data = [
             {
@@ -128,7 +167,7 @@ class ProductAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(data)
 
 
-class UserAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
+class UserAnalyticsViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for UserAnalytics model"""
     queryset = UserAnalytics.objects.all()
     serializer_class = UserAnalyticsSerializer
@@ -165,7 +204,7 @@ class UserAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(data)
 
 
-class WebsiteAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
+class WebsiteAnalyticsViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for WebsiteAnalytics model"""
     queryset = WebsiteAnalytics.objects.all()
     serializer_class = WebsiteAnalyticsSerializer
@@ -179,15 +218,19 @@ class WebsiteAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
         # Get today's analytics
         today_analytics, created = WebsiteAnalytics.objects.get_or_create(date=today)
         
-        # Get last 7 days summary
-        seven_days_ago = today - timedelta(days=7)
-        weekly_data = WebsiteAnalytics.objects.filter(
-            date__gte=seven_days_ago
-        ).aggregate(
-            total_visitors=Sum('total_visitors'),
-            total_page_views=Sum('page_views'),
-            avg_conversion_rate=Avg('conversion_rate')
-        )
+        # Get last 7 days summary, cached so the dashboard can poll cheaply
+        cache_key = f'analytics:website:weekly:{today.isoformat()}'
+        weekly_data = cache.get(cache_key)
+        if weekly_data is None:
+            seven_days_ago = today - timedelta(days=7)
+            weekly_data = WebsiteAnalytics.objects.filter(
+                date__gte=seven_days_ago
+            ).aggregate(
+                total_visitors=Sum('total_visitors'),
+                total_page_views=Sum('page_views'),
+                avg_conversion_rate=Avg('conversion_rate')
+            )
+            cache.set(cache_key, weekly_data, WEBSITE_SUMMARY_CACHE_TIMEOUT)
         
         data = {
             'today': WebsiteAnalyticsSerializer(today_analytics).data,
@@ -201,7 +244,7 @@ class WebsiteAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(data)
 
 
-class InventoryAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
+class InventoryAnalyticsViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for InventoryAnalytics model"""
     queryset = InventoryAnalytics.objects.all()
     serializer_class = InventoryAnalyticsSerializer
@@ -212,30 +255,54 @@ class InventoryAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
         """Get inventory alerts"""
         from products.models import Product
         
-        # Low stock products
-        low_stock_products = Product.objects.filter(stock__lt=50, stock__gt=0)
+        # Out of stock products are below any threshold, so a single joined
+        # query returns both groups
+        below_threshold = Product.objects.below_threshold().select_related('category')
         
-        # Out of stock products
-        out_of_stock_products = Product.objects.filter(stock=0)
-        
-        data = {
-            'low_stock': [
-                {
+        data = {'low_stock': [], 'out_of_stock': []}
+        for product in below_threshold:
+            if product.stock == 0:
+                data['out_of_stock'].append({
                     'id': product.id,
                     'name': product.name,
-                    'stock': product.stock,
                     'category': product.category.name
-                }
-                for product in low_stock_products
-            ],
-            'out_of_stock': [
-                {
+                })
+            else:
+                data['low_stock'].append({
                     'id': product.id,
                     'name': product.name,
+                    'stock': product.stock,
                     'category': product.category.name
-                }
-                for product in out_of_stock_products
-            ]
-        }
+                })
         
         return Response(data)
+
+
+class ClickstreamViewSet(viewsets.ViewSet):
+    """Beacon endpoint accepting batched storefront events"""
+    permission_classes = [AllowAny]
+
+    def create(self, request):
+        """Buffer a batch of events for the next aggregated flush"""
+        serializer = ClickstreamBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        user_id = request.user.id if request.user.is_authenticated else None
+        received_at = timezone.now()
+        events = []
+        for raw_event in serializer.validated_data['events']:
+            event = clickstream.normalize_event(raw_event, user_id, received_at)
+            if event is not None:
+                events.append(event)
+        clickstream.buffer.record(events)
+        
+        return Response(
+            {'accepted': len(events), 'rejected': len(serializer.validated_data['events']) - len(events)},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def stats(self, request):
+        """Get ingestion buffer statistics"""
+        return Response(clickstream.buffer.stats())
@@ -0,0 +1,186 @@
+"""
+Keep-alive load generator.
+
+Opens a fixed number of persistent HTTP/1.1 connections to a running server
+and has each send one request after another for a set duration, the way a
+crowd of browsers and API clients keeps connections open. It is written on
+asyncio streams, so a single process holds thousands of connections, and
+measures the throughput and latency the server sustains at that concurrency.
+"""
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+from .runner import percentile
+
+
+class ConnectionFailed(Exception):
+    pass
+
+
+async def _read_response(reader):
+    """Read one response; returns its status code and whether the server keeps the connection"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionFailed('Connection closed by the server')
+    status_code = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status_code, headers.get('connection', '').lower() != 'close'
+
+
+class LoadGenerator:
+    """Drive ``connections`` keep-alive clients against ``base_url``"""
+
+    def __init__(self, base_url, connections=1000, duration=10.0, warmup=2.0,
+                 connect_timeout=10.0, request_timeout=30.0, seed=1):
+        url = urlsplit(base_url)
+        if url.scheme != 'http':
+            raise ValueError('Only http:// URLs are supported')
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip('/')
+        self.connections = connections
+        self.duration = duration
+        self.warmup = warmup
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.seed = seed
+
+    def _request(self, path, token):
+        lines = [
+            f'GET {self.prefix}{path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Accept: application/json',
+            'Connection: keep-alive',
+        ]
+        if token:
+            lines.append(f'Authorization: Token {token}')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+    async def _client(self, index, build_request, started, stats):
+        rng = random.Random(f'{self.seed}:{index}')
+        measure_from = started + self.warmup
+        deadline = measure_from + self.duration
+        reader = writer = None
+        try:
+            while time.perf_counter() < deadline:
+                if writer is None:
+                    try:
+                        reader, writer = await asyncio.wait_for(
+                            asyncio.open_connection(self.host, self.port), self.connect_timeout
+                        )
+                    except (OSError, asyncio.TimeoutError):
+                        stats['connect_errors'] += 1
+                        await asyncio.sleep(0.1)
+                        continue
+                    stats['connects'] += 1
+
+                path, token = build_request(rng)
+                sent = time.perf_counter()
+                try:
+                    writer.write(self._request(path, token))
+                    # Responses still pending at the deadline are abandoned
+                    status_code, keep_alive = await asyncio.wait_for(
+                        _read_response(reader), min(self.request_timeout, deadline - sent + 0.01)
+                    )
+                except (OSError, ValueError, asyncio.IncompleteReadError,
+                        asyncio.TimeoutError, ConnectionFailed):
+                    status_code, keep_alive = None, False
+                finished = time.perf_counter()
+
+                # Responses completed in the window, even if sent before it, so
+                # a saturated server's queueing delay shows in the latencies
+                if measure_from <= finished <= deadline:
+                    if status_code is None:
+                        stats['socket_errors'] += 1
+                    else:
+                        stats['latencies'].append((finished - sent) * 1000)
+                        stats['status_codes'][status_code] = (
+                            stats['status_codes'].get(status_code, 0) + 1
+                        )
+                if not keep_alive:
+                    writer.close()
+                    reader = writer = None
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def _run(self, build_request):
+        stats = {
+            'latencies': [], 'status_codes': {}, 'connects': 0,
+            'connect_errors': 0, 'socket_errors': 0,
+        }
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self._client(index, build_request, started, stats)
+            for index in range(self.connections)
+        ))
+        return stats
+
+    def wait_until_idle(self, path, threshold=1.0, timeout=300.0):
+        """
+        Wait for requests left over from a previous run to drain, i.e. for
+        ``path`` to be answered within ``threshold`` seconds; returns whether it was.
+        """
+        async def probe():
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                writer.write(self._request(path, None))
+                await _read_response(reader)
+            finally:
+                writer.close()
+
+        give_up = time.perf_counter() + timeout
+        while time.perf_counter() < give_up:
+            started = time.perf_counter()
+            try:
+                asyncio.run(asyncio.wait_for(probe(), timeout))
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionFailed):
+                time.sleep(threshold)
+                continue
+            if time.perf_counter() - started < threshold:
+                return True
+        return False
+
+    def run(self, build_request):
+        """
+        Load the server with requests from ``build_request(rng)``, which
+        returns a ``(path, token)`` pair, and summarize the measured window.
+        """
+        stats = asyncio.run(self._run(build_request))
+        latencies = sorted(stats['latencies'])
+        errors = stats['socket_errors'] + sum(
+            count for status_code, count in stats['status_codes'].items() if status_code >= 400
+        )
+        return {
+            'connections': self.connections,
+            'duration_s': self.duration,
+            'requests': len(latencies),
+            'errors': errors,
+            'status_codes': {str(code): count for code, count in sorted(stats['status_codes'].items())},
+            'socket_errors': stats['socket_errors'],
+            'connects': stats['connects'],
+            'connect_errors': stats['connect_errors'],
+            'throughput_rps': round(len(latencies) / self.duration, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        }
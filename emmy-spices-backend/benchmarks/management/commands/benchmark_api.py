@@ -0,0 +1,244 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings, setup_test_environment, teardown_test_environment
+)
+
+from benchmarks.runner import HTTPTransport, InProcessTransport, compare, run_scenario
+from benchmarks.scenarios import SCENARIOS
+from benchmarks.seed import load_dataset, seed_dataset
+
+
+# Requests from the benchmark must not be rate limited
+UNLIMITED_BUCKETS = {scope: (10 ** 9, 10 ** 9) for scope in ('anon', 'user', 'token')}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark API latency, queries per request and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenarios',
+            help=f'Comma-separated scenarios to run (default: all of {", ".join(SCENARIOS)})'
+        )
+        parser.add_argument('--iterations', type=int, default=200, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+        parser.add_argument(
+            '--url',
+            help='Benchmark a running server at this URL instead of in-process. The server '
+                 'uses its own database and throttling settings.'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Concurrent requests, each worker thread with its own database connection'
+        )
+        parser.add_argument(
+            '--sqlite-pragmas', choices=['tuned', 'stock'], default='tuned',
+            help='In-process on SQLite, apply SQLITE_PRAGMAS (tuned) or none (stock) to '
+                 'compare against SQLite defaults'
+        )
+        parser.add_argument('--users', type=int, default=200, help='Customers to seed')
+        parser.add_argument('--products', type=int, default=500, help='Products to seed')
+        parser.add_argument('--orders', type=int, default=2000, help='Historical orders to seed')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for data and requests')
+        parser.add_argument(
+            '--seed-data',
+            action='store_true',
+            help='With --url, seed the configured database first (not needed on reruns)'
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Keep the in-process benchmark database between runs'
+        )
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Compare against a previous JSON result')
+        parser.add_argument(
+            '--threshold', type=float, default=10.0,
+            help='Percent change tolerated before a metric counts as a regression'
+        )
+        parser.add_argument(
+            '--fail-on-regression',
+            action='store_true',
+            help='Exit with an error if --compare finds a regression'
+        )
+
+    def handle(self, *args, **options):
+        names = options['scenarios'].split(',') if options['scenarios'] else list(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(unknown)}')
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+
+        if options['url']:
+            results = self.run_over_http(names, options)
+        else:
+            results = self.run_in_process(names, options)
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = self.report_comparison(baseline, results, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{regressions} metric(s) regressed')
+
+    def run_in_process(self, names, options):
+        """Seed a throwaway test database and drive the app through the test client"""
+        overrides = {'THROTTLE_BUCKETS': UNLIMITED_BUCKETS, 'PROFILING_SAMPLE_RATE': 0}
+        if options['sqlite_pragmas'] == 'stock':
+            overrides['SQLITE_PRAGMAS'] = {}
+        test_settings = connection.settings_dict['TEST']
+        configured_test_name, scratch = test_settings['NAME'], None
+        if connection.vendor == 'sqlite':
+            # A file, so journal and locking behave as in production, in its
+            # own directory so the WAL files are removed with it
+            if options['keepdb']:
+                test_name = os.path.join(tempfile.gettempdir(), 'emmy_spices_benchmark.sqlite3')
+            else:
+                scratch = tempfile.mkdtemp(prefix='emmy-spices-benchmark-')
+                test_name = os.path.join(scratch, 'benchmark.sqlite3')
+            test_settings['NAME'] = test_name
+
+        setup_test_environment()
+        try:
+            with override_settings(**overrides):
+                old_name = connection.creation.create_test_db(
+                    verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb']
+                )
+                try:
+                    data = load_dataset() if options['keepdb'] else None
+                    if data is None:
+                        data = self.seed(options)
+                    return self.run(InProcessTransport(), names, data, options, mode='in-process')
+                finally:
+                    connection.creation.destroy_test_db(
+                        old_name, verbosity=0, keepdb=options['keepdb']
+                    )
+        finally:
+            teardown_test_environment()
+            test_settings['NAME'] = configured_test_name
+            if scratch:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+    def run_over_http(self, names, options):
+        if options['seed_data']:
+            self.seed(options)
+        data = load_dataset()
+        if data is None:
+            raise CommandError('No benchmark data in the database; rerun with --seed-data')
+        return self.run(HTTPTransport(options['url']), names, data, options, mode='http')
+
+    def seed(self, options):
+        started = time.perf_counter()
+        data = seed_dataset(
+            users=options['users'], products=options['products'],
+            orders=options['orders'], seed=options['seed']
+        )
+        self.stdout.write(
+            f'Seeded {options["users"]} users, {options["products"]} products and '
+            f'{options["orders"]} orders in {time.perf_counter() - started:.1f}s'
+        )
+        return data
+
+    def run(self, transport, names, data, options, mode):
+        results = {'meta': self.meta(options, mode), 'scenarios': {}}
+        for name in names:
+            self.stdout.write(f'Running {name}...')
+            results['scenarios'][name] = run_scenario(
+                transport, SCENARIOS[name], data,
+                iterations=options['iterations'], warmup=options['warmup'],
+                concurrency=options['concurrency'], seed=options['seed']
+            )
+        return results
+
+    def meta(self, options, mode):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, cwd=settings.BASE_DIR, timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'mode': mode,
+            'url': options['url'],
+            'database': connection.vendor,
+            'database_options': self.database_options(options, mode),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'seed': options['seed'],
+            'volumes': {
+                'users': options['users'],
+                'products': options['products'],
+                'orders': options['orders'],
+            },
+            'iterations': options['iterations'],
+            'warmup': options['warmup'],
+            'concurrency': options['concurrency'],
+        }
+
+    def database_options(self, options, mode):
+        """The connection settings that shape concurrent throughput"""
+        if mode == 'http':
+            return None
+        if connection.vendor == 'sqlite':
+            return {
+                'pragmas': getattr(settings, 'SQLITE_PRAGMAS', {}),
+                'transaction_mode': connection.settings_dict['OPTIONS'].get('transaction_mode'),
+            }
+        return {
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'pool': connection.settings_dict['OPTIONS'].get('pool'),
+        }
+
+    def report(self, results):
+        self.stdout.write('')
+        self.stdout.write(
+            f'{"scenario":<18} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+            f'{"req/s":>9} {"queries":>8} {"errors":>7}'
+        )
+        for name, summary in results['scenarios'].items():
+            queries = summary['queries_mean']
+            self.stdout.write(
+                f'{name:<18} {summary["p50_ms"]:9.2f} {summary["p95_ms"]:9.2f} '
+                f'{summary["p99_ms"]:9.2f} {summary["throughput_rps"]:9.1f} '
+                f'{"-" if queries is None else f"{queries:.1f}":>8} {summary["errors"]:7d}'
+            )
+
+    def report_comparison(self, baseline, results, threshold):
+        rows = compare(baseline, results, threshold)
+        regressions = 0
+        self.stdout.write('')
+        self.stdout.write(
+            f'Compared with {baseline.get("meta", {}).get("commit") or "baseline"} '
+            f'(threshold {threshold:g}%)'
+        )
+        for name, metric, old, new, change, regressed in rows:
+            if regressed:
+                regressions += 1
+                line = self.style.ERROR(
+                    f'  {name:<18} {metric:<15} {old:>10} -> {new:>10} ({change:+.1f}%)'
+                )
+            else:
+                line = f'  {name:<18} {metric:<15} {old:>10} -> {new:>10} ({change:+.1f}%)'
+            self.stdout.write(line)
+        self.stdout.write(f'{regressions} regression(s)')
+        return regressions
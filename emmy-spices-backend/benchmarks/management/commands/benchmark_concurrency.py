@@ -0,0 +1,150 @@
+import json
+import platform
+import resource
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.loadgen import LoadGenerator
+from benchmarks.seed import load_dataset
+
+
+# Endpoint -> (DRF path, async path, role)
+ENDPOINTS = {
+    'catalog_list': (
+        '/api/products/api/products/?page={page}',
+        '/api/products/api/async/products/?page={page}',
+        'anon',
+    ),
+    'catalog_detail': (
+        '/api/products/api/products/{product_id}/',
+        '/api/products/api/async/products/{product_id}/',
+        'anon',
+    ),
+    'featured': (
+        '/api/products/api/products/featured/',
+        '/api/products/api/async/products/featured/',
+        'anon',
+    ),
+    'unread_notifications': (
+        '/api/users/api/notifications/unread/',
+        '/api/users/api/async/notifications/unread/',
+        'customer',
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare throughput of the DRF views under WSGI and of the DRF and async '
+        'views under ASGI at many concurrent keep-alive connections'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', help='Running WSGI server, loaded through the DRF views')
+        parser.add_argument(
+            '--asgi-url', help='Running ASGI server, loaded through the DRF and the async views'
+        )
+        parser.add_argument(
+            '--endpoints',
+            help=f'Comma-separated endpoints to run (default: all of {", ".join(ENDPOINTS)})'
+        )
+        parser.add_argument('--connections', type=int, default=1000, help='Keep-alive connections')
+        parser.add_argument('--duration', type=float, default=20.0, help='Measured seconds per run')
+        parser.add_argument(
+            '--warmup', type=float, default=10.0,
+            help='Seconds to run before measuring, long enough for the latencies to settle'
+        )
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the requests')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        names = options['endpoints'].split(',') if options['endpoints'] else list(ENDPOINTS)
+        unknown = [name for name in names if name not in ENDPOINTS]
+        if unknown:
+            raise CommandError(f'Unknown endpoints: {", ".join(unknown)}')
+        if not options['wsgi_url'] and not options['asgi_url']:
+            raise CommandError('Pass --wsgi-url, --asgi-url or both')
+        if options['connections'] < 1:
+            raise CommandError('--connections must be at least 1')
+        data = load_dataset()
+        if data is None:
+            raise CommandError(
+                'No benchmark data in the database; seed it with benchmark_api --url ... --seed-data'
+            )
+        self.raise_open_files_limit(options['connections'])
+
+        runs = []
+        if options['wsgi_url']:
+            runs.append(('wsgi', 'drf', options['wsgi_url']))
+        if options['asgi_url']:
+            runs += [('asgi', 'drf', options['asgi_url']), ('asgi', 'async', options['asgi_url'])]
+
+        results = {'meta': self.meta(options), 'runs': {}}
+        for name in names:
+            for server, views, url in runs:
+                label = f'{name}/{server}/{views}'
+                generator = LoadGenerator(
+                    url, connections=options['connections'], duration=options['duration'],
+                    warmup=options['warmup'], seed=options['seed']
+                )
+                # Abandoned requests of the previous run may still be queued
+                if not generator.wait_until_idle(ENDPOINTS['featured'][0]):
+                    raise CommandError(f'{url} is not responding')
+                self.stdout.write(f'Running {label} with {options["connections"]} connections...')
+                results['runs'][label] = generator.run(
+                    self.request_builder(name, views, data)
+                )
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def request_builder(self, name, views, data):
+        drf_path, async_path, role = ENDPOINTS[name]
+        template = async_path if views == 'async' else drf_path
+
+        def build(rng):
+            path = template.format(
+                page=rng.randint(1, 3), product_id=rng.choice(data['product_ids'])
+            )
+            token = rng.choice(data['customer_tokens']) if role == 'customer' else None
+            return path, token
+        return build
+
+    def raise_open_files_limit(self, connections):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        needed = connections + 100
+        if soft != resource.RLIM_INFINITY and soft < needed:
+            if hard != resource.RLIM_INFINITY and hard < needed:
+                raise CommandError(
+                    f'{connections} connections need {needed} open files, the limit is {hard}'
+                )
+            resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+    def meta(self, options):
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'wsgi_url': options['wsgi_url'],
+            'asgi_url': options['asgi_url'],
+            'connections': options['connections'],
+            'duration': options['duration'],
+            'warmup': options['warmup'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        }
+
+    def report(self, results):
+        self.stdout.write('')
+        self.stdout.write(
+            f'{"run":<38} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+            f'{"req/s":>9} {"errors":>7}'
+        )
+        for label, run in results['runs'].items():
+            self.stdout.write(
+                f'{label:<38} {run["p50_ms"]:9.2f} {run["p95_ms"]:9.2f} '
+                f'{run["p99_ms"]:9.2f} {run["throughput_rps"]:9.1f} {run["errors"]:7d}'
+            )
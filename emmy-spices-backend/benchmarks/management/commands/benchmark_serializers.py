@@ -0,0 +1,104 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from benchmarks.seed import seed_dataset
+from emmy_spices_backend.renderers import ORJSONRenderer
+from orders.models import Order
+from orders.serializers import FastOrderListSerializer, OrderListSerializer
+from products.models import Product
+from products.serializers import FastProductListSerializer, ProductListSerializer
+
+
+# List -> (DRF queryset, fast path queryset, DRF serializer, fast serializer)
+LISTS = {
+    'products': (
+        lambda: Product.objects.filter(is_active=True).select_related('category'),
+        lambda: Product.objects.filter(is_active=True),
+        ProductListSerializer,
+        FastProductListSerializer,
+    ),
+    'orders': (
+        # Prefetched, as the best the ModelSerializer can do for total_items
+        lambda: Order.objects.order_by('-created_at', '-id').prefetch_related('items'),
+        lambda: Order.objects.order_by('-created_at', '-id'),
+        OrderListSerializer,
+        FastOrderListSerializer,
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the ModelSerializer and JSONRenderer with the compiled list '
+        'serializers and orjson on product and order lists, checking they match'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', default='20,50,100', help='Comma-separated list sizes to measure'
+        )
+        parser.add_argument('--iterations', type=int, default=200, help='Measured runs per size')
+        parser.add_argument('--products', type=int, default=500, help='Products to seed')
+        parser.add_argument('--orders', type=int, default=2000, help='Orders to seed')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['rows'].split(',')]
+        except ValueError:
+            raise CommandError('--rows must be comma-separated integers')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seed_dataset(users=100, products=options['products'], orders=options['orders'])
+            reset_queries()
+            results = [
+                (name, size, *self.measure(name, size, options['iterations']))
+                for name in LISTS for size in sizes
+            ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.report(results)
+
+    def measure(self, name, size, iterations):
+        drf_queryset, fast_queryset, serializer_class, fast_class = LISTS[name]
+        context = {'request': APIRequestFactory().get('/')}
+
+        def drf():
+            objects = list(drf_queryset()[:size])
+            data = serializer_class(objects, many=True, context=context).data
+            return JSONRenderer().render(data)
+
+        def fast():
+            serializer = fast_class(context=context)
+            rows = list(serializer.values(fast_queryset())[:size])
+            return ORJSONRenderer().render(serializer.to_representation(rows))
+
+        if drf() != fast():
+            raise CommandError(f'The fast {name} list does not match the ModelSerializer')
+        return self.median_ms(drf, iterations), self.median_ms(fast, iterations)
+
+    def median_ms(self, func, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def report(self, results):
+        self.stdout.write('')
+        self.stdout.write(
+            f'{"list":<10} {"rows":>5} {"drf ms":>9} {"fast ms":>9} {"speedup":>8}'
+        )
+        for name, size, drf_ms, fast_ms in results:
+            self.stdout.write(
+                f'{name:<10} {size:5d} {drf_ms:9.2f} {fast_ms:9.2f} {drf_ms / fast_ms:7.1f}x'
+            )
@@ -0,0 +1,111 @@
+import time
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from benchmarks.scale import (
+    build_plan, reset_sequences, seed_catalog, seed_orders, seed_reviews, seed_users
+)
+
+
+class Command(BaseCommand):
+    help = 'Generate a large, deterministic synthetic dataset for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Customers to create')
+        parser.add_argument('--products', type=int, default=2000, help='Products to create')
+        parser.add_argument('--orders', type=int, default=100000, help='Orders to create')
+        parser.add_argument(
+            '--reviews', type=int,
+            help='Product reviews to create (default: one per 20 orders)'
+        )
+        parser.add_argument('--days', type=int, default=365, help='Days of order history')
+        parser.add_argument(
+            '--end-date',
+            help='Last day of the history as YYYY-MM-DD (default: today). Fix it to get '
+                 'identical data on different days.'
+        )
+        parser.add_argument('--seed', type=int, default=1, help='Random seed')
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Zipf exponent of product popularity (higher is more skewed)'
+        )
+        parser.add_argument(
+            '--wholesale-share', type=float, default=0.1,
+            help='Fraction of customers who are distributors placing wholesale orders'
+        )
+        parser.add_argument(
+            '--no-activity',
+            action='store_true',
+            help='Skip the user activity entries generated with each order'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Processes generating and inserting orders in parallel'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT')
+        parser.add_argument(
+            '--block-size', type=int, default=10000,
+            help='Orders per block, the unit of work handed to a worker'
+        )
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['products']) < 1 and options['orders']:
+            raise CommandError('Orders need at least one user and one product')
+        end = None
+        if options['end_date']:
+            try:
+                day = datetime.strptime(options['end_date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--end-date must be YYYY-MM-DD')
+            end = datetime.combine(day, dt_time(23, 59, 59), tzinfo=dt_timezone.utc)
+        if connection.vendor == 'sqlite' and options['workers'] > 1:
+            self.stdout.write(self.style.WARNING(
+                'SQLite allows a single writer; workers will mostly take turns inserting.'
+            ))
+
+        plan = build_plan(
+            users=options['users'],
+            products=options['products'],
+            orders=options['orders'],
+            seed=options['seed'],
+            days=options['days'],
+            end=end,
+            zipf_exponent=options['zipf'],
+            wholesale_share=options['wholesale_share'],
+            reviews=options['reviews'],
+            activity=not options['no_activity'],
+            batch_size=options['batch_size'],
+            block_size=options['block_size'],
+        )
+
+        started = time.perf_counter()
+        self.step('Products', options['products'], lambda: seed_catalog(plan))
+        self.step('Users', options['users'], lambda: seed_users(plan))
+
+        rows = [0]
+        orders_started = time.perf_counter()
+
+        def progress(done, total, block_rows):
+            rows[0] += block_rows
+            elapsed = time.perf_counter() - orders_started
+            orders_done = min(done * plan['block_size'], plan['orders'])
+            self.stdout.write(
+                f'  block {done}/{total}: ~{orders_done} orders, {rows[0]} rows, '
+                f'{rows[0] / elapsed:,.0f} rows/s'
+            )
+
+        self.step('Orders', options['orders'], lambda: seed_orders(plan, options['workers'], progress))
+        self.step('Reviews', plan['reviews'], lambda: seed_reviews(plan))
+        reset_sequences()
+        self.stdout.write(self.style.SUCCESS(
+            f'Done in {time.perf_counter() - started:.1f}s (seed {plan["seed"]}, '
+            f'history {plan["start"]:%Y-%m-%d} to {plan["end"]:%Y-%m-%d})'
+        ))
+
+    def step(self, name, count, run):
+        self.stdout.write(f'{name}: {count}')
+        started = time.perf_counter()
+        run()
+        self.stdout.write(f'  {name.lower()} done in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,213 @@
+"""
+Benchmark runner.
+
+Scenarios are driven either in-process through Django's test ``Client``
+(which also counts the SQL queries of each request) or against a running
+server over HTTP. Results hold latency percentiles, queries per request and
+throughput per scenario, and can be compared with a previous run.
+
+With ``concurrency`` above one, requests are split between worker threads.
+In-process, each thread has its own test client and, like the threads of a
+WSGI server, its own database connections.
+"""
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.core.cache import caches
+from django.db import connections
+from django.test import Client
+
+from users.authentication import token_cache
+
+
+class QueryCounter:
+    """Database execute wrapper counting the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class InProcessTransport:
+    """Send requests through the full middleware stack without a server"""
+
+    counts_queries = True
+
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client()
+        return self.local.client
+
+    def reset(self):
+        """Start each scenario with cold caches so query counts are repeatable"""
+        token_cache.clear()
+        for cache in caches.all():
+            cache.clear()
+
+    def send(self, request, token):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            if request.get('body') is not None:
+                response = self.client.generic(
+                    request['method'], request['path'], json.dumps(request['body']),
+                    content_type='application/json', **headers
+                )
+            else:
+                response = self.client.generic(request['method'], request['path'], **headers)
+        return response.status_code, counter.count
+
+    def release(self):
+        """Close the calling thread's connections once its requests are done"""
+        connections.close_all()
+
+
+class HTTPTransport:
+    """Send requests to a running server"""
+
+    counts_queries = False
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def reset(self):
+        pass
+
+    def release(self):
+        pass
+
+    def send(self, request, token):
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        data = None
+        if request.get('body') is not None:
+            data = json.dumps(request['body']).encode()
+            headers['Content-Type'] = 'application/json'
+        http_request = urllib.request.Request(
+            self.base_url + request['path'], data=data, headers=headers, method=request['method']
+        )
+        try:
+            with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            return exc.code, None
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def build_requests(scenario, data, count, seed):
+    rng = random.Random(f'{seed}:{scenario.__name__}')
+    requests = []
+    for _ in range(count):
+        request = scenario(rng, data)
+        if request['role'] == 'staff':
+            request['token'] = data['staff_token']
+        requests.append(request)
+    return requests
+
+
+def run_scenario(transport, scenario, data, iterations=200, warmup=20, concurrency=1, seed=1):
+    """Run one scenario and summarize its latencies"""
+    requests = build_requests(scenario, data, warmup + iterations, seed)
+    transport.reset()
+    for request in requests[:warmup]:
+        transport.send(request, request.get('token'))
+
+    def timed(request):
+        started = time.perf_counter()
+        status_code, queries = transport.send(request, request.get('token'))
+        return time.perf_counter() - started, status_code, queries
+
+    def worker(chunk):
+        try:
+            return [timed(request) for request in chunk]
+        finally:
+            transport.release()
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        measured = requests[warmup:]
+        chunks = [measured[index::concurrency] for index in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = [result for chunk in executor.map(worker, chunks) for result in chunk]
+    else:
+        results = [timed(request) for request in requests[warmup:]]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(result[0] * 1000 for result in results)
+    status_codes = {}
+    for _, status_code, _ in results:
+        status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+    summary = {
+        'description': scenario.__doc__,
+        'requests': len(results),
+        'errors': sum(1 for _, status_code, _ in results if status_code >= 400),
+        'status_codes': status_codes,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'throughput_rps': round(len(results) / elapsed, 2) if elapsed > 0 else 0.0,
+        'queries_mean': None,
+        'queries_max': None,
+    }
+    if transport.counts_queries and results:
+        queries = [result[2] for result in results]
+        summary['queries_mean'] = round(sum(queries) / len(queries), 2)
+        summary['queries_max'] = max(queries)
+    return summary
+
+
+def compare(baseline, current, threshold=10.0):
+    """
+    Compare two benchmark results scenario by scenario.
+
+    Returns rows of ``(scenario, metric, before, after, change_percent,
+    regressed)``. Latency and query regressions are increases, throughput
+    regressions are decreases; changes within ``threshold`` percent are not
+    regressions, except for query counts, which are deterministic.
+    """
+    rows = []
+    for name, after in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean', 'throughput_rps'):
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) * 100 / old if old else 0.0
+            if metric == 'throughput_rps':
+                regressed = change < -threshold
+            elif metric == 'queries_mean':
+                regressed = new > old
+            else:
+                regressed = change > threshold
+            rows.append((name, metric, old, new, round(change, 1), regressed))
+    return rows
@@ -0,0 +1,489 @@
+"""
+Synthetic data at scale.
+
+Generates a catalog, customers and a long order history with realistic
+shape: product popularity follows a Zipf distribution, a share of customers
+are distributors placing larger wholesale orders, order status follows
+order age, and orders come with payments and the activity entries a
+customer would have left. Everything is inserted with ``bulk_create``.
+
+Output is fully determined by the seed. Users, products and orders get
+explicit primary keys, and orders are generated in fixed-size blocks, each
+with its own random stream. Blocks can therefore be spread over worker
+processes without changing the result.
+"""
+import bisect
+import contextlib
+import itertools
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Avg, Count, FloatField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from rest_framework.authtoken.models import Token
+
+from orders.models import Order, OrderItem, Payment, ShippingMethod
+from products.models import DEFAULT_REORDER_THRESHOLD, Category, Product, ProductReview
+from users.models import UserActivity, UserProfile
+
+from .seed import ADJECTIVES, CITIES, CUSTOMER_PREFIX, SHIPPING_METHODS, SPICES, STAFF_USERNAME
+
+
+PAYMENT_METHODS = ['mobile_money', 'card', 'bank_transfer']
+REVIEW_TITLES = {
+    1: 'Disappointing', 2: 'Not great', 3: 'Okay', 4: 'Very good', 5: 'Excellent',
+}
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 14) Chrome/120.0 Mobile',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_0) Safari/605.1',
+]
+
+
+@contextlib.contextmanager
+def historical_timestamps(*models):
+    """Let bulk_create keep the given created_at/updated_at values"""
+    changed = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                changed.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in changed:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def zipf_cum_weights(count, exponent, rng):
+    """
+    Cumulative Zipf weights over ``count`` items in a shuffled order.
+
+    Returns ``(ranked, cum_weights)``: the item index at each popularity
+    rank and the running total of the rank weights.
+    """
+    ranked = list(range(count))
+    rng.shuffle(ranked)
+    cum_weights = list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+    return ranked, cum_weights
+
+
+def _customer_name(index):
+    return SPICES[index % len(SPICES)].title(), ADJECTIVES[index // len(SPICES) % len(ADJECTIVES)].title()
+
+
+def _ip_address(rng):
+    return f'41.{rng.randrange(184, 192)}.{rng.randrange(256)}.{rng.randrange(1, 255)}'
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def build_plan(users, products, orders, seed=1, days=365, end=None, zipf_exponent=1.1,
+               wholesale_share=0.1, reviews=None, activity=True, batch_size=5000,
+               block_size=10000):
+    """Describe a dataset; the plan is all a worker process needs to generate its blocks"""
+    end = end or datetime.now(dt_timezone.utc).replace(microsecond=0)
+
+    def next_id(model):
+        return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    return {
+        'users': users,
+        'products': products,
+        'orders': orders,
+        'reviews': orders // 20 if reviews is None else reviews,
+        'seed': seed,
+        'end': end,
+        'start': end - timedelta(days=days),
+        'zipf_exponent': zipf_exponent,
+        'wholesale_share': wholesale_share,
+        'activity': activity,
+        'batch_size': batch_size,
+        'block_size': block_size,
+        'first_user_id': next_id(User),
+        'first_product_id': next_id(Product),
+        'first_order_id': next_id(Order),
+    }
+
+
+def _catalog(plan):
+    """Prices and popularity of the generated products, derived from the seed"""
+    rng = random.Random(f'{plan["seed"]}:products')
+    prices = []
+    for _ in range(plan['products']):
+        retail = Decimal(rng.randrange(150, 8000)) / 100
+        prices.append((retail, (retail * Decimal('0.8')).quantize(Decimal('0.01'))))
+    ranked, cum_weights = zipf_cum_weights(plan['products'], plan['zipf_exponent'], rng)
+    return prices, ranked, cum_weights
+
+
+def _customers(plan):
+    """Distributor flags and ordering frequency of the generated users"""
+    rng = random.Random(f'{plan["seed"]}:users')
+    distributors = [rng.random() < plan['wholesale_share'] for _ in range(plan['users'])]
+    # Some customers order far more often than others
+    ranked, cum_weights = zipf_cum_weights(plan['users'], 0.6, rng)
+    return distributors, ranked, cum_weights
+
+
+def seed_catalog(plan):
+    rng = random.Random(f'{plan["seed"]}:catalog')
+    categories = [
+        Category.objects.get_or_create(
+            name=f'{spice.title()} Blends', defaults={'description': f'Everything {spice}'}
+        )[0]
+        for spice in SPICES
+    ]
+    for fields in SHIPPING_METHODS:
+        ShippingMethod.objects.get_or_create(name=fields['name'], defaults=fields)
+    prices, ranked, _ = _catalog(plan)
+    popularity = [0] * plan['products']
+    for rank, index in enumerate(ranked):
+        popularity[index] = rank
+    start = plan['start']
+    span = (plan['end'] - start).total_seconds()
+
+    def rows():
+        for index, (retail, wholesale) in enumerate(prices):
+            category = rng.choice(categories)
+            # Popular products are restocked more generously
+            stock = 0 if rng.random() < 0.03 else rng.randrange(
+                1, 200 if popularity[index] > plan['products'] // 10 else 2000
+            )
+            created = start + timedelta(seconds=rng.random() * span * 0.2)
+            yield Product(
+                id=plan['first_product_id'] + index,
+                name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(SPICES)} #{index + 1}',
+                description=f'{rng.choice(ADJECTIVES)} {rng.choice(SPICES)} '
+                            f'with {rng.choice(SPICES)} and {rng.choice(SPICES)}',
+                category=category,
+                price=retail,
+                retail_price=retail,
+                wholesale_price=wholesale,
+                stock=stock,
+                box_size=rng.choice([12, 24, 48]),
+                is_featured=popularity[index] < 20,
+                effective_reorder_threshold=(
+                    category.reorder_threshold
+                    if category.reorder_threshold is not None else DEFAULT_REORDER_THRESHOLD
+                ),
+                created_at=created,
+                updated_at=created,
+            )
+
+    with historical_timestamps(Product), transaction.atomic():
+        for chunk in _chunked(rows(), plan['batch_size']):
+            Product.objects.bulk_create(chunk)
+
+
+def seed_users(plan):
+    rng = random.Random(f'{plan["seed"]}:accounts')
+    distributors, _, _ = _customers(plan)
+    password = make_password(None)
+    first_id = plan['first_user_id']
+    start = plan['start']
+
+    def users():
+        for index in range(plan['users']):
+            first_name, last_name = _customer_name(index)
+            yield User(
+                id=first_id + index,
+                username=f'{CUSTOMER_PREFIX}{first_id + index:07d}',
+                email=f'customer{first_id + index}@example.com',
+                first_name=first_name,
+                last_name=last_name,
+                password=password,
+                date_joined=start - timedelta(seconds=rng.randrange(86400 * 365)),
+            )
+
+    def profiles():
+        for index in range(plan['users']):
+            yield UserProfile(
+                user_id=first_id + index,
+                user_type='distributor' if distributors[index] else 'customer',
+                city=rng.choice(CITIES),
+                company_name=f'{_customer_name(index)[1]} Traders' if distributors[index] else '',
+            )
+
+    def tokens():
+        for index in range(plan['users']):
+            yield Token(user_id=first_id + index, key=f'{rng.getrandbits(160):040x}')
+
+    with transaction.atomic():
+        for rows, model in ((users(), User), (profiles(), UserProfile), (tokens(), Token)):
+            for chunk in _chunked(rows, plan['batch_size']):
+                model.objects.bulk_create(chunk)
+        # Staff account used by `benchmark_api --url` for the staff scenarios
+        staff, created = User.objects.get_or_create(
+            username=STAFF_USERNAME,
+            defaults={'email': 'bench-staff@example.com', 'is_staff': True, 'password': password}
+        )
+        if created:
+            Token.objects.create(user=staff, key=f'{rng.getrandbits(160):040x}')
+
+
+class BlockGenerator:
+    """Builds the rows of one block of orders"""
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.prices, self.ranked_products, self.product_weights = _catalog(plan)
+        self.distributors, self.ranked_users, self.user_weights = _customers(plan)
+        self.span = (plan['end'] - plan['start']).total_seconds()
+
+    def product_indexes(self, rng, count):
+        chosen = []
+        while len(chosen) < count:
+            rank = bisect.bisect_left(self.product_weights, rng.random() * self.product_weights[-1])
+            index = self.ranked_products[min(rank, len(self.ranked_products) - 1)]
+            if index not in chosen:
+                chosen.append(index)
+        return chosen
+
+    def status(self, rng, age_days):
+        if age_days < 1:
+            return rng.choice(['pending', 'pending', 'processing'])
+        if age_days < 3:
+            return rng.choice(['processing', 'shipped', 'pending'])
+        if age_days < 7:
+            return rng.choice(['shipped', 'shipped', 'delivered'])
+        roll = rng.random()
+        if roll < 0.06:
+            return 'cancelled'
+        if roll < 0.08:
+            return 'refunded'
+        return 'delivered'
+
+    def build(self, block):
+        plan = self.plan
+        rng = random.Random(f'{plan["seed"]}:orders:{block}')
+        first = block * plan['block_size']
+        last = min(first + plan['block_size'], plan['orders'])
+        orders, items, payments, activities = [], [], [], []
+
+        for number in range(first, last):
+            order_id = plan['first_order_id'] + number
+            created = plan['start'] + timedelta(
+                seconds=(number + rng.random()) * self.span / plan['orders']
+            )
+            age_days = (plan['end'] - created).total_seconds() / 86400
+            rank = bisect.bisect_left(self.user_weights, rng.random() * self.user_weights[-1])
+            user_index = self.ranked_users[min(rank, len(self.ranked_users) - 1)]
+            user_id = plan['first_user_id'] + user_index
+            wholesale = self.distributors[user_index] and rng.random() < 0.8
+            status = self.status(rng, age_days)
+
+            subtotal = Decimal('0')
+            product_indexes = self.product_indexes(rng, min(plan['products'], rng.choice([1, 1, 2, 2, 3, 4, 5])))
+            for product_index in product_indexes:
+                retail, wholesale_price = self.prices[product_index]
+                if wholesale:
+                    boxes = rng.randint(1, 20)
+                    total = wholesale_price * boxes
+                    items.append(OrderItem(
+                        order_id=order_id, product_id=plan['first_product_id'] + product_index,
+                        quantity=boxes, unit_price=wholesale_price, total_price=total,
+                        is_wholesale=True, box_quantity=boxes,
+                    ))
+                else:
+                    quantity = rng.choice([1, 1, 1, 2, 2, 3, 5])
+                    total = retail * quantity
+                    items.append(OrderItem(
+                        order_id=order_id, product_id=plan['first_product_id'] + product_index,
+                        quantity=quantity, unit_price=retail, total_price=total,
+                    ))
+                subtotal += total
+
+            shipping_cost = Decimal('60.00') if wholesale else rng.choice([Decimal('5.00'), Decimal('15.00')])
+            tax_amount = (subtotal * Decimal('0.18')).quantize(Decimal('0.01'))
+            total_amount = subtotal + tax_amount + shipping_cost
+            paid = status in ('processing', 'shipped', 'delivered', 'refunded')
+            shipped_at = created + timedelta(days=rng.uniform(0.5, 2)) if status in ('shipped', 'delivered', 'refunded') else None
+            delivered_at = shipped_at + timedelta(days=rng.uniform(1, 5)) if shipped_at and status != 'shipped' else None
+            first_name, last_name = _customer_name(user_index)
+            payment_method = rng.choice(PAYMENT_METHODS) if paid else ''
+            transaction_id = f'TX{order_id:012d}' if paid else ''
+
+            orders.append(Order(
+                id=order_id,
+                order_number=f'SEED-{order_id:09d}',
+                user_id=user_id,
+                order_type='wholesale' if wholesale else 'retail',
+                status=status,
+                customer_name=f'{first_name} {last_name}',
+                customer_email=f'customer{user_id}@example.com',
+                customer_phone=f'+2507{rng.randrange(10 ** 8):08d}',
+                shipping_address=f'{rng.randrange(1, 900)} KG {rng.randrange(1, 700)} St',
+                shipping_city=rng.choice(CITIES),
+                shipping_state='Kigali',
+                subtotal=subtotal,
+                tax_amount=tax_amount,
+                shipping_cost=shipping_cost,
+                total_amount=total_amount,
+                payment_status='refunded' if status == 'refunded' else 'paid' if paid else 'pending',
+                payment_method=payment_method,
+                transaction_id=transaction_id,
+                tracking_number=f'TRK{order_id:010d}' if shipped_at else '',
+                shipping_carrier=rng.choice(['DHL', 'Moto Express', 'Post']) if shipped_at else '',
+                created_at=created,
+                updated_at=delivered_at or shipped_at or created,
+                shipped_at=shipped_at,
+                delivered_at=delivered_at,
+            ))
+            if paid or status == 'cancelled':
+                payments.append(Payment(
+                    order_id=order_id,
+                    amount=total_amount,
+                    payment_method=payment_method or rng.choice(PAYMENT_METHODS),
+                    transaction_id=transaction_id,
+                    status={'refunded': 'refunded', 'cancelled': 'failed'}.get(status, 'completed'),
+                    created_at=created + timedelta(minutes=rng.uniform(1, 30)),
+                    updated_at=created + timedelta(minutes=rng.uniform(30, 60)),
+                ))
+            if plan['activity']:
+                ip_address = _ip_address(rng)
+                user_agent = rng.choice(USER_AGENTS)
+                for offset, product_index in enumerate(product_indexes):
+                    product_id = plan['first_product_id'] + product_index
+                    activities.append(UserActivity(
+                        user_id=user_id,
+                        activity_type='GET products:product-detail',
+                        description=f'GET /api/products/api/products/{product_id}/ -> 200',
+                        ip_address=ip_address,
+                        user_agent=user_agent,
+                        created_at=created - timedelta(minutes=5 * (len(product_indexes) - offset)),
+                    ))
+                activities.append(UserActivity(
+                    user_id=user_id,
+                    activity_type='POST orders:order-list',
+                    description='POST /api/orders/api/orders/ -> 201',
+                    ip_address=ip_address,
+                    user_agent=user_agent,
+                    created_at=created,
+                ))
+        return orders, items, payments, activities
+
+
+def _insert(model, rows, batch_size, retries=20):
+    """bulk_create one transaction per batch, retrying while SQLite is locked"""
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        for attempt in range(retries):
+            try:
+                model.objects.bulk_create(batch)
+                break
+            except OperationalError as exc:
+                # SQLite allows one writer at a time; wait for other workers
+                if 'locked' not in str(exc) or attempt == retries - 1:
+                    raise
+                time.sleep(0.1 * (attempt + 1))
+
+
+def seed_order_block(block, generator):
+    """Generate and insert one block of orders; returns the rows inserted"""
+    batch_size = generator.plan['batch_size']
+    orders, items, payments, activities = generator.build(block)
+    # Short per-batch transactions let workers prepare rows in parallel and
+    # only take turns for the writes themselves
+    with historical_timestamps(Order, Payment, UserActivity):
+        for model, rows in ((Order, orders), (OrderItem, items),
+                            (Payment, payments), (UserActivity, activities)):
+            _insert(model, rows, batch_size)
+    return len(orders) + len(items) + len(payments) + len(activities)
+
+
+def seed_orders(plan, workers=1, progress=None):
+    """Insert every block of orders, in this process or in ``workers`` processes"""
+    blocks = range((plan['orders'] + plan['block_size'] - 1) // plan['block_size'])
+    if workers <= 1:
+        generator = BlockGenerator(plan)
+        results = (seed_order_block(block, generator) for block in blocks)
+        for done, rows in enumerate(results, 1):
+            if progress:
+                progress(done, len(blocks), rows)
+        return
+
+    from . import workers as pool
+
+    # Child processes open their own connections
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=pool.init_worker, initargs=(plan,)
+    ) as executor:
+        futures = [executor.submit(pool.seed_block, block) for block in blocks]
+        for done, future in enumerate(as_completed(futures), 1):
+            rows = future.result()
+            if progress:
+                progress(done, len(blocks), rows)
+
+
+def seed_reviews(plan):
+    """Reviews concentrated on popular products, then refresh product ratings"""
+    if not plan['reviews'] or not plan['users']:
+        return
+    rng = random.Random(f'{plan["seed"]}:reviews')
+    _, ranked, cum_weights = _catalog(plan)
+    span = (plan['end'] - plan['start']).total_seconds()
+    seen = set()
+    reviews = []
+    attempts = 0
+    target = min(plan['reviews'], plan['users'] * plan['products'])
+    while len(reviews) < target and attempts < target * 10:
+        attempts += 1
+        rank = bisect.bisect_left(cum_weights, rng.random() * cum_weights[-1])
+        product_id = plan['first_product_id'] + ranked[min(rank, len(ranked) - 1)]
+        user_id = plan['first_user_id'] + rng.randrange(plan['users'])
+        if (product_id, user_id) in seen:
+            continue
+        seen.add((product_id, user_id))
+        rating = rng.choices([1, 2, 3, 4, 5], [4, 5, 12, 35, 44])[0]
+        created = plan['start'] + timedelta(seconds=rng.random() * span)
+        reviews.append(ProductReview(
+            product_id=product_id,
+            user_id=user_id,
+            rating=rating,
+            title=REVIEW_TITLES[rating],
+            comment=f'{REVIEW_TITLES[rating]} {rng.choice(ADJECTIVES)} {rng.choice(SPICES)}.',
+            is_verified_purchase=rng.random() < 0.7,
+            created_at=created,
+            updated_at=created,
+        ))
+
+    reviews_of = ProductReview.objects.filter(product_id=OuterRef('pk')).order_by().values('product_id')
+    with historical_timestamps(ProductReview), transaction.atomic():
+        # ProductReview.save queues a rating refresh per review;
+        # bulk_create skips it, so ratings are recomputed below
+        ProductReview.objects.bulk_create(reviews, batch_size=plan['batch_size'])
+        Product.objects.filter(
+            id__gte=plan['first_product_id'], id__lt=plan['first_product_id'] + plan['products']
+        ).update(
+            rating=Coalesce(
+                Subquery(reviews_of.annotate(value=Avg('rating')).values('value')),
+                Value(0.0), output_field=FloatField()
+            ),
+            num_reviews=Coalesce(Subquery(reviews_of.annotate(value=Count('id')).values('value')), 0),
+        )
+
+
+def reset_sequences():
+    """Move primary key sequences past the explicitly assigned ids"""
+    statements = connection.ops.sequence_reset_sql(no_style(), [User, Product, Order])
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
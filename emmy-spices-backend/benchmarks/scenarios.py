@@ -0,0 +1,118 @@
+"""
+Benchmark scenarios.
+
+Each scenario builds one request from a seeded ``random.Random`` and the
+dataset returned by ``benchmarks.seed.load_dataset``. A request is a dict
+with ``method``, ``path``, ``role`` ('anon', 'customer' or 'staff'),
+an optional JSON ``body`` and, for customer requests, the ``token`` to use.
+"""
+from .seed import SPICES
+
+
+def catalog_list(rng, data):
+    """Browse the first pages of the product catalog"""
+    return {
+        'method': 'GET',
+        'path': f'/api/products/api/products/?page={rng.randint(1, 3)}',
+        'role': 'anon',
+    }
+
+
+def catalog_detail(rng, data):
+    """Open a product page"""
+    return {
+        'method': 'GET',
+        'path': f'/api/products/api/products/{rng.choice(data["product_ids"])}/',
+        'role': 'anon',
+    }
+
+
+def category_products(rng, data):
+    """List the products of a category"""
+    return {
+        'method': 'GET',
+        'path': f'/api/products/api/categories/{rng.choice(data["category_ids"])}/products/',
+        'role': 'anon',
+    }
+
+
+def search(rng, data):
+    """Full-text product search with an in-stock filter"""
+    return {
+        'method': 'POST',
+        'path': '/api/products/api/products/search/',
+        'role': 'customer',
+        'token': rng.choice(data['customer_tokens']),
+        'body': {'query': rng.choice(SPICES), 'in_stock': True, 'sort_by': 'price'},
+    }
+
+
+def checkout(rng, data):
+    """Place a retail order through OrderCreateSerializer"""
+    product_ids = data['in_stock_product_ids']
+    items = [
+        {'product_id': product_id, 'quantity': rng.randint(1, 3)}
+        for product_id in rng.sample(product_ids, min(len(product_ids), rng.randint(1, 4)))
+    ]
+    return {
+        'method': 'POST',
+        'path': '/api/orders/api/orders/',
+        'role': 'customer',
+        'token': rng.choice(data['customer_tokens']),
+        'body': {
+            'order_type': 'retail',
+            'customer_name': 'Benchmark Customer',
+            'customer_email': 'customer@example.com',
+            'shipping_address': '1 KG Ave',
+            'shipping_city': 'Kigali',
+            'shipping_state': 'Kigali',
+            'shipping_method_id': rng.choice(data['shipping_method_ids']),
+            'items': items,
+        },
+    }
+
+
+def order_history(rng, data):
+    """A customer's order list"""
+    token, _ = rng.choice(data['customer_orders'])
+    return {
+        'method': 'GET',
+        'path': '/api/orders/api/orders/',
+        'role': 'customer',
+        'token': token,
+    }
+
+
+def order_detail(rng, data):
+    """A customer opening one of their orders"""
+    token, order_id = rng.choice(data['customer_orders'])
+    return {
+        'method': 'GET',
+        'path': f'/api/orders/api/orders/{order_id}/',
+        'role': 'customer',
+        'token': token,
+    }
+
+
+def order_statistics(rng, data):
+    """Staff order statistics over all orders"""
+    return {'method': 'GET', 'path': '/api/orders/api/orders/statistics/', 'role': 'staff'}
+
+
+def sales_summary(rng, data):
+    """Staff sales dashboard summary"""
+    return {'method': 'GET', 'path': '/api/analytics/api/sales/summary/', 'role': 'staff'}
+
+
+def inventory_alerts(rng, data):
+    """Staff low-stock and out-of-stock alerts"""
+    return {'method': 'GET', 'path': '/api/analytics/api/inventory/alerts/', 'role': 'staff'}
+
+
+SCENARIOS = {
+    scenario.__name__: scenario
+    for scenario in [
+        catalog_list, catalog_detail, category_products, search, checkout,
+        order_history, order_detail, order_statistics, sales_summary, inventory_alerts,
+    ]
+}
@@ -0,0 +1,227 @@
+"""
+Deterministic benchmark dataset.
+
+``seed_dataset`` fills the database with a catalog, customers with API
+tokens, a staff user, shipping methods, historical orders and daily sales
+analytics. Everything is derived from a random seed, so the same arguments
+always produce the same data.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from analytics.models import SalesAnalytics
+from orders.models import Order, OrderItem, ShippingMethod
+from products.models import DEFAULT_REORDER_THRESHOLD, Category, Product
+from users.models import UserProfile
+
+
+STAFF_USERNAME = 'bench-staff'
+CUSTOMER_PREFIX = 'bench-customer-'
+ORDER_PREFIX = 'BENCH-'
+
+SPICES = [
+    'pepper', 'cumin', 'turmeric', 'ginger', 'cinnamon', 'cardamom', 'clove',
+    'nutmeg', 'paprika', 'chili', 'coriander', 'fennel', 'saffron', 'masala',
+    'curry', 'garlic', 'vanilla', 'mustard', 'thyme', 'rosemary',
+]
+ADJECTIVES = [
+    'smoked', 'ground', 'whole', 'organic', 'roasted', 'wild', 'sweet', 'hot',
+    'fine', 'coarse', 'dried', 'fresh',
+]
+CITIES = ['Kigali', 'Butare', 'Gisenyi', 'Ruhengeri', 'Kibuye', 'Nyagatare']
+SHIPPING_METHODS = [
+    {'name': 'Standard', 'cost': Decimal('5.00'), 'estimated_days': 5},
+    {'name': 'Express', 'cost': Decimal('15.00'), 'estimated_days': 1},
+    {'name': 'Freight', 'cost': Decimal('60.00'), 'estimated_days': 7, 'is_wholesale_only': True},
+]
+STATUS_WEIGHTS = {
+    'delivered': 55, 'shipped': 15, 'processing': 10, 'pending': 12,
+    'cancelled': 6, 'refunded': 2,
+}
+
+
+def _token_key(rng):
+    return f'{rng.getrandbits(160):040x}'
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def seed_dataset(users=200, products=500, orders=2000, seed=1, batch_size=1000, history_days=90):
+    """Create the benchmark dataset and return it as loaded by ``load_dataset``"""
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password(None)
+
+    with transaction.atomic():
+        categories = Category.objects.bulk_create([
+            Category(name=f'{spice.title()} Blends', description=f'Everything {spice}')
+            for spice in SPICES[:max(1, min(len(SPICES), products // 25 or 1))]
+        ])
+
+        catalog = []
+        for index in range(products):
+            category = rng.choice(categories)
+            retail_price = Decimal(rng.randrange(200, 5000)) / 100
+            catalog.append(Product(
+                name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(SPICES)} #{index + 1}',
+                description=f'{rng.choice(ADJECTIVES)} {rng.choice(SPICES)} '
+                            f'with {rng.choice(SPICES)} and {rng.choice(SPICES)}',
+                category=category,
+                price=retail_price,
+                retail_price=retail_price,
+                wholesale_price=(retail_price * Decimal('0.8')).quantize(Decimal('0.01')),
+                stock=rng.choice([0, rng.randrange(1, 60), rng.randrange(60, 1000)]),
+                is_featured=rng.random() < 0.05,
+                effective_reorder_threshold=(
+                    category.reorder_threshold
+                    if category.reorder_threshold is not None else DEFAULT_REORDER_THRESHOLD
+                ),
+            ))
+        catalog = Product.objects.bulk_create(catalog, batch_size=batch_size)
+
+        staff = User.objects.create_user(
+            STAFF_USERNAME, email='bench-staff@example.com', is_staff=True,
+            date_joined=now - timedelta(days=730)
+        )
+        Token.objects.create(user=staff, key=_token_key(rng))
+
+        customers = User.objects.bulk_create([
+            User(
+                username=f'{CUSTOMER_PREFIX}{index + 1:06d}',
+                email=f'customer{index + 1}@example.com',
+                first_name=rng.choice(SPICES).title(),
+                last_name=rng.choice(ADJECTIVES).title(),
+                password=password,
+                # Joined before the order history starts, so no day counts
+                # customers as both new and returning
+                date_joined=now - timedelta(days=history_days + rng.randrange(1, 365)),
+            )
+            for index in range(users)
+        ], batch_size=batch_size)
+        # bulk_create skips the post_save signal that creates profiles
+        wholesale = {customer.pk for customer in customers if rng.random() < 0.15}
+        UserProfile.objects.bulk_create([
+            UserProfile(
+                user=customer,
+                user_type='distributor' if customer.pk in wholesale else 'customer',
+                city=rng.choice(CITIES),
+            )
+            for customer in customers
+        ], batch_size=batch_size)
+        Token.objects.bulk_create(
+            [Token(user=customer, key=_token_key(rng)) for customer in customers],
+            batch_size=batch_size
+        )
+
+        ShippingMethod.objects.bulk_create([ShippingMethod(**fields) for fields in SHIPPING_METHODS])
+
+        statuses = list(STATUS_WEIGHTS)
+        weights = list(STATUS_WEIGHTS.values())
+        order_rows = []
+        item_rows = []
+        placed_days = []
+        for index in range(orders):
+            customer = rng.choice(customers) if customers else staff
+            order_type = 'wholesale' if customer.pk in wholesale else 'retail'
+            status = rng.choices(statuses, weights)[0]
+            items = []
+            subtotal = Decimal('0')
+            for product in rng.sample(catalog, min(len(catalog), rng.randint(1, 4))):
+                quantity = rng.randint(1, 10 if order_type == 'wholesale' else 3)
+                unit_price = (
+                    product.wholesale_price if order_type == 'wholesale' else product.retail_price
+                )
+                total_price = unit_price * quantity
+                subtotal += total_price
+                items.append(OrderItem(
+                    product=product,
+                    quantity=quantity,
+                    unit_price=unit_price,
+                    total_price=total_price,
+                    is_wholesale=order_type == 'wholesale',
+                    box_quantity=quantity if order_type == 'wholesale' else 0,
+                ))
+            shipping_cost = Decimal('5.00')
+            order_rows.append(Order(
+                order_number=f'{ORDER_PREFIX}{index + 1:08d}',
+                user=customer,
+                order_type=order_type,
+                status=status,
+                customer_name=f'{customer.first_name} {customer.last_name}',
+                customer_email=customer.email,
+                shipping_address=f'{rng.randrange(1, 500)} KG Ave',
+                shipping_city=rng.choice(CITIES),
+                shipping_state='Kigali',
+                subtotal=subtotal,
+                shipping_cost=shipping_cost,
+                total_amount=subtotal + shipping_cost,
+                payment_status='paid' if status in ('shipped', 'delivered') else 'pending',
+            ))
+            item_rows.append(items)
+            placed_days.append(rng.randrange(history_days))
+
+        order_rows = Order.objects.bulk_create(order_rows, batch_size=batch_size)
+        for order, items in zip(order_rows, item_rows):
+            for item in items:
+                item.order = order
+        OrderItem.objects.bulk_create(
+            [item for items in item_rows for item in items], batch_size=batch_size
+        )
+
+        # created_at is auto_now_add, so spread the history afterwards, one
+        # UPDATE per day
+        by_day = {}
+        for order, day in zip(order_rows, placed_days):
+            by_day.setdefault(day, []).append(order.pk)
+        for day, order_ids in by_day.items():
+            for chunk in _chunks(order_ids, batch_size):
+                Order.objects.filter(pk__in=chunk).update(created_at=now - timedelta(days=day))
+
+        for day in range(min(history_days, 30)):
+            SalesAnalytics.get_or_create_for_date((now - timedelta(days=day)).date())
+
+    return load_dataset()
+
+
+def load_dataset(sample_size=500):
+    """Ids and tokens of a previously seeded dataset, for building requests"""
+    staff_token = Token.objects.filter(user__username=STAFF_USERNAME).values_list(
+        'key', flat=True
+    ).first()
+    if staff_token is None:
+        return None
+    customer_tokens = list(
+        Token.objects.filter(user__username__startswith=CUSTOMER_PREFIX)
+        .order_by('user_id').values_list('key', flat=True)[:sample_size]
+    )
+    customer_orders = list(
+        Order.objects.filter(user__username__startswith=CUSTOMER_PREFIX)
+        .order_by('id').values_list('user__auth_token__key', 'id')[:sample_size]
+    )
+    return {
+        'staff_token': staff_token,
+        'customer_tokens': customer_tokens,
+        'customer_orders': customer_orders,
+        'product_ids': list(
+            Product.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)
+        ),
+        'in_stock_product_ids': list(
+            # Checkouts reserve stock, so leave room for a few hundred of them
+            Product.objects.filter(is_active=True, stock__gte=100)
+            .order_by('id').values_list('id', flat=True)
+        ),
+        'category_ids': list(Category.objects.order_by('id').values_list('id', flat=True)),
+        'shipping_method_ids': list(
+            ShippingMethod.objects.filter(is_wholesale_only=False).values_list('id', flat=True)
+        ),
+    }
@@ -0,0 +1,21 @@
+"""
+Process pool entry points for ``benchmarks.scale``.
+
+Spawned workers import this module before Django is set up, so it must not
+import models at module level.
+"""
+_generator = None
+
+
+def init_worker(plan):
+    global _generator
+    import django
+    django.setup()
+
+    from .scale import BlockGenerator
+    _generator = BlockGenerator(plan)
+
+
+def seed_block(block):
+    from .scale import seed_order_block
+    return seed_order_block(block, _generator)
@@ -0,0 +1,165 @@
+"""
+Async variants of read-only DRF endpoints.
+
+DRF 3.14 views are synchronous: under ASGI, Django runs each of them on a
+thread of its own, with its own database connection, so every request in
+progress costs a thread. ``async_api_view`` serves a read-only action of an
+existing viewset from an async function instead, querying through Django's
+async ORM. Django still gives each request a thread for its queries, created
+at the first one, so at most ``ASYNC_API_CONCURRENCY`` requests per process
+run at once; the others wait on the event loop without holding a thread or a
+connection, and thousands of keep-alive clients do not turn into thousands of
+threads contending for the CPU and the database.
+
+The variants behave like the viewset action they mirror: the same session
+and token authentication, permissions, token-bucket throttling, filters,
+pagination, serializers and error bodies. The viewset instance is only used
+to build querysets and serializers, never dispatched.
+"""
+import asyncio
+import weakref
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.paginator import InvalidPage, Page
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_safe
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from users.authentication import CachedTokenAuthentication
+from .throttling import InMemoryBucketStore, get_bucket_store
+
+
+async def aauthenticate(request):
+    """The ``(user, auth)`` DRF would find: the session user, else the API token"""
+    user = await request.auser()
+    if user.is_authenticated and user.is_active:
+        return user, None
+    credentials = await CachedTokenAuthentication().aauthenticate(request)
+    if credentials is not None:
+        return credentials
+    return AnonymousUser(), None
+
+
+def viewset_for(viewset_class, request, action, **kwargs):
+    """A ``viewset_class`` instance set up for ``action`` without dispatching it"""
+    drf_request = Request(request)
+    # Already authenticated; setting them keeps DRF from authenticating again
+    drf_request.user = request.user
+    drf_request.auth = request.auth
+    return viewset_class(
+        request=drf_request, action=action, args=(), kwargs=kwargs, format_kwarg=None
+    )
+
+
+def check_permissions(view):
+    for permission in view.get_permissions():
+        if not permission.has_permission(view.request, view):
+            if not view.request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+
+
+async def acheck_throttles(view):
+    # The in-memory buckets never block; other stores may do network I/O
+    if isinstance(get_bucket_store(), InMemoryBucketStore):
+        view.check_throttles(view.request)
+    else:
+        await sync_to_async(view.check_throttles)(view.request)
+
+
+async def afilter_queryset(view, queryset):
+    """``view.filter_queryset``, on a worker thread only if a filter needs the database"""
+    # django-filter checks model choices such as ?category= against the
+    # database; searching and ordering only build the query
+    params = view.request.query_params
+    if any(field in params for field in getattr(view, 'filterset_fields', ())):
+        return await sync_to_async(view.filter_queryset)(queryset)
+    return view.filter_queryset(queryset)
+
+
+async def apaginate(view, queryset):
+    """The paginated data ``view.list`` would return, counted and fetched with the async ORM"""
+    pagination = view.paginator
+    pagination.request = view.request
+    page_size = pagination.get_page_size(view.request)
+    paginator = pagination.django_paginator_class(queryset, page_size)
+    paginator.count = await queryset.acount()
+    page_number = pagination.get_page_number(view.request, paginator)
+    try:
+        number = paginator.validate_number(page_number)
+    except InvalidPage as exc:
+        raise exceptions.NotFound(
+            pagination.invalid_page_message.format(page_number=page_number, message=str(exc))
+        )
+    bottom = (number - 1) * page_size
+    items = [item async for item in queryset[bottom:bottom + page_size]]
+    pagination.page = Page(items, number, paginator)
+    return pagination.get_paginated_response(view.get_serializer(items, many=True).data).data
+
+
+# Event loop -> semaphore admitting ASYNC_API_CONCURRENCY requests
+_slots = weakref.WeakKeyDictionary()
+
+
+def request_slots():
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(getattr(settings, 'ASYNC_API_CONCURRENCY', 32))
+    return slots
+
+
+def _render(data, status=200, headers=None):
+    return HttpResponse(
+        api_settings.DEFAULT_RENDERER_CLASSES[0]().render(data), status=status, headers=headers,
+        content_type='application/json'
+    )
+
+
+def _error_response(exc):
+    # As rest_framework.views.exception_handler; the session authenticator
+    # comes first, so authentication failures are 403s as in the viewsets
+    headers = {}
+    if getattr(exc, 'wait', None):
+        headers['Retry-After'] = '%d' % exc.wait
+    status = exc.status_code
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        status = 403
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return _render(data, status, headers)
+
+
+def async_api_view(viewset_class, action):
+    """
+    Serve ``viewset_class``'s ``action`` from an async function.
+
+    The function is called with the request, the viewset instance and the
+    URL kwargs, after authentication, permissions and throttling, and
+    returns the data to render.
+    """
+    def decorator(func):
+        @require_safe
+        @wraps(func)
+        async def view(request, **kwargs):
+            async with request_slots():
+                try:
+                    request.user, request.auth = await aauthenticate(request)
+                    viewset = viewset_for(viewset_class, request, action, **kwargs)
+                    check_permissions(viewset)
+                    await acheck_throttles(viewset)
+                    data = await func(request, viewset, **kwargs)
+                except exceptions.APIException as exc:
+                    return _error_response(exc)
+                except Http404 as exc:
+                    # DRF's own handler words the body, which differs by version
+                    response = exception_handler(exc, {})
+                    return _render(response.data, response.status_code)
+                return _render(data)
+        return view
+    return decorator
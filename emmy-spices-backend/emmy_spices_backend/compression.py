@@ -0,0 +1,213 @@
+"""
+Response compression.
+
+``CompressionMiddleware`` compresses JSON and other text responses of at
+least ``COMPRESSION_MIN_SIZE`` bytes with brotli, when the optional Brotli
+package is installed and the client accepts it, or else with gzip. HTML is
+left alone, as its CSRF tokens would be open to BREACH. Streaming responses
+are compressed chunk by chunk and flushed as they go, so exports start
+arriving at once; event streams are never compressed.
+
+Catalog payloads are the same for every client until the data changes, so
+the compressed bodies of responses under ``COMPRESSION_CACHE_PATHS`` are
+kept in a per-process LRU keyed by a digest of the uncompressed body:
+hashing costs a fraction of compressing, and a repeated payload is sent
+from the cache.
+"""
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types worth compressing; anything else (images, archives) is not
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/javascript', 'application/xml',
+    'image/svg+xml', 'text/csv', 'text/css', 'text/javascript', 'text/plain',
+)
+
+
+def accepted_encodings(header):
+    """The codings of an Accept-Encoding header the client accepts, by name"""
+    accepted = set()
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if name and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def compress(data, encoding, level):
+    """``data`` compressed with ``encoding``"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    # A gzip stream without a timestamp, so equal bodies give equal bytes
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class _StreamCompressor:
+    """Compress a stream chunk by chunk, flushing each so the client gets it at once"""
+
+    def __init__(self, encoding, level):
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=level)
+            self.process = self.compressor.process
+            self.flush = self.compressor.flush
+            self.finish = self.compressor.finish
+        else:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.process = self.compressor.compress
+            self.flush = lambda: self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self.compressor.flush
+
+    def chunk(self, data):
+        return self.process(data) + self.flush()
+
+
+class CompressedBodyCache:
+    """Compressed bodies by encoding and digest of the body, least recently used first out"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compress(self, body, encoding, level):
+        key = (encoding, level, hashlib.blake2b(body, digest_size=16).digest())
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+        compressed = compress(body, encoding, level)
+        if len(compressed) > self.max_bytes:
+            return compressed
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = compressed
+                self.size += len(compressed)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+        return compressed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = self.hits = self.misses = 0
+
+
+body_cache = CompressedBodyCache(getattr(settings, 'COMPRESSION_CACHE_SIZE', 32 * 1024 * 1024))
+
+
+class CompressionMiddleware:
+    """Compress responses with brotli or gzip, reusing compressed catalog bodies"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        self.levels = {
+            'br': getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5),
+            'gzip': getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6),
+        }
+        self.cache_paths = tuple(getattr(settings, 'COMPRESSION_CACHE_PATHS', ()))
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def choose_encoding(self, request, response):
+        """The coding to compress ``response`` with, or None to send it as it is"""
+        if response.has_header('Content-Encoding') or response.status_code == 206:
+            return None
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in COMPRESSIBLE_TYPES:
+            return None
+        if not response.streaming and len(response.content) < self.min_size:
+            return None
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        if brotli is not None and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+        return None
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '')
+        if content_type.startswith('text/event-stream'):
+            return response
+        # The body depends on Accept-Encoding whenever it could be compressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request, response)
+        if encoding is None:
+            return response
+        level = self.levels[encoding]
+
+        if response.streaming:
+            stream = _StreamCompressor(encoding, level)
+            if response.is_async:
+                response.streaming_content = self.compress_async(stream, response.streaming_content)
+            else:
+                response.streaming_content = self.compress_sync(stream, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            body = response.content
+            if request.method == 'GET' and request.path.startswith(self.cache_paths):
+                compressed = body_cache.get_or_compress(body, encoding, level)
+            else:
+                compressed = compress(body, encoding, level)
+            if len(compressed) >= len(body):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The compressed body is no longer byte for byte what a strong ETag named
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def compress_sync(stream, content):
+        for chunk in content:
+            if chunk:
+                yield stream.chunk(chunk)
+        yield stream.finish()
+
+    @staticmethod
+    async def compress_async(stream, content):
+        async for chunk in content:
+            if chunk:
+                yield stream.chunk(chunk)
+        yield stream.finish()
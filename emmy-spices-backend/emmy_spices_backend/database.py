@@ -0,0 +1,142 @@
+"""
+Database profiles.
+
+``DATABASE_PROFILE`` selects how the default database is configured:
+
+- ``sqlite`` (default): the project's SQLite file, tuned for a threaded
+  server. Every new connection gets the ``SQLITE_PRAGMAS`` setting (WAL
+  journal, ``synchronous=NORMAL``, busy timeout, memory-mapped I/O) from the
+  ``connection_created`` hook below, and write transactions start with
+  ``BEGIN IMMEDIATE`` so concurrent writers queue on the busy timeout instead
+  of failing with "database is locked" when a read lock cannot be upgraded.
+- ``postgres``: PostgreSQL through psycopg 3, configured from ``DATABASE_URL``
+  or ``DATABASE_NAME``/``DATABASE_USER``/... With ``DATABASE_POOL`` on (the
+  default) each process keeps a psycopg connection pool; with it off,
+  connections persist for ``DATABASE_CONN_MAX_AGE`` seconds instead. Set
+  ``DATABASE_POOL=off`` behind PgBouncer, which does the pooling itself.
+
+A ``DATABASE_URL`` starting with ``postgres`` selects the postgres profile
+without setting ``DATABASE_PROFILE``.
+
+The same variables prefixed with ``DATABASE_REPLICA_`` (at least
+``DATABASE_REPLICA_URL`` or ``DATABASE_REPLICA_NAME``) add a ``replica``
+database for ``emmy_spices_backend.replicas.PrimaryReplicaRouter``. Tests
+mirror it to ``default``.
+"""
+import os
+import tempfile
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+PROFILES = ('sqlite', 'postgres')
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+}
+
+
+def _flag(value):
+    return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+
+def _postgres_from_url(url):
+    parts = urlsplit(url)
+    return {
+        'NAME': unquote(parts.path.lstrip('/')),
+        'USER': unquote(parts.username or ''),
+        'PASSWORD': unquote(parts.password or ''),
+        'HOST': parts.hostname or '',
+        'PORT': str(parts.port or ''),
+    }
+
+
+def database_config(base_dir, environ=os.environ, prefix='DATABASE'):
+    """Build a ``DATABASES`` entry from the variables starting with ``prefix``"""
+    environ = {
+        'DATABASE' + name[len(prefix):]: value
+        for name, value in environ.items() if name.startswith(prefix + '_')
+    }
+    url = environ.get('DATABASE_URL', '')
+    profile = environ.get('DATABASE_PROFILE') or (
+        'postgres' if url.startswith(('postgres://', 'postgresql://')) else 'sqlite'
+    )
+    if profile not in PROFILES:
+        raise ImproperlyConfigured(
+            f'DATABASE_PROFILE must be one of {", ".join(PROFILES)}, not {profile!r}'
+        )
+    conn_max_age = int(environ.get('DATABASE_CONN_MAX_AGE', 600))
+
+    if profile == 'sqlite':
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': environ.get('DATABASE_NAME') or base_dir / 'db.sqlite3',
+            'CONN_MAX_AGE': conn_max_age,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+            # A file rather than the default in-memory database, whose shared
+            # cache fails concurrent writers instead of queueing them. Named
+            # per process: background writer threads can leave a WAL file
+            # behind, which must not be replayed into the next test database.
+            'TEST': {
+                'NAME': environ.get('DATABASE_TEST_NAME') or os.path.join(
+                    tempfile.gettempdir(), f'emmy_spices_test_{os.getpid()}.sqlite3'
+                ),
+            },
+        }
+
+    config = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('DATABASE_NAME', 'emmy_spices'),
+        'USER': environ.get('DATABASE_USER', ''),
+        'PASSWORD': environ.get('DATABASE_PASSWORD', ''),
+        'HOST': environ.get('DATABASE_HOST', ''),
+        'PORT': environ.get('DATABASE_PORT', ''),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if url:
+        config.update(_postgres_from_url(url))
+    if _flag(environ.get('DATABASE_POOL', 'on')):
+        # Pooled connections are returned to the pool after each request;
+        # Django refuses CONN_MAX_AGE together with a pool
+        config['CONN_MAX_AGE'] = 0
+        config['OPTIONS']['pool'] = {
+            'min_size': int(environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+            'timeout': int(environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        }
+    else:
+        config['CONN_MAX_AGE'] = conn_max_age
+        # Transaction-mode PgBouncer cannot keep server-side cursors open
+        config['DISABLE_SERVER_SIDE_CURSORS'] = True
+    return config
+
+
+def databases(base_dir, environ=os.environ):
+    """The ``DATABASES`` setting: ``default`` and, if configured, ``replica``"""
+    config = {'default': database_config(base_dir, environ)}
+    if environ.get('DATABASE_REPLICA_URL') or environ.get('DATABASE_REPLICA_NAME'):
+        replica = database_config(base_dir, environ, prefix='DATABASE_REPLICA')
+        replica['TEST'] = {'MIRROR': 'default'}
+        config['replica'] = replica
+    return config
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Tune every new SQLite connection with the SQLITE_PRAGMAS setting"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+    for name, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
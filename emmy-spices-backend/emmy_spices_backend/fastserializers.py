@@ -0,0 +1,208 @@
+"""
+Compiled list serializers.
+
+A ModelSerializer builds every row field by field: it loads model instances
+with all their columns, then for each field walks the source attributes,
+checks for None and calls ``to_representation``. On the 20-100 row product
+and order lists that is most of the request's CPU time.
+
+A ``FastListSerializer`` mirrors one of those serializers. Its fields are
+compiled once into ``(key, column, getter, converter)`` steps, and rows are
+built straight from ``.values()`` of just the columns needed, following
+relations with joins. Fields the database returns ready to use (text,
+numbers, booleans) are copied as they are; decimals, dates and the like go
+through the DRF field's own ``to_representation``, and fields backed by
+model properties or methods call them on the row, so no formatting or
+business logic is duplicated. The output is identical to the serializer's
+(see the parity tests). A field the compiler does not understand raises
+ImproperlyConfigured on first use rather than being served differently.
+"""
+import inspect
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .fieldsets import FieldSelection, SparseFieldsetViewMixin
+from .images import ImageVariantsField, variant_urls
+from .metrics import serializer_timing
+
+
+# Representation equal to the database value
+_AS_IS_FIELDS = (serializers.CharField, serializers.BooleanField, serializers.IntegerField)
+
+
+def _model_column(model, source):
+    """The values() lookup and model field of a dotted ``source``, or (None, None)"""
+    parts = source.split('.')
+    for index, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None, None
+        if index == len(parts) - 1:
+            return (None, None) if field.is_relation else ('__'.join(parts), field)
+        # A null relation would make DRF skip the field instead
+        if not (field.many_to_one or field.one_to_one) or field.null:
+            return None, None
+        model = field.related_model
+    return None, None
+
+
+def compile_steps(serializer_class, annotations):
+    """One ``(key, column, getter, field, model field, columns)`` step per readable field"""
+    model = serializer_class.Meta.model
+    dependencies = getattr(serializer_class, 'field_dependencies', {})
+    steps = []
+    for key, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        if field.source in annotations:
+            column, model_field, fget = field.source, None, None
+        else:
+            column, model_field = _model_column(model, field.source)
+            fget = None
+            if column is None:
+                attribute = getattr(model, field.source, None)
+                if isinstance(attribute, property):
+                    fget = attribute.fget
+                elif inspect.isfunction(attribute):
+                    # A method DRF would call without arguments
+                    fget = attribute
+                else:
+                    raise ImproperlyConfigured(
+                        f'{serializer_class.__name__}.{key}: cannot compile source '
+                        f'{field.source!r}; use a column, a property, a method or an annotation'
+                    )
+        # Properties and methods read the columns declared in field_dependencies
+        columns = [column] if column is not None else list(dependencies.get(key, ()))
+        steps.append((key, column, fget, field, model_field, columns))
+    return steps
+
+
+class FastListSerializer:
+    """Build the output of ``serializer_class`` for many rows from ``.values()``"""
+
+    serializer_class = None
+    # Query expressions for properties that would run queries, by source
+    annotations = {}
+
+    @classmethod
+    def compiled(cls):
+        if '_compiled' not in cls.__dict__:
+            cls._compiled = compile_steps(cls.serializer_class, cls.annotations)
+        return cls._compiled
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        steps = self.compiled()
+        # The fields of ?fields= and ?exclude=
+        selected = set(FieldSelection.from_request(self.context.get('request')).select(
+            [step[0] for step in steps],
+            getattr(self.serializer_class, 'expandable_fields', {}),
+        ))
+        steps = [step for step in steps if step[0] in selected]
+        self.columns = list(dict.fromkeys(
+            column for *_, columns in steps for column in columns
+        ))
+        self.steps = [
+            (key, column, fget, self.converter(field, model_field))
+            for key, column, fget, field, model_field, _ in steps
+        ]
+        self.needs_object = any(fget is not None for _, _, fget, _ in self.steps)
+
+    def converter(self, field, model_field):
+        """The function giving the field's representation of a value, None for the value itself"""
+        if isinstance(field, serializers.FileField):
+            return self.file_converter(field, model_field)
+        if isinstance(field, ImageVariantsField):
+            request = self.context.get('request')
+            return lambda value: variant_urls(value, request)
+        if isinstance(field, _AS_IS_FIELDS):
+            return None
+        if isinstance(field, serializers.ChoiceField) and all(
+            isinstance(choice, str) for choice in field.choices
+        ):
+            return None
+        return field.to_representation
+
+    def file_converter(self, field, model_field):
+        # As FileField.to_representation, from the stored name
+        if not getattr(field, 'use_url', True):
+            return None
+        storage = model_field.storage
+        request = self.context.get('request')
+
+        def file_url(name):
+            if not name:
+                return None
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return file_url
+
+    def values(self, queryset):
+        """``queryset`` as rows of the columns the serializer needs"""
+        annotations = {
+            column: expression for column, expression in self.annotations.items()
+            if column in self.columns
+        }
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+        return queryset.values(*self.columns)
+
+    def to_representation(self, rows):
+        """The serializer's data for ``rows`` from ``values()``"""
+        data = []
+        steps = self.steps
+        needs_object = self.needs_object
+        with serializer_timing():
+            for row in rows:
+                obj = SimpleNamespace(**row) if needs_object else None
+                item = {}
+                for key, column, fget, convert in steps:
+                    value = fget(obj) if fget is not None else row[column]
+                    if value is not None and convert is not None:
+                        value = convert(value)
+                    item[key] = value
+                data.append(item)
+        return data
+
+
+class FastListMixin(SparseFieldsetViewMixin):
+    """Serialize lists with ``fast_list_serializer_class`` where the action uses the serializer it mirrors"""
+
+    fast_list_serializer_class = None
+
+    def get_fast_list_serializer(self):
+        fast = self.fast_list_serializer_class
+        if fast is None or self.get_serializer_class() is not fast.serializer_class:
+            return None
+        # Nested fields need the serializer
+        expandable = getattr(fast.serializer_class, 'expandable_fields', {})
+        if FieldSelection.from_request(self.request).expanded(expandable):
+            return None
+        return fast(context=self.get_serializer_context())
+
+    def project_queryset(self, queryset):
+        # The fast serializer selects its own columns
+        if self.get_fast_list_serializer() is not None:
+            return queryset
+        return super().project_queryset(queryset)
+
+    def list_data(self, queryset):
+        """The serialized data of ``queryset``, unpaginated"""
+        fast = self.get_fast_list_serializer()
+        if fast is None:
+            return self.get_serializer(self.project_queryset(queryset), many=True).data
+        return fast.to_representation(fast.values(queryset))
+
+    def list(self, request, *args, **kwargs):
+        fast = self.get_fast_list_serializer()
+        if fast is None:
+            return super().list(request, *args, **kwargs)
+        rows = fast.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(fast.to_representation(page))
+        return Response(fast.to_representation(rows))
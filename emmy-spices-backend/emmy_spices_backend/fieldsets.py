@@ -0,0 +1,220 @@
+"""
+Sparse fieldsets.
+
+Read endpoints take comma-separated field names in ``?fields=`` (keep only
+these), ``?exclude=`` (drop these) and ``?expand=`` (add fields that are
+left out by default). Dotted names reach into nested serializers, as in
+``?fields=id,status,items.quantity,items.product.name``.
+
+Serializers opt in with ``SparseFieldsetMixin``, which also declares what
+their computed fields read. Views with ``SparseFieldsetViewMixin`` then
+trim the query to match: only the columns the selected fields need are
+loaded, and only the relations they read are prefetched. Without any of the
+parameters, responses and queries are unchanged.
+"""
+import copy
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+PARAMS = ('fields', 'exclude', 'expand')
+
+
+def _parse(value):
+    """``a,b.c,b.d`` as ``{'a': {}, 'b': {'c': {}, 'd': {}}}``"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class FieldSelection:
+    """The fields requested for one level of a response"""
+
+    def __init__(self, fields=None, exclude=None, expand=None, prefix=''):
+        # None keeps every field
+        self.fields = fields
+        self.exclude = exclude or {}
+        self.expand = expand or {}
+        self.prefix = prefix
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None:
+            return cls()
+        params = getattr(request, 'query_params', request.GET)
+        trees = {param: _parse(params.get(param, '')) for param in PARAMS}
+        return cls(trees['fields'] or None, trees['exclude'], trees['expand'])
+
+    def __bool__(self):
+        return bool(self.fields or self.exclude or self.expand)
+
+    def child(self, name):
+        """The selection inside the nested field ``name``"""
+        # A field named without sub-fields is kept whole
+        fields = self.fields.get(name) or None if self.fields is not None else None
+        return FieldSelection(
+            fields, self.exclude.get(name), self.expand.get(name), f'{self.prefix}{name}.'
+        )
+
+    def expanded(self, expandable):
+        """The names of ``expandable`` that were asked for"""
+        return [
+            name for name in expandable
+            if name in self.expand or (self.fields is not None and name in self.fields)
+        ]
+
+    def select(self, names, expandable=()):
+        """The names of ``names`` to output, followed by those of ``expandable`` requested"""
+        errors = {}
+        for param in PARAMS:
+            tree = getattr(self, param) or {}
+            unknown = [
+                name for name, below in tree.items()
+                # Only some fields can be expanded, but fields inside any can be
+                if name not in expandable and (name not in names or param == 'expand' and not below)
+            ]
+            if unknown:
+                errors[param] = [f'Unknown field: {self.prefix}{name}' for name in unknown]
+        if errors:
+            raise ValidationError(errors)
+        # Only a name without sub-fields excludes the field itself
+        excluded = {name for name, below in self.exclude.items() if not below}
+        kept = [name for name in names if self.fields is None or name in self.fields]
+        return [name for name in [*kept, *self.expanded(expandable)] if name not in excluded]
+
+
+def field_selection(serializer):
+    """The selection for ``serializer``, from the request of the serializer it is nested in"""
+    path = []
+    node = serializer
+    while node.parent is not None:
+        if node.field_name:
+            path.append(node.field_name)
+        node = node.parent
+    request = serializer.context.get('request')
+    if request is None or request.method not in SAFE_METHODS:
+        # Writes take and return every field
+        return FieldSelection()
+    selection = FieldSelection.from_request(request)
+    for name in reversed(path):
+        selection = selection.child(name)
+    return selection
+
+
+class SparseFieldsetMixin:
+    """Output the fields selected by the request"""
+
+    # Field name -> field only output when expanded
+    expandable_fields = {}
+    # Field name -> what a field not backed by a column reads: columns, and
+    # lookups of relations to prefetch
+    field_dependencies = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name, field in self.expandable_fields.items():
+            fields[name] = copy.deepcopy(field)
+        names = field_selection(self).select(
+            [name for name in fields if name not in self.expandable_fields],
+            list(self.expandable_fields),
+        )
+        return {name: fields[name] for name in names}
+
+
+def _split(model, lookup):
+    """The relation path of ``lookup``, the relations it follows and whether it ends at a column"""
+    parts = lookup.split(LOOKUP_SEP)
+    relations = []
+    for part in parts:
+        field = model._meta.get_field(part)
+        if not field.is_relation:
+            break
+        relations.append(field)
+        model = field.related_model
+    relation_path = LOOKUP_SEP.join(parts[:len(relations)])
+    return relation_path, relations, len(relations) < len(parts)
+
+
+def projection(serializer):
+    """
+    The columns and relations the readable fields of ``serializer`` use, as
+    ``(columns, prefetches)``; columns is None when some field's are unknown.
+    """
+    model = serializer.Meta.model
+    dependencies = getattr(serializer, 'field_dependencies', {})
+    columns = {model._meta.pk.name}
+    prefetches = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if name in dependencies:
+            lookups = dependencies[name]
+        elif field.source == '*':
+            columns = None
+            continue
+        else:
+            lookups = [field.source.replace('.', LOOKUP_SEP)]
+
+        nested = getattr(field, 'child', field)
+        for lookup in lookups:
+            try:
+                path, relations, to_column = _split(model, lookup)
+            except FieldDoesNotExist:
+                # A property or method whose columns were not declared
+                columns = None
+                continue
+            if not relations:
+                if columns is not None:
+                    columns.add(lookup)
+                continue
+            first = relations[0]
+            if (first.many_to_one or first.one_to_one) and first.concrete and columns is not None:
+                columns.add(first.name)
+            if isinstance(nested, serializers.ModelSerializer) and name not in dependencies:
+                prefetches.append(path)
+                prefetches.extend(
+                    f'{path}{LOOKUP_SEP}{below}' for below in projection(nested)[1]
+                )
+            elif to_column or len(relations) > 1 or not isinstance(field, serializers.RelatedField):
+                # A related field alone only needs the key column
+                prefetches.append(path)
+    return columns, list(dict.fromkeys(prefetches))
+
+
+def project_queryset(queryset, serializer):
+    """``queryset`` loading only what ``serializer`` outputs"""
+    columns, prefetches = projection(serializer)
+    if columns is not None:
+        select_related = queryset.query.select_related
+        if select_related is True:
+            columns = None
+        elif select_related:
+            # Relations joined by the view stay loaded
+            columns |= set(select_related)
+    if columns is not None:
+        queryset = queryset.only(*columns)
+    return queryset.prefetch_related(*prefetches)
+
+
+class SparseFieldsetViewMixin:
+    """Trim the queries of read actions to the fields selected by the request"""
+
+    def project_queryset(self, queryset):
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        if not FieldSelection.from_request(self.request):
+            return queryset
+        serializer = self.get_serializer()
+        if not isinstance(serializer, SparseFieldsetMixin):
+            return queryset
+        return project_queryset(queryset, serializer)
+
+    def filter_queryset(self, queryset):
+        return self.project_queryset(super().filter_queryset(queryset))
@@ -0,0 +1,162 @@
+"""
+Image derivatives.
+
+Uploaded product images and profile pictures are stored as they are. A
+background job then renders each into the sizes of ``IMAGE_VARIANTS``
+(longest edge in pixels, never upscaled), as WebP and as JPEG (PNG when the
+image has transparency) for clients without WebP, with metadata stripped
+and EXIF rotation applied.
+
+Derivatives are stored under a name derived from their content,
+``<IMAGE_DERIVATIVES_DIR>/3f/3fa9c1...e2.webp``, so a URL always names the
+same bytes: they can be cached by browsers and CDNs for good, and a new
+upload simply gets new URLs. Identical renders are stored once.
+
+Their names live in a JSON field next to the image (``image_variants`` for
+``image``) along with the name of the original they were made from. Saving a
+new image empties the field and queues the job; the job only records its
+result if the image was not replaced meanwhile.
+"""
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.views.static import serve
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+
+DEFAULT_VARIANTS = {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280}
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def derivatives_dir():
+    return getattr(settings, 'IMAGE_DERIVATIVES_DIR', 'derivatives')
+
+
+def variants_field(field_name):
+    """The name of the field holding the variants of image field ``field_name``"""
+    return f'{field_name}_variants'
+
+
+def prepare_variants(instance, field_name, update_fields=None):
+    """
+    Before ``instance`` is saved, drop the variants of an image that was
+    replaced or removed; returns whether the image needs new ones.
+    """
+    if update_fields is not None and field_name not in update_fields:
+        return False
+    field = variants_field(field_name)
+    image = getattr(instance, field_name)
+    if not image:
+        setattr(instance, field, {})
+        return False
+    # An upload not saved yet is new, whatever its name
+    variants = getattr(instance, field)
+    if image._committed and instance.pk is not None and variants.get('source') != image.name:
+        # They may have been rendered since the instance was loaded; don't
+        # overwrite them with the stale value
+        variants = type(instance)._base_manager.filter(pk=instance.pk).values_list(
+            field, flat=True
+        ).first() or {}
+    if image._committed and variants.get('source') == image.name:
+        setattr(instance, field, variants)
+        return False
+    setattr(instance, field, {})
+    return True
+
+
+def job_key(instance, field_name):
+    """Idempotency key of the job rendering the current image of ``instance``"""
+    name = getattr(instance, field_name).name
+    digest = hashlib.sha256(name.encode()).hexdigest()[:16]
+    return f'image-variants:{instance._meta.label_lower}:{instance.pk}:{field_name}:{digest}'
+
+
+def _store(data, extension, storage):
+    digest = hashlib.sha256(data).hexdigest()
+    name = f'{derivatives_dir()}/{digest[:2]}/{digest[:32]}.{extension}'
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(data))
+    return name
+
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'webp':
+        image.save(buffer, 'WEBP', quality=getattr(settings, 'IMAGE_WEBP_QUALITY', 80), method=4)
+    elif image_format == 'jpeg':
+        image.save(
+            buffer, 'JPEG', quality=getattr(settings, 'IMAGE_JPEG_QUALITY', 82),
+            optimize=True, progressive=True
+        )
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def render_variants(image_file):
+    """Render and store the variants of ``image_file``; returns the value of its variants field"""
+    sizes = sorted(
+        getattr(settings, 'IMAGE_VARIANTS', DEFAULT_VARIANTS).items(), key=lambda item: item[1]
+    )
+    storage = image_file.storage
+    with image_file.open('rb') as source:
+        image = Image.open(source)
+        # JPEGs can be decoded straight at a fraction of their size
+        image.draft('RGB', (sizes[-1][1], sizes[-1][1]))
+        image = ImageOps.exif_transpose(image)
+    transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if transparent else 'RGB')
+    fallback = 'png' if transparent else 'jpeg'
+
+    variants = {}
+    for name, edge in sizes:
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        variants[name] = {
+            'width': resized.width,
+            'height': resized.height,
+            'webp': _store(_encode(resized, 'webp'), 'webp', storage),
+            fallback: _store(
+                _encode(resized, fallback), 'jpg' if fallback == 'jpeg' else 'png', storage
+            ),
+        }
+    return {'source': image_file.name, 'variants': variants}
+
+
+def _url(name, request):
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def variant_urls(value, request=None):
+    """The variants of a variants field value, with URLs in place of the stored names"""
+    return {
+        name: {
+            key: item if key in ('width', 'height') else _url(item, request)
+            for key, item in variant.items()
+        }
+        for name, variant in (value or {}).get('variants', {}).items()
+    }
+
+
+class ImageVariantsField(serializers.Field):
+    """Output the variants of an image, empty until they are rendered"""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return variant_urls(value, self.context.get('request'))
+
+
+def serve_derivative(request, path):
+    """Serve a derivative in development, cacheable for good as its name follows its content"""
+    response = serve(request, path, document_root=os.path.join(settings.MEDIA_ROOT, derivatives_dir()))
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
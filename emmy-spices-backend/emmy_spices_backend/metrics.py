@@ -0,0 +1,350 @@
+"""
+Per-route request metrics.
+
+MetricsMiddleware records, for every request, the total latency, the number
+of SQL queries, the time spent in the database and the time spent in DRF
+serializers, keyed by HTTP method and URL route. Values go into log-linear
+(HDR-style) histograms with eight sub-buckets per power of two, which keep
+quantiles within ~12% at any scale using a fixed amount of memory.
+``metrics_view`` exposes them in the Prometheus text format to staff users
+and to scrapers sending ``Authorization: Bearer <METRICS_TOKEN>``.
+
+Serializer time is what views using SerializerTimingMixin spend in the
+``data`` of serializers made by ``get_serializer``; serializers a view builds
+by hand are not counted.
+
+Queries are attributed to the request through a context variable, so those
+an async view runs on a worker thread through the async ORM are counted too.
+
+Requests that run more than METRICS_SLOW_QUERY_COUNT queries are logged with
+a stack sample taken at the query that crossed the threshold, which usually
+points straight at an N+1 loop.
+"""
+import bisect
+import contextvars
+import hmac
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.authentication import get_authorization_header
+
+from users.authentication import requesting_user
+
+
+logger = logging.getLogger(__name__)
+
+
+def _log_linear_bounds(lowest=0.01, highest=600000.0, sub_buckets=8):
+    bounds = []
+    base = lowest
+    while base < highest:
+        step = base / sub_buckets
+        bounds.extend(base + step * i for i in range(1, sub_buckets + 1))
+        base *= 2
+    return bounds
+
+
+class Histogram:
+    """Log-linear histogram of non-negative values"""
+
+    BOUNDS = _log_linear_bounds()
+    # Coarse, stable bucket bounds for the Prometheus output (powers of two)
+    EXPORT_BOUNDS = BOUNDS[7::8]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(self.BOUNDS[index], self.max) if index < len(self.BOUNDS) else self.max
+        return self.max
+
+    def cumulative(self, bounds):
+        """Cumulative counts at each of ``bounds`` (which must be in BOUNDS)"""
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            while index < len(self.BOUNDS) and self.BOUNDS[index] <= bound:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class MetricsRegistry:
+    """Histograms per (method, route) for each recorded metric"""
+
+    METRICS = {
+        'latency_ms': 'Total request latency in milliseconds',
+        'db_time_ms': 'Time spent executing SQL in milliseconds',
+        'queries': 'Number of SQL queries per request',
+        'serializer_time_ms': 'Time spent in DRF serializers in milliseconds',
+    }
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self.histograms = {}
+        self.status_counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, route, status_code, values):
+        key = (method, route)
+        with self._lock:
+            route_histograms = self.histograms.get(key)
+            if route_histograms is None:
+                route_histograms = self.histograms[key] = {
+                    name: Histogram() for name in self.METRICS
+                }
+            for name, value in values.items():
+                route_histograms[name].record(value)
+            status_key = (method, route, status_code)
+            self.status_counts[status_key] = self.status_counts.get(status_key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.status_counts.clear()
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            lines.append('# HELP emmy_http_requests_total Requests handled, by route and status')
+            lines.append('# TYPE emmy_http_requests_total counter')
+            for (method, route, status_code), count in sorted(self.status_counts.items()):
+                lines.append(
+                    f'emmy_http_requests_total{{method="{method}",route="{_escape(route)}",'
+                    f'status="{status_code}"}} {count}'
+                )
+            for name, help_text in self.METRICS.items():
+                metric = f'emmy_http_{name}'
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} histogram')
+                for (method, route), route_histograms in sorted(self.histograms.items()):
+                    histogram = route_histograms[name]
+                    labels = f'method="{method}",route="{_escape(route)}"'
+                    cumulative = histogram.cumulative(Histogram.EXPORT_BOUNDS)
+                    for bound, count in zip(Histogram.EXPORT_BOUNDS, cumulative):
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {count}')
+                    lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{{labels}}} {histogram.sum:.3f}')
+                    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+                lines.append(f'# HELP {metric}_quantile Estimated quantiles of {metric}')
+                lines.append(f'# TYPE {metric}_quantile gauge')
+                for (method, route), route_histograms in sorted(self.histograms.items()):
+                    histogram = route_histograms[name]
+                    labels = f'method="{method}",route="{_escape(route)}"'
+                    for q in self.QUANTILES:
+                        lines.append(
+                            f'{metric}_quantile{{{labels},quantile="{q}"}} {histogram.quantile(q):g}'
+                        )
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+# Serializer time accumulated by the request running in this context
+_serializer_time = contextvars.ContextVar('serializer_time', default=None)
+
+
+@contextmanager
+def serializer_timing():
+    """Count the block as serializer time of the current request"""
+    totals = _serializer_time.get()
+    if totals is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        totals[0] += time.perf_counter() - started
+
+
+# Serializer class -> subclass timing its ``data``
+_timed_classes = {}
+
+
+def _timed_class(serializer_class):
+    timed = _timed_classes.get(serializer_class)
+    if timed is None:
+        def data(self):
+            with serializer_timing():
+                return super(timed, self).data
+        timed = type(serializer_class.__name__, (serializer_class,), {
+            '__module__': serializer_class.__module__,
+            '__qualname__': serializer_class.__qualname__,
+            'data': property(data),
+        })
+        _timed_classes[serializer_class] = timed
+    return timed
+
+
+class SerializerTimingMixin:
+    """
+    Count the ``data`` of the serializers a view creates as serializer time.
+
+    Only the serializers made by ``get_serializer`` are timed, each as a
+    whole, with the nested serializers it renders.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        serializer.__class__ = _timed_class(type(serializer))
+        return serializer
+
+
+class QueryRecorder:
+    """Database execute wrapper counting queries and their duration"""
+
+    def __init__(self, sample_at=None):
+        self.count = 0
+        self.duration = 0.0
+        self.sample_at = sample_at
+        self.stack_sample = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if self.count == self.sample_at:
+            self.stack_sample = ''.join(traceback.format_stack(limit=25)[:-1])
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+
+
+# QueryRecorder of the request running in this context
+_query_recorder = contextvars.ContextVar('query_recorder', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _query_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def _add_query_recording(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def install_query_recording():
+    """Count queries on every connection, including those opened later by other threads"""
+    connection_created.connect(_add_query_recording, dispatch_uid='metrics_query_recording')
+    for connection in connections.all(initialized_only=True):
+        _add_query_recording(connection)
+
+
+class MetricsMiddleware:
+    """Record latency, query and serializer metrics for each request"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.slow_query_count = getattr(settings, 'METRICS_SLOW_QUERY_COUNT', 50)
+        install_query_recording()
+
+    @contextmanager
+    def measure(self):
+        """Collect the queries and serializer time of the request run inside"""
+        recorder = QueryRecorder(
+            sample_at=self.slow_query_count + 1 if self.slow_query_count else None
+        )
+        totals = [0.0]
+        recorder_token = _query_recorder.set(recorder)
+        serializer_token = _serializer_time.set(totals)
+        try:
+            yield recorder, totals
+        finally:
+            _serializer_time.reset(serializer_token)
+            _query_recorder.reset(recorder_token)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with self.measure() as (recorder, totals):
+            response = self.get_response(request)
+        self.record(request, response, recorder, totals, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with self.measure() as (recorder, totals):
+            response = await self.get_response(request)
+        self.record(request, response, recorder, totals, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, recorder, totals, latency):
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        registry.record(request.method, route, response.status_code, {
+            'latency_ms': latency * 1000,
+            'db_time_ms': recorder.duration * 1000,
+            'queries': recorder.count,
+            'serializer_time_ms': totals[0] * 1000,
+        })
+
+        if recorder.stack_sample:
+            logger.warning(
+                '%s %s ran %d queries (%.1f ms in the database, %.1f ms total). '
+                'Stack at query %d:\n%s',
+                request.method, request.get_full_path(), recorder.count,
+                recorder.duration * 1000, latency * 1000, recorder.sample_at,
+                recorder.stack_sample
+            )
+
+
+def may_read_metrics(request):
+    """Whether ``request`` carries the METRICS_TOKEN bearer token or comes from a staff user"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    auth = get_authorization_header(request).split()
+    if token and len(auth) == 2 and auth[0].lower() == b'bearer':
+        return hmac.compare_digest(auth[1], token.encode())
+    user = requesting_user(request)
+    return user is not None and user.is_staff
+
+
+def metrics_view(request):
+    """Prometheus text exposition of the collected request metrics"""
+    if not may_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
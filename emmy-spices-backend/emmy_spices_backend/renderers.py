@@ -0,0 +1,33 @@
+"""
+JSON rendering with orjson.
+
+``ORJSONRenderer`` produces the same bytes as DRF's compact ``JSONRenderer``
+several times faster. Types orjson doesn't handle natively, and dates and
+times, whose format differs, go through DRF's own encoder. Only floats
+written in exponent notation may differ (``1e-05`` becomes ``1e-5``); data
+orjson rejects (integers beyond 64 bits, for example) and indented output
+fall back to the stock renderer.
+"""
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+_default = JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    """Render JSON with orjson, as JSONRenderer would"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_default, option=_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer too, to keep the output a JavaScript subset
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,162 @@
+"""
+Read-replica routing.
+
+When a ``replica`` database is configured (``DATABASE_REPLICA_*``, see
+``emmy_spices_backend.database``), ``PrimaryReplicaRouter`` sends reads to
+it only where stale data is acceptable:
+
+- during GET, HEAD and OPTIONS requests, i.e. the read-only viewset actions,
+  marked by ``ReplicaRoutingMiddleware``;
+- inside ``replica_reads()``, which the analytics rollups use for their
+  aggregations.
+
+Writes, reads inside a transaction on the primary and the authentication
+tables read on every request always use ``default``. After a client's
+successful request that wrote models through the ORM (a checkout, a
+review...), its reads stay on the primary for ``REPLICA_STICKY_SECONDS`` so
+it sees its own changes despite replication lag. Unsafe requests that write
+nothing, such as clickstream beacons, do not pin the client.
+Clients are recognised by a cookie, or for token clients that ignore cookies,
+by their Authorization header, pinned in the default cache; that cache must be
+shared between processes (LocMemCache is not) for the pin to hold on every
+worker.
+"""
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+PIN_COOKIE = 'replica_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Read on every request and written at login, so a lagging replica would
+# reject fresh tokens and sessions; the job queue's idempotency keys are
+# checked against the rows just written
+PRIMARY_ONLY_APPS = {'auth', 'authtoken', 'contenttypes', 'jobs', 'sessions'}
+
+_replica_reads = ContextVar('replica_reads', default=False)
+# [wrote] flag of the unsafe request running in this context
+_writes = ContextVar('replica_writes', default=None)
+
+
+def replica_alias():
+    """The replica's database alias, or None when none is configured"""
+    alias = getattr(settings, 'REPLICA_DATABASE', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def _tracking_writes():
+    """Yield a [wrote] flag set when the block writes models"""
+    wrote = [False]
+    token = _writes.set(wrote)
+    try:
+        yield wrote
+    finally:
+        _writes.reset(token)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Let the reads in this block go to the replica (or, with False, not)"""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Route reads to the replica inside ``replica_reads()``, everything else to default"""
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        alias = replica_alias()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        wrote = _writes.get()
+        if wrote is not None:
+            wrote[0] = True
+        # Explicit, or saving an instance read from the replica would
+        # follow the instance to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+def _pin_key(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return 'replica-pin:' + hashlib.sha256(authorization.encode()).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    """Serve safe requests from the replica unless the client has just written"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 15)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if replica_alias() is None:
+            return self.get_response(request)
+        pin_key = _pin_key(request)
+        if request.method in SAFE_METHODS:
+            pinned = PIN_COOKIE in request.COOKIES or (
+                pin_key is not None and cache.get(pin_key)
+            )
+            with replica_reads(not pinned):
+                return self.get_response(request)
+
+        with _tracking_writes() as wrote:
+            response = self.get_response(request)
+        if wrote[0] and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax'
+            )
+            if pin_key is not None:
+                cache.set(pin_key, True, self.sticky_seconds)
+        return response
+
+    async def __acall__(self, request):
+        if replica_alias() is None:
+            return await self.get_response(request)
+        pin_key = _pin_key(request)
+        if request.method in SAFE_METHODS:
+            pinned = PIN_COOKIE in request.COOKIES or (
+                pin_key is not None and await cache.aget(pin_key)
+            )
+            with replica_reads(not pinned):
+                return await self.get_response(request)
+
+        with _tracking_writes() as wrote:
+            response = await self.get_response(request)
+        if wrote[0] and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax'
+            )
+            if pin_key is not None:
+                await cache.aset(pin_key, True, self.sticky_seconds)
+        return response
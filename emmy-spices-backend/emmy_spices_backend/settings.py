@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+
+from .database import DEFAULT_SQLITE_PRAGMAS, databases
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,6 +44,7 @@ INSTALLED_APPS = [
     
     # Third party apps
     'rest_framework',
+    'rest_framework.authtoken',
     'corsheaders',
     
     # Local apps
@@ -48,17 +52,24 @@ INSTALLED_APPS = [
     'orders',
     'users',
     'analytics',
+    'benchmarks',
+    'jobs',
 ]
 
 MIDDLEWARE = [
+    'emmy_spices_backend.metrics.MetricsMiddleware',
+    'emmy_spices_backend.compression.CompressionMiddleware',
+    'emmy_spices_backend.replicas.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.UserActivityMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'analytics.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'emmy_spices_backend.urls'
@@ -84,10 +95,55 @@ WSGI_APPLICATION = 'emmy_spices_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_PROFILE=sqlite (default) or postgres, plus an optional replica from
+# DATABASE_REPLICA_*; see emmy_spices_backend/database.py
+DATABASES = databases(BASE_DIR)
+
+# Send safe reads to the replica, see emmy_spices_backend.replicas
+DATABASE_ROUTERS = ['emmy_spices_backend.replicas.PrimaryReplicaRouter']
+REPLICA_DATABASE = 'replica'
+# After a client's write, how long its reads stay on the primary so it sees
+# its own changes through replication lag
+REPLICA_STICKY_SECONDS = 15
+
+# PRAGMAs applied to every new SQLite connection
+SQLITE_PRAGMAS = DEFAULT_SQLITE_PRAGMAS
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '{asctime} {levelname} {name}: {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'emmy_spices_backend': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'emmy-spices',
     }
 }
 
@@ -142,17 +198,120 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    'DEFAULT_THROTTLE_CLASSES': [
+        'emmy_spices_backend.throttling.TokenBucketThrottle',
+    ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'emmy_spices_backend.renderers.ORJSONRenderer',
     ],
+    # Reverse proxies in front of the app; X-Forwarded-For is only trusted
+    # for this many hops, and ignored when 0 (clients can set it freely)
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+}
+
+# Request throttling (see emmy_spices_backend.throttling)
+THROTTLE_BUCKETS = {
+    # scope: (burst capacity, tokens refilled per second)
+    'anon': (120, 2),
+    'user': (300, 5),
+    'token': (600, 10),
+}
+# InMemoryBucketStore is per process; CacheBucketStore shares buckets
+# through the default cache (use a shared cache such as Redis in production)
+THROTTLE_BUCKET_STORE = 'emmy_spices_backend.throttling.InMemoryBucketStore'
+THROTTLE_MAX_BUCKETS = 100000  # per process, least recently used evicted first
+
+# Request metrics (see emmy_spices_backend.metrics), scraped from /metrics
+# Scrapers send 'Authorization: Bearer <METRICS_TOKEN>'; staff users may also read /metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_SLOW_QUERY_COUNT = 50  # log requests running more queries than this (0 disables)
+
+# Request profiling (see analytics.profiling), browsable in the admin
+PROFILING_SAMPLE_RATE = 0.0  # fraction of API requests profiled at random
+PROFILING_PATH_PREFIXES = ['/api/']
+PROFILING_DEFAULT_MODE = 'sample'  # mode for ?profile=1: 'sample' or 'cprofile'
+PROFILING_SAMPLE_INTERVAL_MS = 5
+PROFILING_MAX_QUERIES = 1000  # SQL statements kept per profile
+
+# Token authentication cache (see users.authentication)
+TOKEN_AUTH_CACHE_SIZE = 10000  # verified tokens kept per process
+TOKEN_AUTH_CACHE_TTL = 60  # seconds a verified token is trusted without a lookup
+# Cache holding per-user revocation versions; must be shared between workers
+# (Redis, Memcached) for revocations to apply everywhere at once
+TOKEN_AUTH_VERSION_CACHE = 'default'
+
+# Clickstream ingestion (analytics beacon)
+CLICKSTREAM_BUFFER_SIZE = 100000  # events held in memory before the oldest are dropped
+CLICKSTREAM_FLUSH_INTERVAL = 5  # seconds between aggregated database flushes
+CLICKSTREAM_LOG_PATH = None  # optional append-only NDJSON archive of raw events (not replayed)
+
+# User activity logging (write-behind queue)
+# Off under the test runner: the writer thread would outlive each test's
+# transaction; ActivityWriterTests turn it back on
+USER_ACTIVITY_LOGGING = sys.argv[1:2] != ['test']
+USER_ACTIVITY_PATH_PREFIXES = ['/api/']
+USER_ACTIVITY_QUEUE_SIZE = 10000  # records buffered before new ones are dropped
+USER_ACTIVITY_BATCH_SIZE = 500  # rows per bulk_create
+USER_ACTIVITY_FLUSH_INTERVAL_MS = 200  # max delay before a partial batch is written
+
+# Real-time notifications (Server-Sent Events, requires ASGI)
+NOTIFICATION_BROKER = 'users.notifications.LocalBroker'
+NOTIFICATION_STREAM_HEARTBEAT = 15  # seconds between keep-alive comments
+
+# Async API variants (see emmy_spices_backend.async_api), served under ASGI
+ASYNC_API_CONCURRENCY = 32  # requests per process running at once, each with a thread
+
+# Response compression (see emmy_spices_backend.compression); brotli needs the
+# optional Brotli package, gzip is used otherwise
+COMPRESSION_MIN_SIZE = 1024  # bytes below which responses are sent uncompressed
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_CACHE_PATHS = ['/api/products/', '/api/analytics/']  # compressed bodies reused
+COMPRESSION_CACHE_SIZE = 32 * 1024 * 1024  # bytes of compressed bodies kept per process
+
+# Image derivatives (see emmy_spices_backend.images), rendered by background
+# jobs; `manage.py render_image_variants` backfills existing images
+IMAGE_VARIANTS = {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280}  # longest edge, px
+IMAGE_WEBP_QUALITY = 80
+IMAGE_JPEG_QUALITY = 82
+IMAGE_DERIVATIVES_DIR = 'derivatives'  # under MEDIA_ROOT; names change with content
+
+# History retention, applied by `manage.py prune_history`
+USER_ACTIVITY_RETENTION_DAYS = 90
+USER_SESSION_RETENTION_DAYS = 180
+NOTIFICATION_RETENTION_DAYS = 365
+
+# Stock reservations (see orders.reservations); unpaid ones are released by
+# `manage.py expire_reservations`
+STOCK_RESERVATION_MINUTES = 15
+
+# Background jobs (see jobs.queue), run by `manage.py run_jobs`
+JOBS_EAGER = False  # run tasks when the enqueueing transaction commits, without a worker
+JOBS_POLL_INTERVAL = 1  # seconds an idle worker waits before polling again
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BACKOFF = 10  # seconds before the first retry, doubled on each attempt
+JOBS_LOCK_TIMEOUT = 600  # seconds before a running job is presumed lost and requeued
+JOB_RETENTION_DAYS = 7  # finished jobs kept for `manage.py prune_history`
+
+# Order and payment events (see orders.outbox), delivered by `manage.py relay_outbox`
+OUTBOX_SINKS = {
+    'handlers': {'BACKEND': 'orders.outbox.HandlerSink'},
+    # 'file': {'BACKEND': 'orders.outbox.FileSink', 'OPTIONS': {'path': BASE_DIR / 'events.ndjson'}},
+    # 'webhook': {
+    #     'BACKEND': 'orders.outbox.WebhookSink',
+    #     'OPTIONS': {'url': 'https://example.com/hooks/orders', 'timeout': 10},
+    # },
 }
+OUTBOX_RETRY_BACKOFF = 5  # seconds before an order's rejected event is retried, doubled each time
+OUTBOX_MAX_BACKOFF = 300
+OUTBOX_RETENTION_DAYS = 30  # published events kept for `manage.py prune_history`
 
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
@@ -0,0 +1,249 @@
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import connections, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from orders.models import Order
+from orders.serializers import ShippingMethodSerializer
+from . import replicas, throttling
+from .metrics import registry
+from .replicas import PIN_COOKIE, PrimaryReplicaRouter, ReplicaRoutingMiddleware, replica_reads
+from .throttling import InMemoryBucketStore, TokenBucketThrottle
+
+
+class InMemoryBucketStoreTests(SimpleTestCase):
+    def test_buckets_refill_at_the_rate_up_to_capacity(self):
+        store = InMemoryBucketStore()
+        self.assertEqual(store.consume('a', 8, capacity=10, rate=2, now=0), 0)
+        self.assertEqual(store.consume('a', 5, capacity=10, rate=2, now=0), 1.5)
+        self.assertEqual(store.consume('a', 5, capacity=10, rate=2, now=1.5), 0)
+        # Long idle periods refill only up to the capacity
+        self.assertEqual(store.consume('a', 10, capacity=10, rate=2, now=100), 0)
+        self.assertEqual(store.consume('a', 1, capacity=10, rate=2, now=100), 0.5)
+
+    def test_clients_have_separate_buckets(self):
+        store = InMemoryBucketStore()
+        store.consume('a', 10, capacity=10, rate=1, now=0)
+        self.assertEqual(store.consume('b', 10, capacity=10, rate=1, now=0), 0)
+
+    def test_full_buckets_are_swept_out(self):
+        store = InMemoryBucketStore(sweep_interval=60)
+        store.consume('idle', 10, capacity=10, rate=1, now=0)
+        store.consume('busy', 1, capacity=100, rate=1, now=0)
+        store.consume('busy', 99, capacity=100, rate=1, now=59)
+        store.consume('new', 1, capacity=10, rate=1, now=61)
+        self.assertEqual(list(store.buckets), ['busy', 'new'])
+
+    def test_least_recently_used_buckets_are_evicted_beyond_maxsize(self):
+        store = InMemoryBucketStore(maxsize=2)
+        for key in ('a', 'b', 'a', 'c'):
+            store.consume(key, 1, capacity=10, rate=1, now=1)
+        self.assertEqual(list(store.buckets), ['a', 'c'])
+
+
+@override_settings(THROTTLE_BUCKETS={'anon': (10, 1), 'user': (10, 1), 'token': (10, 1)})
+class TokenBucketThrottleTests(SimpleTestCase):
+    def setUp(self):
+        self.store = throttling._store = InMemoryBucketStore()
+        self.addCleanup(setattr, throttling, '_store', None)
+
+    def allow(self, throttle, request, action, costs):
+        view = type('View', (), {'action': action, 'throttle_costs': costs})()
+        return throttle.allow_request(request, view)
+
+    def anonymous_request(self, **meta):
+        request = Request(APIRequestFactory().get('/', REMOTE_ADDR='10.0.0.1', **meta))
+        request.user, request.auth = AnonymousUser(), None
+        return request
+
+    def test_costs_are_charged_per_action(self):
+        request = self.anonymous_request()
+        throttle = TokenBucketThrottle()
+        costs = {'search': 4, 'report': lambda request: 50}
+        self.assertTrue(self.allow(throttle, request, 'search', costs))
+        self.assertTrue(self.allow(throttle, request, 'search', costs))
+        self.assertFalse(self.allow(throttle, request, 'search', costs))
+        self.assertAlmostEqual(throttle.wait(), 2, places=2)
+        self.assertTrue(self.allow(throttle, request, 'list', costs))
+        # A request never costs more than a full bucket
+        self.assertFalse(self.allow(throttle, request, 'report', costs))
+        self.assertAlmostEqual(throttle.wait(), 9, places=2)
+
+    def test_forwarded_for_does_not_pick_the_bucket(self):
+        throttle = TokenBucketThrottle()
+        for i in range(11):
+            request = self.anonymous_request(HTTP_X_FORWARDED_FOR=f'198.51.100.{i}')
+            allowed = self.allow(throttle, request, 'list', {})
+        self.assertFalse(allowed)
+        self.assertEqual(list(self.store.buckets), ['ip:10.0.0.1'])
+
+
+@override_settings(METRICS_TOKEN='scrape-secret')
+class MetricsViewTests(TestCase):
+    def test_anonymous_requests_are_forbidden(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    def test_bearer_token(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('emmy_http_requests_total', response.content.decode())
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_empty_token_is_never_accepted(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff_api_token(self):
+        staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        customer = User.objects.create_user('customer', password='pw')
+        for user, status_code in ((staff, 200), (customer, 403)):
+            token = Token.objects.create(user=user)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION=f'Token {token.key}')
+            self.assertEqual(response.status_code, status_code)
+
+    def test_staff_session(self):
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class SerializerTimingTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    def test_view_serializers_are_timed(self):
+        response = self.client.get('/api/orders/api/shipping-methods/')
+        self.assertEqual(response.status_code, 200)
+        [histograms] = registry.histograms.values()
+        self.assertEqual(histograms['serializer_time_ms'].count, 1)
+        self.assertGreater(histograms['serializer_time_ms'].sum, 0)
+
+    def test_serializer_classes_are_not_patched(self):
+        self.assertIs(ShippingMethodSerializer.data, serializers.Serializer.data)
+        self.assertEqual(serializers.Serializer.data.fget.__module__, 'rest_framework.serializers')
+
+
+@mock.patch.object(replicas, 'replica_alias', lambda: 'replica')
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_use_replica_only_when_enabled(self):
+        self.assertEqual(self.router.db_for_read(Order), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Order), 'replica')
+            with replica_reads(False):
+                self.assertEqual(self.router.db_for_read(Order), 'default')
+
+    def test_primary_only_apps_and_transactions(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_read(Token), 'default')
+            with mock.patch.object(connections['default'], 'in_atomic_block', True):
+                self.assertEqual(self.router.db_for_read(Order), 'default')
+
+    def test_writes_use_primary(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_write(Order), 'default')
+
+
+@mock.patch.object(replicas, 'replica_alias', lambda: 'replica')
+@override_settings(REPLICA_STICKY_SECONDS=15)
+class ReplicaRoutingMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.factory = RequestFactory()
+        self.status_code = 200
+        self.reads = []
+
+    def get_response(self, request):
+        self.reads.append(replicas._replica_reads.get())
+        if request.method == 'POST':
+            router.db_for_write(Order)
+        return HttpResponse(status=self.status_code)
+
+    def test_safe_requests_read_from_replica(self):
+        middleware = ReplicaRoutingMiddleware(self.get_response)
+        middleware(self.factory.get('/'))
+        middleware(self.factory.post('/'))
+        self.assertEqual(self.reads, [True, False])
+
+    def test_successful_write_pins_cookie_clients(self):
+        middleware = ReplicaRoutingMiddleware(self.get_response)
+        response = middleware(self.factory.post('/'))
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 15)
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        middleware(request)
+        self.assertEqual(self.reads[-1], False)
+
+    def test_successful_write_pins_token_clients(self):
+        middleware = ReplicaRoutingMiddleware(self.get_response)
+        middleware(self.factory.post('/', HTTP_AUTHORIZATION='Token abc'))
+        middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token abc'))
+        middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token other'))
+        self.assertEqual(self.reads[1:], [False, True])
+
+    def test_request_without_writes_does_not_pin(self):
+        middleware = ReplicaRoutingMiddleware(self.get_response)
+        response = middleware(self.factory.put('/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertEqual(self.reads[-1], True)
+
+    def test_failed_write_does_not_pin(self):
+        self.status_code = 400
+        middleware = ReplicaRoutingMiddleware(self.get_response)
+        response = middleware(self.factory.post('/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertEqual(self.reads[-1], True)
+
+    async def test_async_requests(self):
+        async def get_response(request):
+            return self.get_response(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        await middleware(self.factory.post('/', HTTP_AUTHORIZATION='Token abc'))
+        await middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token abc'))
+        await middleware(self.factory.get('/'))
+        self.assertEqual(self.reads, [False, False, True])
+
+    def test_without_replica_requests_pass_through(self):
+        middleware = ReplicaRoutingMiddleware(self.get_response)
+        with mock.patch.object(replicas, 'replica_alias', lambda: None):
+            response = middleware(self.factory.post('/'))
+            middleware(self.factory.get('/'))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.reads, [False, False])
+
+
+@mock.patch.object(replicas, 'replica_alias', lambda: 'replica')
+class ReplicaPinTests(TestCase):
+    def test_beacon_does_not_pin(self):
+        with mock.patch('analytics.clickstream.buffer.record') as record:
+            response = self.client.post(
+                '/api/analytics/api/beacon/',
+                {'events': [{'type': 'page_view', 'visitor_id': 'a'}]},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 202)
+        record.assert_called_once()
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_write_pins(self):
+        self.client.force_login(User.objects.create_user('reader'))
+        response = self.client.post('/api/users/api/notifications/mark_all_read/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(PIN_COOKIE, response.cookies)
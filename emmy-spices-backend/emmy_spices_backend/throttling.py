@@ -0,0 +1,151 @@
+"""
+Token-bucket request throttling with per-endpoint costs.
+
+Each client gets a bucket keyed by API token, user or IP address. Buckets
+refill continuously at a fixed rate up to a burst capacity, and each request
+spends tokens according to the cost its view declares in ``throttle_costs``
+(action name -> cost, or a callable taking the request). Expensive actions
+therefore drain the budget faster than cheap ones. When a bucket runs dry
+DRF responds with 429 and a ``Retry-After`` header.
+
+Anonymous clients are keyed by IP address as DRF's ``get_ident`` finds it:
+X-Forwarded-For is only read behind REST_FRAMEWORK['NUM_PROXIES'] proxies,
+so clients cannot pick a fresh key for each request.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+
+DEFAULT_BUCKETS = {
+    # scope: (capacity, tokens refilled per second)
+    'anon': (120, 2),
+    'user': (300, 5),
+    'token': (600, 10),
+}
+
+
+class InMemoryBucketStore:
+    """
+    Buckets held in this process; exact, but not shared between workers.
+
+    A bucket that has refilled completely is the same as no bucket, so idle
+    buckets are swept out every ``sweep_interval`` seconds. At most
+    ``maxsize`` buckets are kept, least recently used first out, so a flood
+    of new client addresses cannot grow the store without bound; a client
+    evicted early merely starts again from a full bucket.
+    """
+
+    def __init__(self, maxsize=None, sweep_interval=60):
+        self.maxsize = maxsize or getattr(settings, 'THROTTLE_MAX_BUCKETS', 100000)
+        self.sweep_interval = sweep_interval
+        # key -> (tokens, updated, time the bucket is full again), oldest first
+        self.buckets = OrderedDict()
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost, capacity, rate, now=None):
+        """Spend ``cost`` tokens; returns 0 if allowed, else seconds to wait"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            entry = self.buckets.pop(key, None)
+            tokens, updated = (capacity, now) if entry is None else entry[:2]
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def _sweep(self, now):
+        for key in [key for key, entry in self.buckets.items() if entry[2] <= now]:
+            del self.buckets[key]
+        self._next_sweep = now + self.sweep_interval
+
+
+class CacheBucketStore:
+    """
+    Buckets stored in a Django cache so all workers share one budget.
+
+    Reads and writes are not atomic, so concurrent requests from the same
+    client may occasionally both be admitted; the limit is approximate.
+    """
+
+    def __init__(self, alias='default', prefix='throttle'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def consume(self, key, cost, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        cache_key = f'{self.prefix}:{key}'
+        tokens, updated = self.cache.get(cache_key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        # Keep the entry only as long as it takes to refill completely
+        self.cache.set(cache_key, (tokens, now), math.ceil(capacity / rate) + 1)
+        return 0 if allowed else (cost - tokens) / rate
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_path = getattr(
+                    settings, 'THROTTLE_BUCKET_STORE',
+                    'emmy_spices_backend.throttling.InMemoryBucketStore'
+                )
+                _store = import_string(store_path)()
+    return _store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle requests by per-client token buckets and per-action costs"""
+
+    def get_scope_and_ident(self, request):
+        token = getattr(request.auth, 'key', None)
+        if token:
+            return 'token', f'token:{token}'
+        if request.user and request.user.is_authenticated:
+            return 'user', f'user:{request.user.pk}'
+        return 'anon', f'ip:{self.get_ident(request)}'
+
+    def get_cost(self, request, view):
+        costs = getattr(view, 'throttle_costs', None) or {}
+        cost = costs.get(getattr(view, 'action', None), 1)
+        if callable(cost):
+            cost = cost(request)
+        return cost
+
+    def allow_request(self, request, view):
+        cost = self.get_cost(request, view)
+        if cost <= 0:
+            return True
+        scope, ident = self.get_scope_and_ident(request)
+        buckets = getattr(settings, 'THROTTLE_BUCKETS', DEFAULT_BUCKETS)
+        capacity, rate = buckets[scope]
+        # A single request may never cost more than a full bucket
+        cost = min(cost, capacity)
+        self.wait_time = get_bucket_store().consume(ident, cost, capacity, rate)
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
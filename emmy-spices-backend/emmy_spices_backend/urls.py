@@ -15,20 +15,29 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .images import derivatives_dir, serve_derivative
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/products/', include('products.urls')),
     path('api/orders/', include('orders.urls')),
     path('api/users/', include('users.urls')),
     path('api/analytics/', include('analytics.urls')),
+    path('metrics', metrics_view, name='metrics'),
     # path('api/docs/', include_docs_urls(title='Emmy Spices API')),
 ]
 
 # Serve media files in development
 if settings.DEBUG:
+    urlpatterns += [
+        re_path(
+            rf'^{settings.MEDIA_URL.lstrip("/")}{derivatives_dir()}/(?P<path>.*)$', serve_derivative
+        ),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
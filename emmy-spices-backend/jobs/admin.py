@@ -0,0 +1,23 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = [
+        'task', 'status', 'priority', 'attempts', 'max_attempts', 'run_at',
+        'locked_by', 'created_at', 'finished_at'
+    ]
+    list_filter = ['status', 'task', 'created_at']
+    search_fields = ['task', 'idempotency_key', 'last_error']
+    ordering = ['-created_at']
+    readonly_fields = ['attempts', 'locked_by', 'locked_at', 'last_error', 'created_at', 'finished_at']
+    actions = ['requeue']
+
+    @admin.action(description='Requeue selected jobs')
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_at=timezone.now(), finished_at=None, last_error=''
+        )
+        self.message_user(request, f'{updated} jobs requeued.')
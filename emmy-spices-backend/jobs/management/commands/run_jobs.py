@@ -0,0 +1,82 @@
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs.queue import Worker
+from jobs.workers import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs until stopped with SIGTERM or Ctrl-C'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Worker processes to run'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are due now and exit'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help='Due jobs fetched per claim attempt'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            help='Seconds to wait when the queue is empty (default: settings.JOBS_POLL_INTERVAL)'
+        )
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        worker_options = {
+            'batch_size': options['batch_size'],
+            'poll_interval': options['poll_interval'],
+        }
+
+        if options['once']:
+            started = time.perf_counter()
+            worker = Worker(**worker_options)
+            worker.requeue_stale()
+            ran = worker.run_pending()
+            self.stdout.write(f'Ran {ran} jobs in {time.perf_counter() - started:.2f}s')
+            return
+
+        if options['processes'] == 1:
+            worker = Worker(**worker_options)
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *args: worker.stop())
+            self.stdout.write(f'Worker {worker.name} running jobs')
+            worker.run()
+            return
+
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=run_worker, args=(worker_options,), name=f'jobs-worker-{i}')
+            for i in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+
+        def stop(*args):
+            # Each worker finishes its current job before exiting
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, stop)
+        self.stdout.write(f'Running jobs in {len(processes)} worker processes')
+        for process in processes:
+            process.join()
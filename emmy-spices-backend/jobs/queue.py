@@ -0,0 +1,205 @@
+"""
+Database-backed job queue.
+
+Slow side effects (recomputing a product's rating, rolling up the day's
+sales...) are registered with ``@task`` in an app's ``tasks.py`` and queued
+with ``enqueue()``, which only inserts a ``Job`` row. ``run_jobs`` workers
+poll for due jobs, highest priority first, and claim each one with a
+conditional UPDATE, so concurrent workers never run the same job.
+
+A job enqueued inside a transaction becomes visible to the workers when the
+transaction commits and disappears with it on rollback. Failed jobs are
+retried with exponential backoff up to ``max_attempts``, and a job whose
+worker died is requeued after ``JOBS_LOCK_TIMEOUT``: delivery is at least
+once, so tasks must be idempotent. An idempotency key makes enqueueing
+idempotent too; a key that is already queued, running or done (and kept in
+the job history) returns the existing job instead of adding one, while a
+job that failed for good is queued again.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# Task name -> function, filled by @task when the apps' tasks.py are imported
+TASKS = {}
+
+
+def task(func=None, *, name=None, priority=0, max_attempts=None):
+    """Register a function as a task, named ``module.function`` unless ``name`` is given"""
+    def register(func):
+        func.task_name = name or f'{func.__module__}.{func.__qualname__}'
+        func.default_priority = priority
+        func.default_max_attempts = max_attempts
+        TASKS[func.task_name] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def enqueue(task, kwargs=None, *, key=None, priority=None, delay=None, max_attempts=None):
+    """
+    Queue a call of ``task`` (a @task function or its name) with ``kwargs``.
+
+    ``kwargs`` must be JSON-serialisable. With ``JOBS_EAGER`` the task runs
+    when the current transaction commits instead, and None is returned.
+    """
+    name = getattr(task, 'task_name', task)
+    func = TASKS.get(name)
+    if func is None:
+        raise ValueError(f'Unknown task {name!r}')
+    kwargs = kwargs or {}
+    if getattr(settings, 'JOBS_EAGER', False):
+        transaction.on_commit(lambda: func(**kwargs))
+        return None
+
+    fields = {
+        'task': name,
+        'kwargs': kwargs,
+        'priority': func.default_priority if priority is None else priority,
+        'max_attempts': (
+            max_attempts or func.default_max_attempts
+            or getattr(settings, 'JOBS_MAX_ATTEMPTS', 5)
+        ),
+        'run_at': timezone.now() + timedelta(seconds=delay or 0),
+    }
+    if key is None:
+        return Job.objects.create(**fields)
+    job, created = Job.objects.get_or_create(idempotency_key=key, defaults=fields)
+    if not created and job.status == 'failed':
+        # Give the call a fresh set of attempts; conditional, so racing
+        # enqueues requeue it once
+        requeued = Job.objects.filter(pk=job.pk, status='failed').update(
+            attempts=0, finished_at=None, last_error='', status='queued', **fields
+        )
+        if requeued:
+            job.refresh_from_db()
+    return job
+
+
+class Worker:
+    """Claim and run due jobs one at a time"""
+
+    def __init__(self, name=None, batch_size=10, poll_interval=None):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        # Due jobs fetched per claim attempt, so racing workers skip past
+        # the ones claimed by others instead of polling again
+        self.batch_size = batch_size
+        self.poll_interval = (
+            getattr(settings, 'JOBS_POLL_INTERVAL', 1) if poll_interval is None else poll_interval
+        )
+        self.lock_timeout = getattr(settings, 'JOBS_LOCK_TIMEOUT', 600)
+        self.retry_backoff = getattr(settings, 'JOBS_RETRY_BACKOFF', 10)
+        self.stopping = False
+        self._wake = threading.Event()
+
+    def requeue_stale(self):
+        """Requeue jobs left running by a worker that died; returns how many"""
+        now = timezone.now()
+        stale = Job.objects.filter(
+            status='running', locked_at__lt=now - timedelta(seconds=self.lock_timeout)
+        )
+        failed = stale.filter(attempts__gte=F('max_attempts')).update(
+            status='failed', finished_at=now, locked_by='',
+            last_error='Worker stopped while running the job',
+        )
+        requeued = stale.update(status='queued', run_at=now, locked_by='', locked_at=None)
+        if failed or requeued:
+            logger.warning('Recovered %d stale jobs (%d failed)', failed + requeued, failed)
+        return failed + requeued
+
+    def claim(self):
+        """Take the next due job, or None when there is none"""
+        now = timezone.now()
+        due = Job.objects.filter(status='queued', run_at__lte=now).order_by(
+            '-priority', 'run_at', 'pk'
+        ).values_list('pk', flat=True)
+        for pk in due[:self.batch_size]:
+            claimed = Job.objects.filter(pk=pk, status='queued').update(
+                status='running', locked_by=self.name, locked_at=now,
+                attempts=F('attempts') + 1,
+            )
+            if claimed:
+                return Job.objects.get(pk=pk)
+        return None
+
+    def _finish(self, job, **fields):
+        # Filtered on the lock, so a job requeued as stale meanwhile is left alone
+        return Job.objects.filter(pk=job.pk, status='running', locked_by=self.name).update(
+            locked_by='', locked_at=None, **fields
+        )
+
+    def run_job(self, job):
+        """Run a claimed job and record the outcome; returns whether it succeeded"""
+        func = TASKS.get(job.task)
+        started = time.perf_counter()
+        try:
+            if func is None:
+                raise LookupError(f'Unknown task {job.task!r}')
+            func(**job.kwargs)
+        except Exception:
+            now = timezone.now()
+            error = traceback.format_exc()
+            if func is None or job.attempts >= job.max_attempts:
+                self._finish(job, status='failed', finished_at=now, last_error=error)
+                logger.error(
+                    'Job %s #%s failed for good after %d attempts', job.task, job.pk, job.attempts,
+                    exc_info=True
+                )
+            else:
+                delay = self.retry_backoff * 2 ** (job.attempts - 1)
+                self._finish(
+                    job, status='queued', run_at=now + timedelta(seconds=delay), last_error=error
+                )
+                logger.warning(
+                    'Job %s #%s failed, retrying in %ss', job.task, job.pk, delay, exc_info=True
+                )
+            return False
+
+        self._finish(job, status='succeeded', finished_at=timezone.now(), last_error='')
+        logger.info(
+            'Job %s #%s succeeded in %.3fs', job.task, job.pk, time.perf_counter() - started
+        )
+        return True
+
+    def run_pending(self, limit=None):
+        """Run due jobs until none is left (or ``limit`` ran); returns how many ran"""
+        ran = 0
+        while not self.stopping and (limit is None or ran < limit):
+            # Drop connections that broke or outlived CONN_MAX_AGE between jobs
+            close_old_connections()
+            job = self.claim()
+            if job is None:
+                break
+            self.run_job(job)
+            ran += 1
+        return ran
+
+    def run(self):
+        """Poll for jobs until ``stop()`` is called"""
+        logger.info('Worker %s started', self.name)
+        try:
+            while not self.stopping:
+                self.requeue_stale()
+                if not self.run_pending():
+                    self._wake.wait(self.poll_interval)
+        finally:
+            connections.close_all()
+            logger.info('Worker %s stopped', self.name)
+
+    def stop(self):
+        """Stop after the job being run, if any"""
+        self.stopping = True
+        self._wake.set()
@@ -0,0 +1,163 @@
+import threading
+from datetime import timedelta
+
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import Worker, enqueue, task
+
+
+CALLS = []
+
+
+@task(name='jobs.tests.record')
+def record(value):
+    CALLS.append(value)
+
+
+@task(name='jobs.tests.flaky', max_attempts=3)
+def flaky(fail):
+    if fail:
+        raise RuntimeError('flaky failure')
+
+
+def run_due(worker):
+    # Worker.run_pending() closes the connection, and with it the test's
+    # transaction, when it is not in autocommit mode
+    ran = []
+    while (job := worker.claim()) is not None:
+        ran.append(worker.run_job(job))
+    return ran
+
+
+@override_settings(JOBS_EAGER=False, JOBS_RETRY_BACKOFF=10, JOBS_LOCK_TIMEOUT=600)
+class WorkerTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_a_claimed_job_is_not_claimed_again(self):
+        job = enqueue(record, {'value': 1})
+        first, second = Worker(name='first'), Worker(name='second')
+        self.assertEqual(first.claim().pk, job.pk)
+        self.assertIsNone(second.claim())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('running', 'first', 1))
+
+    def test_jobs_run_by_priority_then_due_time(self):
+        enqueue(record, {'value': 'late'}, delay=-10)
+        enqueue(record, {'value': 'urgent'}, priority=5)
+        enqueue(record, {'value': 'later'}, delay=60)
+        enqueue(record, {'value': 'early'}, delay=-20)
+        self.assertEqual(run_due(Worker()), [True, True, True])
+        self.assertEqual(CALLS, ['urgent', 'early', 'late'])
+
+    def test_failures_back_off_until_max_attempts(self):
+        job = enqueue(flaky, {'fail': True})
+        worker = Worker()
+        for attempt in range(1, 4):
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            started = timezone.now()
+            with self.assertLogs('jobs.queue', 'WARNING'):
+                self.assertFalse(worker.run_job(worker.claim()))
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+            self.assertIn('flaky failure', job.last_error)
+            if attempt < 3:
+                self.assertEqual(job.status, 'queued')
+                delay = (job.run_at - started).total_seconds()
+                self.assertAlmostEqual(delay, 10 * 2 ** (attempt - 1), delta=1)
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_jobs_are_requeued_or_failed(self):
+        stale = timezone.now() - timedelta(seconds=601)
+        retried = enqueue(record, {'value': 1})
+        exhausted = enqueue(record, {'value': 2}, max_attempts=1)
+        fresh = enqueue(record, {'value': 3})
+        Job.objects.filter(pk__in=[retried.pk, exhausted.pk]).update(
+            status='running', locked_by='dead', locked_at=stale, attempts=1
+        )
+        Job.objects.filter(pk=fresh.pk).update(
+            status='running', locked_by='alive', locked_at=timezone.now(), attempts=1
+        )
+        with self.assertLogs('jobs.queue', 'WARNING') as logs:
+            self.assertEqual(Worker().requeue_stale(), 2)
+        self.assertIn('Recovered 2 stale jobs (1 failed)', logs.output[0])
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[retried.pk], statuses[exhausted.pk], statuses[fresh.pk]],
+            ['queued', 'failed', 'running']
+        )
+
+    def test_a_requeued_job_is_not_finished_by_its_old_worker(self):
+        job = enqueue(record, {'value': 1})
+        old = Worker(name='old')
+        claimed = old.claim()
+        Job.objects.filter(pk=job.pk).update(status='queued', locked_by='', locked_at=None)
+        new = Worker(name='new')
+        new.run_job(new.claim())
+        old.run_job(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('succeeded', 2))
+
+
+@override_settings(JOBS_EAGER=False)
+class IdempotencyKeyTests(TestCase):
+    def test_a_key_is_enqueued_once(self):
+        first = enqueue(record, {'value': 1}, key='once')
+        second = enqueue(record, {'value': 2}, key='once')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.get().kwargs, {'value': 1})
+        worker = Worker()
+        worker.run_job(worker.claim())
+        self.assertEqual(enqueue(record, {'value': 3}, key='once').status, 'succeeded')
+
+    def test_a_failed_job_can_be_enqueued_again(self):
+        job = enqueue(flaky, {'fail': True}, key='retry-me', max_attempts=1)
+        worker = Worker()
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            worker.run_job(worker.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+        again = enqueue(flaky, {'fail': False}, key='retry-me')
+        self.assertEqual(again.pk, job.pk)
+        self.assertEqual((again.status, again.attempts, again.last_error), ('queued', 0, ''))
+        self.assertTrue(worker.run_job(worker.claim()))
+
+
+@override_settings(JOBS_EAGER=False)
+class ConcurrentClaimTests(TransactionTestCase):
+    """Workers polling at once must run every job exactly once"""
+
+    workers = 6
+    jobs = 30
+
+    def test_each_job_is_claimed_once(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Shared-cache in-memory SQLite fails concurrent writers instead of queueing them')
+        for i in range(self.jobs):
+            enqueue(record, {'value': i})
+        CALLS.clear()
+        start = threading.Barrier(self.workers)
+
+        def work(name):
+            try:
+                start.wait()
+                Worker(name=name, batch_size=self.jobs).run_pending()
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work, args=(f'w{i}',)) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(CALLS), list(range(self.jobs)))
+        self.assertEqual(
+            list(Job.objects.order_by().values_list('status', 'attempts').distinct()),
+            [('succeeded', 1)]
+        )
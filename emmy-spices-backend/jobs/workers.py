@@ -0,0 +1,18 @@
+"""
+Process entry point for ``run_jobs --processes``.
+
+Spawned workers import this module before Django is set up, so it must not
+import models at module level.
+"""
+import signal
+
+
+def run_worker(options):
+    import django
+    django.setup()
+
+    from .queue import Worker
+    worker = Worker(**options)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: worker.stop())
+    worker.run()
@@ -1,3 +1,14 @@
 from django.contrib import admin
+from .models import OutboxEvent
 
-# Register your models here.
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'event_type', 'order', 'sequence', 'created_at', 'published_at', 'attempts'
+    ]
+    list_filter = ['event_type', 'created_at', 'published_at']
+    search_fields = ['order__order_number', 'last_error']
+    ordering = ['-id']
+    raw_id_fields = ['order']
+    readonly_fields = ['created_at']
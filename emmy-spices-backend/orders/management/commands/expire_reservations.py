@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.models import StockReservation
+from orders.reservations import expire_reservations
+
+
+class Command(BaseCommand):
+    help = 'Release the stock of reservations whose orders were not paid in time'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Overdue reservations loaded per query'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            help='Keep running, sweeping every this many seconds (default: sweep once)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many reservations are overdue without expiring them'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['dry_run']:
+            overdue = StockReservation.objects.filter(
+                status='active', expires_at__lt=timezone.now()
+            ).count()
+            self.stdout.write(f'{overdue} overdue reservations (dry run)')
+            return
+
+        while True:
+            started = time.perf_counter()
+            expired = expire_reservations(batch_size=options['batch_size'])
+            if expired or options['interval'] is None:
+                self.stdout.write(
+                    f'Expired {expired} reservations in {time.perf_counter() - started:.2f}s'
+                )
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
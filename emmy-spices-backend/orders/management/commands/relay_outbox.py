@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.models import OutboxEvent
+from orders.outbox import relay_batch
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending order and payment events to the OUTBOX_SINKS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Events delivered to the sinks per call'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            help='Keep running, polling every this many seconds when idle (default: relay once)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many events are pending without delivering them'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['dry_run']:
+            pending = OutboxEvent.objects.filter(published_at__isnull=True)
+            waiting = pending.filter(available_at__gt=timezone.now()).count()
+            self.stdout.write(
+                f'{pending.count()} pending events, {waiting} waiting for a retry (dry run)'
+            )
+            return
+
+        while True:
+            started = time.perf_counter()
+            published = failed = 0
+            while True:
+                batch_published, batch_failed = relay_batch(options['batch_size'])
+                if not batch_published and not batch_failed:
+                    break
+                published += batch_published
+                failed += batch_failed
+            if published or failed or options['interval'] is None:
+                self.stdout.write(
+                    f'Published {published} events, {failed} held back for retry '
+                    f'in {time.perf_counter() - started:.2f}s'
+                )
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
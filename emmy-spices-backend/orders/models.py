@@ -1,4 +1,6 @@
-from django.db import models
+import uuid
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from decimal import Decimal
@@ -21,7 +23,7 @@ class Order(models.Model):
         ('wholesale', 'Wholesale'),
     ]
 
-    order_number = models.CharField(max_length=20, unique=True)
+    order_number = models.CharField(max_length=32, unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     order_type = models.CharField(max_length=10, choices=ORDER_TYPE_CHOICES, default='retail')
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default='pending')
@@ -77,11 +79,18 @@ class Order(models.Model):
 
     def save(self, *args, **kwargs):
         """Generate order number if not provided"""
-        if not self.order_number:
-            import datetime
-            now = datetime.datetime.now()
-            self.order_number = f"ORD-{now.strftime('%Y%m%d')}-{Order.objects.count() + 1:04d}"
-        super().save(*args, **kwargs)
+        if self.order_number:
+            super().save(*args, **kwargs)
+            return
+        # Numbered by primary key: counting orders raced between concurrent
+        # checkouts (duplicate numbers) and scanned the whole table
+        with transaction.atomic(using=kwargs.get('using')):
+            self.order_number = f"NEW-{uuid.uuid4().hex[:16]}"
+            super().save(*args, **kwargs)
+            self.order_number = f"ORD-{self.created_at:%Y%m%d}-{self.pk:06d}"
+            Order.objects.using(self._state.db).filter(pk=self.pk).update(
+                order_number=self.order_number
+            )
 
     @property
     def total_items(self):
@@ -167,3 +176,67 @@ class Payment(models.Model):
 
     def __str__(self):
         return f"Payment {self.transaction_id} - {self.amount} RWF"
+
+
+class StockReservation(models.Model):
+    """Stock held for an unpaid order until payment, cancellation or expiry"""
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+        ('expired', 'Expired'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # The sweeper's lookup of overdue active reservations
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} x {self.quantity} for order {self.order.order_number} ({self.status})"
+
+
+class OutboxEvent(models.Model):
+    """An order or payment event, written with the change it records and relayed to the sinks"""
+    EVENT_TYPE_CHOICES = [
+        ('order.created', 'Order created'),
+        ('order.status_changed', 'Order status changed'),
+        ('payment.created', 'Payment created'),
+        ('payment.status_changed', 'Payment status changed'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events')
+    sequence = models.PositiveIntegerField(help_text='Position among the events of the order')
+    event_type = models.CharField(max_length=30, choices=EVENT_TYPE_CHOICES)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(null=True, blank=True, help_text='Retry not before')
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'sequence'], name='outbox_order_sequence'),
+        ]
+        indexes = [
+            # The relay's scan for undelivered events
+            models.Index(
+                fields=['id'], name='outbox_pending_idx', condition=models.Q(published_at__isnull=True)
+            ),
+            models.Index(fields=['published_at'], name='outbox_published_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.sequence} for order {self.order_id}"
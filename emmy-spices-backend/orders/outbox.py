@@ -0,0 +1,224 @@
+"""
+Transactional outbox for order and payment events.
+
+Every order or payment state change writes an ``OutboxEvent`` row with
+``record_event()`` in the same transaction, so an event exists exactly when
+its change was committed. The ``relay_outbox`` command then delivers pending
+events in batches to the sinks configured in ``OUTBOX_SINKS`` and marks them
+published.
+
+Delivery is at least once: a batch is marked published only after every sink
+accepted it, and a crash or a failing sink means it is delivered again.
+Consumers should skip events they have already seen, identified by ``id`` or
+by ``(order_id, sequence)``.
+
+Events of one order are delivered in ``sequence`` order. ``record_event``
+locks the order row, so concurrent changes to one order take consecutive
+sequence numbers and commit in that order. When a sink rejects an event, later events
+of the same order are held back until it is delivered, while other orders
+carry on. Run a single relay: two would deliver the same order's events
+concurrently.
+"""
+import json
+import os
+import urllib.request
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules, import_string
+
+from .models import Order, OutboxEvent
+
+
+class OutboxSink:
+    """Interface for delivering a batch of events"""
+
+    def deliver(self, events):
+        """Deliver ``events``, a list of event dicts, or raise to have them retried"""
+        raise NotImplementedError
+
+
+class FileSink(OutboxSink):
+    """Append events as JSON lines to a local file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def deliver(self, events):
+        with open(self.path, 'a', encoding='utf-8') as log:
+            for event in events:
+                log.write(json.dumps(event, cls=DjangoJSONEncoder) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+
+
+class WebhookSink(OutboxSink):
+    """POST each batch as a JSON array; any response but 2xx is retried"""
+
+    def __init__(self, url, timeout=10, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def deliver(self, events):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(events, cls=DjangoJSONEncoder).encode(),
+            headers=self.headers,
+            method='POST',
+        )
+        # urlopen raises HTTPError for 4xx and 5xx responses
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+# Event type ('*' for all) -> handler functions, filled by @outbox_handler
+HANDLERS = defaultdict(list)
+
+
+def outbox_handler(*event_types):
+    """Register a function called with each relayed event of the given types"""
+    def register(func):
+        for event_type in event_types or ('*',):
+            HANDLERS[event_type].append(func)
+        return func
+    return register
+
+
+class HandlerSink(OutboxSink):
+    """Call the in-process handlers registered in the apps' outbox_handlers.py"""
+
+    def __init__(self):
+        autodiscover_modules('outbox_handlers')
+
+    def deliver(self, events):
+        for event in events:
+            for handler in HANDLERS[event['type']] + HANDLERS['*']:
+                handler(event)
+
+
+_sinks = None
+
+
+def get_sinks():
+    """Instantiate the sinks of the OUTBOX_SINKS setting once per process"""
+    global _sinks
+    if _sinks is None:
+        _sinks = {
+            name: import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+            for name, config in getattr(settings, 'OUTBOX_SINKS', {}).items()
+        }
+    return _sinks
+
+
+def order_payload(order, previous_status=None):
+    return {
+        'order_number': order.order_number,
+        'user_id': order.user_id,
+        'order_type': order.order_type,
+        'status': order.status,
+        'previous_status': previous_status,
+        'payment_status': order.payment_status,
+        'total_amount': order.total_amount,
+    }
+
+
+def payment_payload(payment, previous_status=None):
+    return {
+        'payment_id': payment.pk,
+        'order_number': payment.order.order_number,
+        'amount': payment.amount,
+        'payment_method': payment.payment_method,
+        'transaction_id': payment.transaction_id,
+        'status': payment.status,
+        'previous_status': previous_status,
+    }
+
+
+def record_event(order, event_type, payload):
+    """Add an event for ``order`` to the outbox, in the caller's transaction"""
+    with transaction.atomic():
+        # Serialises the order's events: a concurrent change waits here until
+        # this transaction commits, then takes the next sequence number
+        Order.objects.select_for_update().only('pk').get(pk=order.pk)
+        last = OutboxEvent.objects.filter(order=order).aggregate(last=Max('sequence'))['last']
+        return OutboxEvent.objects.create(
+            order=order,
+            sequence=(last or 0) + 1,
+            event_type=event_type,
+            # Decimals and dates become strings, as in the delivered event
+            payload=json.loads(json.dumps(payload, cls=DjangoJSONEncoder)),
+        )
+
+
+def event_data(event):
+    """The dict delivered to the sinks for ``event``"""
+    return {
+        'id': event.pk,
+        'type': event.event_type,
+        'order_id': event.order_id,
+        'sequence': event.sequence,
+        'occurred_at': event.created_at,
+        'payload': event.payload,
+    }
+
+
+def _deliver(sinks, events):
+    data = [event_data(event) for event in events]
+    for sink in sinks.values():
+        sink.deliver(data)
+
+
+def _retry_delay(attempts):
+    backoff = getattr(settings, 'OUTBOX_RETRY_BACKOFF', 5)
+    return min(backoff * 2 ** (attempts - 1), getattr(settings, 'OUTBOX_MAX_BACKOFF', 300))
+
+
+def relay_batch(batch_size=100, sinks=None):
+    """
+    Deliver up to ``batch_size`` pending events; returns (published, failed).
+
+    The batch goes to the sinks in one call. If that fails it is retried
+    order by order, so only the orders whose events are rejected are held
+    back; events that did go through may then be delivered twice.
+    """
+    sinks = get_sinks() if sinks is None else sinks
+    now = timezone.now()
+    pending = OutboxEvent.objects.filter(published_at__isnull=True)
+    # Orders whose oldest pending event is waiting for a retry
+    blocked = set(pending.filter(available_at__gt=now).values_list('order_id', flat=True))
+    events = list(pending.exclude(order_id__in=blocked).order_by('pk')[:batch_size])
+    if not events:
+        return 0, 0
+
+    try:
+        _deliver(sinks, events)
+        delivered, failed = events, 0
+    except Exception:
+        by_order = defaultdict(list)
+        for event in events:
+            by_order[event.order_id].append(event)
+        delivered, failed = [], 0
+        for order_events in by_order.values():
+            try:
+                _deliver(sinks, order_events)
+                delivered.extend(order_events)
+            except Exception as exc:
+                head = order_events[0]
+                head.attempts += 1
+                OutboxEvent.objects.filter(pk=head.pk).update(
+                    attempts=head.attempts,
+                    available_at=now + timedelta(seconds=_retry_delay(head.attempts)),
+                    last_error=f'{type(exc).__name__}: {exc}',
+                )
+                failed += len(order_events)
+
+    OutboxEvent.objects.filter(pk__in=[event.pk for event in delivered]).update(
+        published_at=timezone.now(), available_at=None, last_error=''
+    )
+    return len(delivered), failed
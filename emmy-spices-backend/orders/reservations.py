@@ -0,0 +1,133 @@
+"""
+Stock reservations for the cart-to-order flow.
+
+Checkout reserves each ordered quantity for ``STOCK_RESERVATION_MINUTES``.
+A completed payment commits the reservations into stock decrements;
+cancelling the order releases them, and the ``expire_reservations`` command
+expires the ones that were never paid.
+
+Every step is a conditional UPDATE rather than a read-check-write, so
+concurrent checkouts cannot oversell: a reservation is only taken while
+``stock - reserved_stock`` covers it. A reservation also leaves ``active``
+exactly once, through an UPDATE filtered on its current status, so a payment
+racing the sweeper either commits or finds the reservation expired, never
+both. Each step bumps ``Product.version``, so a stale product instance can
+no longer be saved over it.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from products.models import Product
+from .models import StockReservation
+
+
+class InsufficientStock(Exception):
+    """Not enough unreserved stock for the requested quantity"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        super().__init__(f"Insufficient stock for {product.name}")
+
+
+def reservation_minutes():
+    return getattr(settings, 'STOCK_RESERVATION_MINUTES', 15)
+
+
+def reserve_stock(order, product, quantity, minutes=None):
+    """Hold ``quantity`` of ``product`` for ``order`` or raise InsufficientStock"""
+    minutes = reservation_minutes() if minutes is None else minutes
+    with transaction.atomic():
+        held = Product.objects.filter(
+            pk=product.pk, is_active=True, stock__gte=F('reserved_stock') + quantity
+        ).update(reserved_stock=F('reserved_stock') + quantity, version=F('version') + 1)
+        if not held:
+            raise InsufficientStock(product, quantity)
+        return StockReservation.objects.create(
+            order=order,
+            product=product,
+            quantity=quantity,
+            expires_at=timezone.now() + timedelta(minutes=minutes),
+        )
+
+
+def _transition(reservation, from_status, to_status):
+    """Move a reservation between states; False if it was no longer in ``from_status``"""
+    moved = StockReservation.objects.filter(pk=reservation.pk, status=from_status).update(
+        status=to_status, updated_at=timezone.now()
+    )
+    if moved:
+        reservation.status = to_status
+    return bool(moved)
+
+
+def release_reservation(reservation, status='released'):
+    """Hand an active reservation's stock back; False if it had already ended"""
+    with transaction.atomic():
+        if not _transition(reservation, 'active', status):
+            return False
+        Product.objects.filter(pk=reservation.product_id).update(
+            reserved_stock=F('reserved_stock') - reservation.quantity,
+            version=F('version') + 1,
+        )
+    return True
+
+
+def commit_reservation(reservation):
+    """
+    Turn a reservation into a stock decrement.
+
+    A reservation that expired before the payment arrived takes the stock
+    again if it is still available, and raises InsufficientStock otherwise.
+    Committing twice is a no-op.
+    """
+    quantity = reservation.quantity
+    with transaction.atomic():
+        if _transition(reservation, 'active', 'committed'):
+            Product.objects.filter(pk=reservation.product_id).update(
+                stock=F('stock') - quantity,
+                reserved_stock=F('reserved_stock') - quantity,
+                version=F('version') + 1,
+            )
+        elif _transition(reservation, 'expired', 'committed'):
+            taken = Product.objects.filter(
+                pk=reservation.product_id, stock__gte=F('reserved_stock') + quantity
+            ).update(stock=F('stock') - quantity, version=F('version') + 1)
+            if not taken:
+                raise InsufficientStock(reservation.product, quantity)
+
+
+def commit_order(order):
+    """Commit the stock of a paid order"""
+    with transaction.atomic():
+        for reservation in order.reservations.filter(
+            status__in=['active', 'expired']
+        ).select_related('product'):
+            commit_reservation(reservation)
+
+
+def release_order(order):
+    """Release the stock still held by a cancelled order"""
+    released = 0
+    for reservation in order.reservations.filter(status='active'):
+        released += release_reservation(reservation)
+    return released
+
+
+def expire_reservations(now=None, batch_size=500):
+    """Expire active reservations past their deadline; returns how many expired"""
+    overdue = StockReservation.objects.filter(
+        status='active', expires_at__lt=now or timezone.now()
+    ).order_by('expires_at')
+    expired = 0
+    while True:
+        batch = list(overdue[:batch_size])
+        if not batch:
+            return expired
+        for reservation in batch:
+            # A reservation committed or released meanwhile is skipped
+            expired += release_reservation(reservation, status='expired')
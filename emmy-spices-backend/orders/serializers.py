@@ -1,12 +1,21 @@
 from rest_framework import serializers
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from emmy_spices_backend.fastserializers import FastListSerializer
+from emmy_spices_backend.fieldsets import SparseFieldsetMixin
 from .models import Order, OrderItem, ShippingMethod, Payment
+from .outbox import order_payload, record_event
+from .reservations import InsufficientStock, release_order, reserve_stock
 from products.serializers import ProductListSerializer
 from users.serializers import UserProfileSerializer
+from users.notifications import notify
+from users.models import UserProfile, get_request_profile
 from products.models import Product
 from django.utils import timezone
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for OrderItem model"""
     product = ProductListSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
@@ -18,6 +27,8 @@ class OrderItemSerializer(serializers.ModelSerializer):
             'id', 'order', 'product', 'product_id', 'quantity', 'unit_price',
             'total_price', 'is_wholesale', 'box_quantity'
         ]
+        # Set by OrderCreateSerializer.create from the order and product
+        read_only_fields = ['order', 'unit_price']
 
 
 class ShippingMethodSerializer(serializers.ModelSerializer):
@@ -28,7 +39,7 @@ class ShippingMethodSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'cost', 'estimated_days', 'is_active', 'is_wholesale_only']
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Payment model"""
     
     class Meta:
@@ -40,11 +51,11 @@ class PaymentSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Order model"""
     items = OrderItemSerializer(many=True, read_only=True)
     payments = PaymentSerializer(many=True, read_only=True)
-    user_profile = UserProfileSerializer(source='user.profile', read_only=True)
+    user_profile = serializers.SerializerMethodField()
     total_items = serializers.IntegerField(read_only=True)
     can_cancel = serializers.BooleanField(read_only=True)
     can_refund = serializers.BooleanField(read_only=True)
@@ -65,8 +76,29 @@ class OrderSerializer(serializers.ModelSerializer):
             'total_items', 'can_cancel', 'can_refund'
         ]
 
+    field_dependencies = {
+        'user_profile': ['user__profile'],
+        'total_items': ['items'],
+        'can_cancel': ['status'],
+        'can_refund': ['status', 'payment_status'],
+    }
 
-class OrderListSerializer(serializers.ModelSerializer):
+    def get_user_profile(self, obj):
+        """Serialize the customer's profile, reusing the request's cached one"""
+        request = self.context.get('request')
+        if request is not None and obj.user_id == request.user.id:
+            profile = get_request_profile(request)
+        else:
+            try:
+                profile = obj.user.profile
+            except UserProfile.DoesNotExist:
+                profile = None
+        if profile is None:
+            return None
+        return UserProfileSerializer(profile, context=self.context).data
+
+
+class OrderListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Simplified serializer for order lists"""
     total_items = serializers.IntegerField(read_only=True)
     can_cancel = serializers.BooleanField(read_only=True)
@@ -80,6 +112,32 @@ class OrderListSerializer(serializers.ModelSerializer):
             'can_cancel', 'can_refund'
         ]
 
+    expandable_fields = {
+        'items': OrderItemSerializer(many=True, read_only=True),
+        'payments': PaymentSerializer(many=True, read_only=True),
+    }
+    field_dependencies = {
+        'total_items': ['items'],
+        'can_cancel': ['status'],
+        'can_refund': ['status', 'payment_status'],
+    }
+
+
+class FastOrderListSerializer(FastListSerializer):
+    """OrderListSerializer built from ``.values()`` rows"""
+    serializer_class = OrderListSerializer
+    # Order.total_items, summed per listed order in the query rather than
+    # with a GROUP BY over every order before the page is cut
+    annotations = {
+        'total_items': Coalesce(
+            Subquery(
+                OrderItem.objects.filter(order=OuterRef('pk'))
+                .values('order').annotate(total=Sum('quantity')).values('total')
+            ),
+            0,
+        ),
+    }
+
 
 class OrderCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating orders"""
@@ -94,8 +152,9 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             'shipping_postal_code', 'notes', 'items', 'shipping_method_id'
         ]
 
+    @transaction.atomic
     def create(self, validated_data):
-        """Create order with items"""
+        """Create order with items, reserving their stock"""
         items_data = validated_data.pop('items', [])
         shipping_method_id = validated_data.pop('shipping_method_id', None)
         
@@ -110,8 +169,8 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             except ShippingMethod.DoesNotExist:
                 pass
         
-        # Create order
-        order = Order.objects.create(**validated_data)
+        # Create order; totals are filled in once the items are priced
+        order = Order.objects.create(subtotal=0, total_amount=0, **validated_data)
         
         # Create order items
         subtotal = 0
@@ -133,11 +192,19 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             
             order_item = OrderItem.objects.create(**item_data)
             subtotal += order_item.total_price
+            
+            # Validation only saw a snapshot; the reservation is what stops
+            # concurrent orders from overselling
+            try:
+                reserve_stock(order, product, order_item.quantity)
+            except InsufficientStock as exc:
+                raise serializers.ValidationError(str(exc))
         
         # Calculate totals
         order.subtotal = subtotal
         order.total_amount = subtotal + order.tax_amount + order.shipping_cost
         order.save()
+        record_event(order, 'order.created', order_payload(order))
         
         return order
 
@@ -158,7 +225,7 @@ class OrderCreateSerializer(serializers.ModelSerializer):
                 if not product.is_active:
                     raise serializers.ValidationError(f"Product {product.name} is not active")
                 
-                if product.stock < item.get('quantity', 1):
+                if product.available_stock < item.get('quantity', 1):
                     raise serializers.ValidationError(f"Insufficient stock for {product.name}")
                     
             except Product.DoesNotExist:
@@ -199,6 +266,17 @@ class OrderUpdateSerializer(serializers.ModelSerializer):
         
         return value
 
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """Update the order, releasing reserved stock on cancellation"""
+        previous_status = instance.status
+        instance = super().update(instance, validated_data)
+        if instance.status != previous_status:
+            if instance.status == 'cancelled':
+                release_order(instance)
+            record_event(instance, 'order.status_changed', order_payload(instance, previous_status))
+        return instance
+
 
 class OrderStatusUpdateSerializer(serializers.Serializer):
     """Serializer for updating order status"""
@@ -209,9 +287,7 @@ class OrderStatusUpdateSerializer(serializers.Serializer):
         """Update order status"""
         status = validated_data['status']
         notes = validated_data.get('notes', '')
-        
-        # Update status
-        instance.status = status
+        previous_status = instance.status
         
         # Add notes
         if notes:
@@ -220,13 +296,35 @@ class OrderStatusUpdateSerializer(serializers.Serializer):
             else:
                 instance.admin_notes = notes
         
+        # A repeated update only keeps its notes: no event, no notification
+        if status == previous_status:
+            if notes:
+                instance.save()
+            return instance
+        
+        # Update status
+        instance.status = status
+        
         # Set timestamps
         if status == 'shipped' and not instance.shipped_at:
             instance.shipped_at = timezone.now()
         elif status == 'delivered' and not instance.delivered_at:
             instance.delivered_at = timezone.now()
         
-        instance.save()
+        with transaction.atomic():
+            instance.save()
+            if status == 'cancelled':
+                release_order(instance)
+            record_event(
+                instance, 'order.status_changed', order_payload(instance, previous_status)
+            )
+        
+        notify(
+            instance.user,
+            'order_status',
+            f"Order {instance.order_number} is {instance.get_status_display().lower()}",
+            f"Your order {instance.order_number} status changed to {instance.get_status_display()}."
+        )
         return instance
 
 
@@ -1,3 +1,368 @@
-from django.test import TestCase
+import threading
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from products.models import Category, Product, StaleProductError
+from users.models import Notification
+from .models import Order, OrderItem, OutboxEvent, StockReservation
+from emmy_spices_backend.renderers import ORJSONRenderer
+from .outbox import OutboxSink, order_payload, record_event, relay_batch
+from .serializers import FastOrderListSerializer, OrderListSerializer
+from .reservations import (
+    InsufficientStock, commit_order, commit_reservation, expire_reservations,
+    release_order, reserve_stock
+)
+
+
+def make_product(stock):
+    category = Category.objects.create(name=f'Spices {Category.objects.count()}')
+    return Product.objects.create(
+        name='Black Pepper', description='Whole peppercorns', category=category,
+        price=Decimal('5.00'), retail_price=Decimal('5.00'),
+        wholesale_price=Decimal('4.00'), stock=stock,
+    )
+
+
+def make_order(user):
+    return Order.objects.create(
+        user=user, customer_name='Test', customer_email='test@example.com',
+        shipping_address='1 KG Ave', shipping_city='Kigali', shipping_state='Kigali',
+        subtotal=0, total_amount=0,
+    )
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.product = make_product(stock=10)
+        self.order = make_order(self.user)
+
+    def test_reserve_holds_stock_without_decrementing_it(self):
+        reserve_stock(self.order, self.product, 4)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock), (10, 4))
+        self.assertEqual(self.product.available_stock, 6)
+
+    def test_reserve_more_than_available_fails(self):
+        reserve_stock(self.order, self.product, 8)
+        with self.assertRaises(InsufficientStock):
+            reserve_stock(make_order(self.user), self.product, 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 8)
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_commit_decrements_stock_once(self):
+        reserve_stock(self.order, self.product, 4)
+        commit_order(self.order)
+        commit_order(self.order)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock), (6, 0))
+
+    def test_release_returns_stock(self):
+        reserve_stock(self.order, self.product, 4)
+        self.assertEqual(release_order(self.order), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock), (10, 0))
+        self.assertEqual(self.order.reservations.get().status, 'released')
+
+    def test_sweeper_expires_only_overdue_reservations(self):
+        overdue = reserve_stock(self.order, self.product, 3, minutes=-1)
+        current = reserve_stock(make_order(self.user), self.product, 2)
+        self.assertEqual(expire_reservations(), 1)
+        overdue.refresh_from_db()
+        current.refresh_from_db()
+        self.assertEqual((overdue.status, current.status), ('expired', 'active'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 2)
+
+    def test_commit_after_expiry_takes_stock_if_still_available(self):
+        reservation = reserve_stock(self.order, self.product, 3, minutes=-1)
+        expire_reservations()
+        commit_reservation(reservation)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock), (7, 0))
+
+    def test_commit_after_expiry_fails_when_stock_is_gone(self):
+        reservation = reserve_stock(self.order, self.product, 3, minutes=-1)
+        expire_reservations()
+        reserve_stock(make_order(self.user), self.product, 9)
+        with self.assertRaises(InsufficientStock):
+            commit_reservation(reservation)
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'expired')
+
+    def test_stale_product_save_is_rejected(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        reserve_stock(self.order, self.product, 4)
+        stale.stock = 20
+        with self.assertRaises(StaleProductError), transaction.atomic():
+            stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock), (10, 4))
+
+
+class CheckoutReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = make_product(stock=5)
+
+    def checkout(self, quantity):
+        return self.client.post('/api/orders/api/orders/', {
+            'order_type': 'retail',
+            'customer_name': 'Test',
+            'customer_email': 'test@example.com',
+            'shipping_address': '1 KG Ave',
+            'shipping_city': 'Kigali',
+            'shipping_state': 'Kigali',
+            'items': [{'product_id': self.product.pk, 'quantity': quantity}],
+        }, format='json')
+
+    def test_checkout_reserves_and_payment_commits(self):
+        self.assertEqual(self.checkout(3).status_code, 201)
+        order = Order.objects.get()
+        response = self.client.post('/api/orders/api/payments/', {
+            'order': order.pk, 'amount': '15.00', 'payment_method': 'momo',
+            'status': 'completed',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock), (2, 0))
+
+    def test_checkout_beyond_available_stock_is_rejected(self):
+        self.assertEqual(self.checkout(3).status_code, 201)
+        response = self.checkout(3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_stale_product_update_conflicts(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        self.client.force_authenticate(staff)
+        version = self.product.version
+        self.checkout(1)
+        response = self.client.patch(
+            f'/api/products/api/products/{self.product.pk}/',
+            {'stock': 50, 'version': version}, format='json'
+        )
+        self.assertEqual(response.status_code, 409)
+
+
+class RecordingSink(OutboxSink):
+    def __init__(self, reject_order=None):
+        self.delivered = []
+        self.reject_order = reject_order
+
+    def deliver(self, events):
+        if any(event['order_id'] == self.reject_order for event in events):
+            raise ConnectionError('sink unavailable')
+        self.delivered.extend(events)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+
+    def set_status(self, order, status):
+        return self.client.post(
+            f'/api/orders/api/orders/{order.pk}/update_status/', {'status': status}, format='json'
+        )
+
+    def test_status_changes_are_recorded_in_sequence(self):
+        order = make_order(self.user)
+        self.set_status(order, 'processing')
+        self.set_status(order, 'processing')
+        self.set_status(order, 'shipped')
+        events = list(order.events.values_list('sequence', 'payload__previous_status', 'payload__status'))
+        self.assertEqual(events, [(1, 'pending', 'processing'), (2, 'processing', 'shipped')])
+
+    def test_repeated_status_only_keeps_its_notes(self):
+        order = make_order(self.user)
+        self.set_status(order, 'processing')
+        self.client.post(
+            f'/api/orders/api/orders/{order.pk}/update_status/',
+            {'status': 'processing', 'notes': 'Packed'}, format='json'
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.admin_notes, 'Packed')
+        self.assertEqual(order.events.count(), 1)
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 1)
+
+    def test_event_rolls_back_with_its_change(self):
+        order = make_order(self.user)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            record_event(order, 'order.created', order_payload(order))
+            raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_relay_publishes_each_event_once_in_order(self):
+        orders = [make_order(self.user) for _ in range(2)]
+        for status in ('processing', 'shipped'):
+            for order in orders:
+                self.set_status(order, status)
+        sink = RecordingSink()
+        self.assertEqual(relay_batch(batch_size=3, sinks={'test': sink}), (3, 0))
+        self.assertEqual(relay_batch(batch_size=3, sinks={'test': sink}), (1, 0))
+        self.assertEqual(relay_batch(batch_size=3, sinks={'test': sink}), (0, 0))
+        for order in orders:
+            self.assertEqual(
+                [event['sequence'] for event in sink.delivered if event['order_id'] == order.pk],
+                [1, 2]
+            )
+
+    def test_rejected_order_holds_back_only_its_own_events(self):
+        stuck, other = make_order(self.user), make_order(self.user)
+        for status in ('processing', 'shipped'):
+            self.set_status(stuck, status)
+            self.set_status(other, status)
+        sink = RecordingSink(reject_order=stuck.pk)
+        self.assertEqual(relay_batch(sinks={'test': sink}), (2, 2))
+        self.assertEqual({event['order_id'] for event in sink.delivered}, {other.pk})
+        head = stuck.events.get(sequence=1)
+        self.assertEqual(head.attempts, 1)
+        self.assertIn('sink unavailable', head.last_error)
+
+        # Backing off: nothing is retried until the head event is due
+        self.assertEqual(relay_batch(sinks={'test': sink}), (0, 0))
+        sink.reject_order = None
+        OutboxEvent.objects.filter(pk=head.pk).update(available_at=None)
+        self.assertEqual(relay_batch(sinks={'test': sink}), (2, 0))
+        self.assertEqual(
+            [event['sequence'] for event in sink.delivered if event['order_id'] == stuck.pk], [1, 2]
+        )
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    """Workers racing for the last units of one SKU must never oversell it"""
+
+    workers = 8
+    attempts_per_worker = 5
+
+    def test_concurrent_reservations_do_not_oversell(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Shared-cache in-memory SQLite fails concurrent writers instead of queueing them')
+        user = User.objects.create_user('buyer')
+        product = make_product(stock=17)
+        orders = [make_order(user) for _ in range(self.workers)]
+        outcomes = []
+        lock = threading.Lock()
+        start = threading.Barrier(self.workers)
+
+        def worker(order):
+            try:
+                start.wait()
+                for _ in range(self.attempts_per_worker):
+                    try:
+                        reserve_stock(order, product, 1)
+                        result = 'reserved'
+                    except InsufficientStock:
+                        result = 'refused'
+                    with lock:
+                        outcomes.append(result)
+            except OperationalError as exc:
+                with lock:
+                    outcomes.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(outcomes), self.workers * self.attempts_per_worker)
+        self.assertEqual(outcomes.count('reserved'), 17, outcomes)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.reserved_stock), (17, 17))
+        self.assertEqual(StockReservation.objects.filter(status='active').count(), 17)
+
+
+class FastOrderListSerializerTests(TestCase):
+    def test_matches_order_list_serializer(self):
+        user = User.objects.create_user('buyer')
+        empty = make_order(user)
+        with_items = make_order(user)
+        for quantity in (2, 5):
+            OrderItem.objects.create(
+                order=with_items, product=make_product(stock=50), quantity=quantity,
+                unit_price=Decimal('5.00')
+            )
+        refundable = make_order(user)
+        Order.objects.filter(pk=refundable.pk).update(
+            status='delivered', payment_status='paid', total_amount=Decimal('99.9')
+        )
+        Order.objects.filter(pk=empty.pk).update(status='cancelled', order_type='wholesale')
+
+        queryset = Order.objects.order_by('-created_at')
+        expected = JSONRenderer().render(OrderListSerializer(queryset, many=True).data)
+        fast = FastOrderListSerializer()
+        actual = ORJSONRenderer().render(fast.to_representation(fast.values(queryset)))
+        self.assertEqual(actual, expected)
+        self.assertEqual(
+            [row['total_items'] for row in fast.to_representation(fast.values(queryset))],
+            [0, 7, 0]
+        )
+
+
+class OrderSparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.order = make_order(self.user)
+        for quantity in (2, 3):
+            OrderItem.objects.create(
+                order=self.order, product=make_product(stock=10), quantity=quantity,
+                unit_price=Decimal('5.00'), total_price=Decimal('5.00') * quantity,
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_expands_nested_fields(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                '/api/orders/api/orders/?expand=items'
+                '&fields=id,total_items,items.quantity,items.product.name'
+            )
+        self.assertEqual(response.json()['results'], [{
+            'id': self.order.pk,
+            'total_items': 5,
+            'items': [
+                {'product': {'name': 'Black Pepper'}, 'quantity': 2},
+                {'product': {'name': 'Black Pepper'}, 'quantity': 3},
+            ],
+        }])
+
+    def test_detail_skips_excluded_relations(self):
+        path = f'/api/orders/api/orders/{self.order.pk}/'
+        full = self.client.get(path).json()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'{path}?exclude=user_profile,payments,items.product')
+        data = response.json()
+        self.assertNotIn('user_profile', data)
+        self.assertNotIn('payments', data)
+        self.assertEqual(data['items'][0], {
+            key: value for key, value in full['items'][0].items() if key != 'product'
+        })
+
+
+class OrderNumberTests(TestCase):
+    def test_numbered_by_primary_key(self):
+        order = make_order(User.objects.create_user('buyer'))
+        order.refresh_from_db()
+        self.assertEqual(order.order_number, f'ORD-{order.created_at:%Y%m%d}-{order.pk:06d}')
+
+    def test_largest_primary_key_fits(self):
+        order = make_order(User.objects.create_user('buyer'))
+        order.pk = 2 ** 63 - 1
+        order.order_number = ''
+        order.save()
+        max_length = Order._meta.get_field('order_number').max_length
+        self.assertLessEqual(len(order.order_number), max_length)
+        order.full_clean()
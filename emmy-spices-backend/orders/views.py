@@ -1,29 +1,38 @@
-from rest_framework import viewsets, status, filters
+from rest_framework import viewsets, status, filters, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import transaction
 from django.db.models import Q, Sum, Count
 from django.utils import timezone
 from datetime import datetime, timedelta
 
+from emmy_spices_backend.fastserializers import FastListMixin
+from emmy_spices_backend.metrics import SerializerTimingMixin
+from users.notifications import notify
 from .models import Order, OrderItem, ShippingMethod, Payment
+from .outbox import payment_payload, record_event
+from .reservations import InsufficientStock, commit_order
 from .serializers import (
     OrderSerializer, OrderListSerializer, OrderCreateSerializer,
     OrderUpdateSerializer, OrderStatusUpdateSerializer, OrderFilterSerializer,
-    OrderStatisticsSerializer, ShippingMethodSerializer, PaymentSerializer
+    OrderStatisticsSerializer, ShippingMethodSerializer, PaymentSerializer,
+    FastOrderListSerializer
 )
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SerializerTimingMixin, FastListMixin, viewsets.ModelViewSet):
     """ViewSet for Order model"""
     queryset = Order.objects.all()
+    fast_list_serializer_class = FastOrderListSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['status', 'order_type', 'payment_status']
     search_fields = ['order_number', 'customer_name', 'customer_email']
     ordering_fields = ['created_at', 'total_amount', 'status']
     ordering = ['-created_at']
+    throttle_costs = {'statistics': 10}
 
     def get_queryset(self):
         """Filter queryset based on user"""
@@ -51,6 +60,9 @@ class OrderViewSet(viewsets.ModelViewSet):
         if max_amount:
             queryset = queryset.filter(total_amount__lte=max_amount)
         
+        if self.action == 'retrieve':
+            queryset = queryset.select_related('user__profile')
+        
         return queryset
 
     def get_serializer_class(self):
@@ -76,7 +88,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         
         if serializer.is_valid():
             serializer.update(order, serializer.validated_data)
-            return Response(OrderSerializer(order).data)
+            return Response(OrderSerializer(order, context={'request': request}).data)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -138,7 +150,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class ShippingMethodViewSet(viewsets.ReadOnlyModelViewSet):
+class ShippingMethodViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for ShippingMethod model"""
     queryset = ShippingMethod.objects.filter(is_active=True)
     serializer_class = ShippingMethodSerializer
@@ -158,7 +170,7 @@ class ShippingMethodViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     """ViewSet for Payment model"""
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
@@ -177,3 +189,46 @@ class PaymentViewSet(viewsets.ModelViewSet):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsAuthenticated()]
         return [IsAuthenticatedOrReadOnly()]
+
+    def perform_create(self, serializer):
+        """Save the payment and notify the order's customer"""
+        with transaction.atomic():
+            payment = serializer.save()
+            if payment.status == 'completed':
+                self._commit_stock(payment)
+            record_event(payment.order, 'payment.created', payment_payload(payment))
+        self._notify_payment(payment)
+
+    def perform_update(self, serializer):
+        """Save the payment and notify the customer if its status changed"""
+        previous_status = serializer.instance.status
+        with transaction.atomic():
+            payment = serializer.save()
+            if payment.status == 'completed' and previous_status != 'completed':
+                self._commit_stock(payment)
+            if payment.status != previous_status:
+                record_event(
+                    payment.order, 'payment.status_changed',
+                    payment_payload(payment, previous_status)
+                )
+        if payment.status != previous_status:
+            self._notify_payment(payment)
+
+    def _commit_stock(self, payment):
+        """Turn the order's stock reservations into decrements"""
+        try:
+            commit_order(payment.order)
+        except InsufficientStock as exc:
+            raise serializers.ValidationError(
+                f"{exc}; the order's reservation expired and the stock is gone"
+            )
+
+    def _notify_payment(self, payment):
+        order = payment.order
+        notify(
+            order.user,
+            'payment',
+            f"Payment {payment.get_status_display().lower()} for order {order.order_number}",
+            f"Your payment of {payment.amount} RWF for order {order.order_number} "
+            f"is {payment.get_status_display().lower()}."
+        )
@@ -4,7 +4,7 @@ from .models import Product, Category, ProductImage, ProductReview
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'description', 'created_at']
+    list_display = ['name', 'description', 'reorder_threshold', 'created_at']
     list_filter = ['created_at']
     search_fields = ['name', 'description']
     ordering = ['name']
@@ -32,7 +32,10 @@ class ProductAdmin(admin.ModelAdmin):
     ]
     search_fields = ['name', 'description']
     ordering = ['-created_at']
-    readonly_fields = ['rating', 'num_reviews', 'stock_status', 'is_in_stock']
+    readonly_fields = [
+        'rating', 'num_reviews', 'reserved_stock', 'effective_reorder_threshold',
+        'stock_status', 'is_in_stock'
+    ]
     
     fieldsets = (
         ('Basic Information', {
@@ -42,7 +45,10 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('price', 'retail_price', 'wholesale_price')
         }),
         ('Inventory', {
-            'fields': ('stock', 'box_size')
+            'fields': (
+                'stock', 'reserved_stock', 'box_size', 'reorder_threshold',
+                'effective_reorder_threshold', 'stock_status'
+            )
         }),
         ('Status', {
             'fields': ('is_active', 'is_featured')
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='reorder_threshold',
+            field=models.PositiveIntegerField(default=50, help_text='Stock level below which products in this category need reordering'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_reorder_threshold',
+            field=models.PositiveIntegerField(default=50, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reorder_threshold',
+            field=models.PositiveIntegerField(blank=True, help_text='Overrides the category reorder threshold when set', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('stock__lt', models.F('effective_reorder_threshold'))), fields=['stock', 'category'], name='product_below_threshold_idx'),
+        ),
+    ]
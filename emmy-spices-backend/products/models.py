@@ -1,12 +1,29 @@
 from django.db import models
+from django.db.models import F, Q
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
 
+from emmy_spices_backend.images import job_key, prepare_variants
+from jobs.queue import enqueue
+
+
+# Stock level below which a product is reported as "Low Stock" unless its
+# category or the product itself configures a different reorder threshold.
+DEFAULT_REORDER_THRESHOLD = 50
+
+
+class StaleProductError(Exception):
+    """The product row changed since the instance being saved was read"""
+
 
 class Category(models.Model):
     """Product category model"""
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
+    reorder_threshold = models.PositiveIntegerField(
+        default=DEFAULT_REORDER_THRESHOLD,
+        help_text="Stock level below which products in this category need reordering"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -17,6 +34,31 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Propagate the threshold to products that inherit it, as a new version"""
+        super().save(*args, **kwargs)
+        self.products.filter(reorder_threshold__isnull=True).exclude(
+            effective_reorder_threshold=self.reorder_threshold
+        ).update(
+            effective_reorder_threshold=self.reorder_threshold, version=F('version') + 1
+        )
+
+
+class ProductQuerySet(models.QuerySet):
+    """Stock level lookups backed by the below-threshold partial index"""
+
+    def below_threshold(self):
+        """Products whose stock is below their reorder threshold"""
+        return self.filter(stock__lt=F('effective_reorder_threshold'))
+
+    def low_stock(self):
+        """Products below their reorder threshold but still in stock"""
+        return self.below_threshold().filter(stock__gt=0)
+
+    def out_of_stock(self):
+        """Products with no stock left"""
+        return self.filter(stock=0)
+
 
 class Product(models.Model):
     """Product model for Emmy Spices"""
@@ -40,7 +82,15 @@ class Product(models.Model):
         help_text="Price for distributors (per box)"
     )
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Thumbnails and WebP renditions of the image (see emmy_spices_backend.images)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     stock = models.PositiveIntegerField(default=0)
+    # Held by unpaid orders (see orders.reservations); only changed through
+    # conditional UPDATEs, never from a possibly stale instance
+    reserved_stock = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped by every write to the row; save() only succeeds against the
+    # version the instance was read at
+    version = models.PositiveIntegerField(default=0)
     box_size = models.PositiveIntegerField(default=24, help_text="Number of pieces per box")
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     is_active = models.BooleanField(default=True)
@@ -52,15 +102,90 @@ class Product(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(5)]
     )
     num_reviews = models.PositiveIntegerField(default=0)
+    reorder_threshold = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Overrides the category reorder threshold when set"
+    )
+    # Denormalized copy of the threshold that applies to this product, so that
+    # "below threshold" lookups compare two columns of the same row.
+    effective_reorder_threshold = models.PositiveIntegerField(
+        default=DEFAULT_REORDER_THRESHOLD,
+        editable=False
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['stock', 'category'],
+                name='product_below_threshold_idx',
+                condition=Q(stock__lt=F('effective_reorder_threshold')),
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(reserved_stock__lte=F('stock')),
+                name='product_reserved_within_stock',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Resolve the effective reorder threshold before saving"""
+        threshold = self.reorder_threshold
+        if threshold is None and self.category_id:
+            threshold = self.category.reorder_threshold
+        self.effective_reorder_threshold = (
+            DEFAULT_REORDER_THRESHOLD if threshold is None else threshold
+        )
+        update_fields = kwargs.get('update_fields')
+        render_image = prepare_variants(self, 'image', update_fields)
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'effective_reorder_threshold', 'version'}
+            if 'image' in update_fields:
+                kwargs['update_fields'].add('image_variants')
+        if self._state.adding:
+            super().save(*args, **kwargs)
+        else:
+            self.version += 1
+            try:
+                super().save(*args, **kwargs)
+            except StaleProductError:
+                self.version -= 1
+                raise
+        if render_image:
+            self.render_image_variants()
+
+    def render_image_variants(self):
+        from .tasks import render_image_variants
+        enqueue(
+            render_image_variants, {'model': 'product', 'pk': self.pk},
+            key=job_key(self, 'image')
+        )
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Optimistic concurrency: only overwrite the row at the version this
+        # instance was read at, so a concurrent reservation or edit is not lost
+        updated = super()._do_update(
+            base_qs.filter(version=self.version - 1), using, pk_val, values,
+            update_fields, forced_update
+        )
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise StaleProductError(f"Product {pk_val} was changed concurrently")
+        return updated
+
+    @property
+    def available_stock(self):
+        """Stock not held by unpaid orders"""
+        return self.stock - self.reserved_stock
+
     @property
     def is_in_stock(self):
         """Check if product is in stock"""
@@ -71,23 +196,17 @@ class Product(models.Model):
         """Get stock status string"""
         if self.stock == 0:
             return "Out of Stock"
-        elif self.stock < 50:
+        elif self.stock < self.effective_reorder_threshold:
             return "Low Stock"
         else:
             return "In Stock"
 
-    def update_rating(self, new_rating):
-        """Update product rating"""
-        total_rating = (self.rating * self.num_reviews) + new_rating
-        self.num_reviews += 1
-        self.rating = total_rating / self.num_reviews
-        self.save()
-
 
 class ProductImage(models.Model):
     """Additional product images"""
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -98,6 +217,23 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.alt_text or 'Image'}"
 
+    def save(self, *args, **kwargs):
+        """Queue the rendering of a new image's variants"""
+        update_fields = kwargs.get('update_fields')
+        render_image = prepare_variants(self, 'image', update_fields)
+        if update_fields is not None and 'image' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'image_variants'}
+        super().save(*args, **kwargs)
+        if render_image:
+            self.render_image_variants()
+
+    def render_image_variants(self):
+        from .tasks import render_image_variants
+        enqueue(
+            render_image_variants, {'model': 'productimage', 'pk': self.pk},
+            key=job_key(self, 'image')
+        )
+
 
 class ProductReview(models.Model):
     """Product review model"""
@@ -120,6 +256,16 @@ class ProductReview(models.Model):
         return f"{self.user.username} - {self.product.name} - {self.rating} stars"
 
     def save(self, *args, **kwargs):
-        """Override save to update product rating"""
+        """Override save to queue a refresh of the product rating"""
         super().save(*args, **kwargs)
-        self.product.update_rating(self.rating)
+        self.refresh_product_rating()
+
+    def delete(self, *args, **kwargs):
+        """Override delete to queue a refresh of the product rating"""
+        result = super().delete(*args, **kwargs)
+        self.refresh_product_rating()
+        return result
+
+    def refresh_product_rating(self):
+        from .tasks import refresh_product_rating
+        enqueue(refresh_product_rating, {'product_id': self.product_id})
@@ -1,4 +1,8 @@
 from rest_framework import serializers
+
+from emmy_spices_backend.fastserializers import FastListSerializer
+from emmy_spices_backend.fieldsets import SparseFieldsetMixin
+from emmy_spices_backend.images import ImageVariantsField
 from .models import Product, Category, ProductImage, ProductReview
 
 
@@ -8,7 +12,10 @@ class CategorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'product_count', 'created_at', 'updated_at']
+        fields = [
+            'id', 'name', 'description', 'reorder_threshold', 'product_count',
+            'created_at', 'updated_at'
+        ]
 
     def get_product_count(self, obj):
         return obj.products.count()
@@ -16,10 +23,11 @@ class CategorySerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     """Serializer for ProductImage model"""
+    image_variants = ImageVariantsField()
     
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'alt_text', 'is_primary', 'created_at']
+        fields = ['id', 'image', 'image_variants', 'alt_text', 'is_primary', 'created_at']
 
 
 class ProductReviewSerializer(serializers.ModelSerializer):
@@ -41,7 +49,7 @@ class ProductReviewSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Product model"""
     category = CategorySerializer(read_only=True)
     category_id = serializers.IntegerField(write_only=True)
@@ -49,6 +57,7 @@ class ProductSerializer(serializers.ModelSerializer):
     reviews = ProductReviewSerializer(many=True, read_only=True)
     stock_status = serializers.CharField(read_only=True)
     is_in_stock = serializers.BooleanField(read_only=True)
+    available_stock = serializers.IntegerField(read_only=True)
     average_rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
     review_count = serializers.IntegerField(read_only=True)
 
@@ -56,14 +65,26 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = [
             'id', 'name', 'description', 'price', 'retail_price', 'wholesale_price',
-            'image', 'stock', 'box_size', 'category', 'category_id', 'is_active',
+            'image', 'stock', 'available_stock', 'version', 'box_size', 'reorder_threshold',
+            'effective_reorder_threshold', 'category', 'category_id', 'is_active',
             'is_featured', 'rating', 'num_reviews', 'stock_status', 'is_in_stock',
             'average_rating', 'review_count', 'images', 'reviews', 'created_at', 'updated_at'
         ]
 
+    field_dependencies = {
+        'stock_status': ['stock', 'effective_reorder_threshold'],
+        'is_in_stock': ['stock'],
+        'available_stock': ['stock', 'reserved_stock'],
+        'average_rating': ['reviews'],
+        'review_count': ['reviews'],
+        'related_products': ['category'],
+    }
+
     def to_representation(self, instance):
         """Custom representation with calculated fields"""
         data = super().to_representation(instance)
+        if 'average_rating' not in self.fields and 'review_count' not in self.fields:
+            return data
         
         # Calculate average rating from reviews
         reviews = instance.reviews.all()
@@ -73,24 +94,39 @@ class ProductSerializer(serializers.ModelSerializer):
         else:
             data['average_rating'] = 0.0
             data['review_count'] = 0
+        for name in ('average_rating', 'review_count'):
+            if name not in self.fields:
+                del data[name]
         
         return data
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Simplified serializer for product lists"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     stock_status = serializers.CharField(read_only=True)
     is_in_stock = serializers.BooleanField(read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'description', 'price', 'retail_price', 'wholesale_price',
-            'image', 'stock', 'box_size', 'category_name', 'is_active', 'is_featured',
-            'rating', 'stock_status', 'is_in_stock', 'created_at'
+            'image', 'image_variants', 'stock', 'box_size', 'category_name', 'is_active',
+            'is_featured', 'rating', 'stock_status', 'is_in_stock', 'created_at'
         ]
 
+    expandable_fields = {'images': ProductImageSerializer(many=True, read_only=True)}
+    field_dependencies = {
+        'stock_status': ['stock', 'effective_reorder_threshold'],
+        'is_in_stock': ['stock'],
+    }
+
+
+class FastProductListSerializer(FastListSerializer):
+    """ProductListSerializer built from ``.values()`` rows"""
+    serializer_class = ProductListSerializer
+
 
 class ProductDetailSerializer(ProductSerializer):
     """Detailed serializer for single product view"""
@@ -101,10 +137,13 @@ class ProductDetailSerializer(ProductSerializer):
 
     def get_related_products(self, obj):
         """Get related products from the same category"""
-        related = Product.objects.filter(
-            category=obj.category,
-            is_active=True
-        ).exclude(id=obj.id)[:4]
+        # Passed in by callers that fetched them already
+        related = self.context.get('related_products')
+        if related is None:
+            related = Product.objects.filter(
+                category=obj.category,
+                is_active=True
+            ).exclude(id=obj.id)[:4]
         return ProductListSerializer(related, many=True).data
 
 
@@ -116,7 +155,8 @@ class ProductCreateSerializer(serializers.ModelSerializer):
         model = Product
         fields = [
             'name', 'description', 'price', 'retail_price', 'wholesale_price',
-            'image', 'stock', 'box_size', 'category_id', 'is_active', 'is_featured', 'images'
+            'image', 'stock', 'box_size', 'reorder_threshold', 'category_id',
+            'is_active', 'is_featured', 'images'
         ]
 
     def create(self, validated_data):
@@ -133,14 +173,25 @@ class ProductCreateSerializer(serializers.ModelSerializer):
 class ProductUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating products"""
     images = ProductImageSerializer(many=True, required=False)
+    # The version the client read; the update fails if the product changed since
+    version = serializers.IntegerField(required=False, min_value=0)
 
     class Meta:
         model = Product
         fields = [
             'name', 'description', 'price', 'retail_price', 'wholesale_price',
-            'image', 'stock', 'box_size', 'category_id', 'is_active', 'is_featured', 'images'
+            'image', 'stock', 'box_size', 'reorder_threshold', 'category_id',
+            'is_active', 'is_featured', 'images', 'version'
         ]
 
+    def validate_stock(self, value):
+        """Stock cannot drop below what unpaid orders hold"""
+        if self.instance and value < self.instance.reserved_stock:
+            raise serializers.ValidationError(
+                f"{self.instance.reserved_stock} units are reserved by unpaid orders"
+            )
+        return value
+
     def update(self, instance, validated_data):
         """Handle nested image updates"""
         images_data = validated_data.pop('images', [])
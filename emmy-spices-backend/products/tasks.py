@@ -0,0 +1,33 @@
+from decimal import Decimal
+
+from django.db.models import Avg, Count, F
+
+from emmy_spices_backend.images import render_variants
+from jobs.queue import task
+from .models import Product, ProductImage, ProductReview
+
+
+@task(priority=10)
+def refresh_product_rating(product_id):
+    """Recompute a product's rating and review count from its reviews"""
+    stats = ProductReview.objects.filter(product_id=product_id).aggregate(
+        rating=Avg('rating'), num_reviews=Count('pk')
+    )
+    rating = Decimal(stats['rating'] or 0).quantize(Decimal('0.01'))
+    Product.objects.filter(pk=product_id).update(
+        rating=rating, num_reviews=stats['num_reviews'], version=F('version') + 1
+    )
+
+
+@task(priority=-5, max_attempts=3)
+def render_image_variants(model, pk):
+    """Render the thumbnails and WebP variants of a product's or product image's image"""
+    model = {'product': Product, 'productimage': ProductImage}[model]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not instance.image:
+        return
+    updates = {'image_variants': render_variants(instance.image)}
+    if model is Product:
+        updates['version'] = F('version') + 1
+    # A replaced image has a job of its own
+    model.objects.filter(pk=pk, image=instance.image.name).update(**updates)
@@ -1,3 +1,419 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import uuid
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from emmy_spices_backend.compression import CompressionMiddleware, body_cache
+from emmy_spices_backend.renderers import ORJSONRenderer
+from jobs.models import Job
+from users.models import Notification
+from .models import Category, Product, ProductImage, ProductReview, StaleProductError
+from .serializers import FastProductListSerializer, ProductListSerializer
+from .tasks import render_image_variants
+
+
+class AsyncEndpointTests(TestCase):
+    """The async variants return what the DRF views return"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reviewer')
+        categories = [Category.objects.create(name=name) for name in ('Whole', 'Ground')]
+        cls.products = [
+            Product.objects.create(
+                name=f'Spice {i}', description='Aromatic', category=categories[i % 2],
+                price=Decimal('5.00'), retail_price=Decimal('5.00'),
+                wholesale_price=Decimal('4.00'), stock=i, is_featured=i % 3 == 0,
+            )
+            for i in range(24)
+        ]
+        ProductReview.objects.create(
+            product=cls.products[0], user=cls.user, rating=4, title='Good', comment='Fresh'
+        )
+        Notification.objects.create(
+            user=cls.user, notification_type='system', title='Hello', message='Welcome'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+
+    def get_pair(self, path, async_path, **headers):
+        sync_response = self.client.get(f'/api/products/api/{path}', **headers)
+        async_response = self.client.get(f'/api/products/api/async/{async_path}', **headers)
+        self.assertEqual(sync_response.status_code, async_response.status_code)
+        return sync_response.json(), async_response.json()
+
+    def test_list_matches(self):
+        category = self.products[0].category_id
+        for query in ('', '?page=2', f'?category={category}&ordering=price', '?search=1&in_stock=true'):
+            with self.subTest(query=query):
+                expected, actual = self.get_pair(f'products/{query}', f'products/{query}')
+                # Only the pagination links differ, pointing at each variant
+                for data in (expected, actual):
+                    data.pop('next')
+                    data.pop('previous')
+                self.assertEqual(expected, actual)
+
+    def test_detail_and_featured_match(self):
+        pk = self.products[0].pk
+        expected, actual = self.get_pair(f'products/{pk}/', f'products/{pk}/')
+        self.assertEqual(json.dumps(expected), json.dumps(actual))
+        self.assertEqual(*self.get_pair('products/featured/', 'products/featured/'))
+        self.assertEqual(*self.get_pair('products/999999/', 'products/999999/'))
+
+    def test_unread_notifications_need_authentication(self):
+        path = '/api/users/api/async/notifications/unread/'
+        self.assertEqual(self.client.get(path).status_code, 403)
+        response = self.client.get(path, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        expected = self.client.get(
+            '/api/users/api/notifications/unread/', HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(len(response.json()), 1)
+
+    def test_only_safe_methods(self):
+        response = self.client.post('/api/products/api/async/products/')
+        self.assertEqual(response.status_code, 405)
+
+    async def test_served_under_asgi(self):
+        pk = self.products[0].pk
+        response = await self.async_client.get(f'/api/products/api/async/products/{pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], pk)
+        self.assertEqual(len(response.json()['related_products']), 4)
+
+
+class ORJSONRendererTests(TestCase):
+    def test_matches_json_renderer(self):
+        data = {
+            'text': 'Piment d\u2019Espelette \u2028 \u2029 \U0001f336',
+            'lazy': gettext_lazy('Not found.'),
+            'amount': Decimal('12.50'),
+            'ratio': 0.1,
+            'created_at': timezone.now(),
+            'naive': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456),
+            'date': datetime.date(2024, 5, 1),
+            'time': datetime.time(8, 15),
+            'id': uuid.uuid4(),
+            'nested': [(1, 2), {'a': None, 'b': True}],
+            1: 'integer key',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indent_falls_back_to_json_renderer(self):
+        data = {'a': [1, 2]}
+        accepted = 'application/json; indent=4'
+        self.assertEqual(
+            ORJSONRenderer().render(data, accepted), JSONRenderer().render(data, accepted)
+        )
+
+
+class ReorderThresholdTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Whole', reorder_threshold=10)
+        cls.products = {
+            name: Product.objects.create(
+                name=name, description='Aromatic', category=cls.category,
+                price=Decimal('5.00'), retail_price=Decimal('5.00'),
+                wholesale_price=Decimal('4.00'), stock=stock, reorder_threshold=threshold,
+            )
+            for name, stock, threshold in (
+                ('Empty', 0, None), ('Low', 5, None), ('Stocked', 20, None),
+                ('Override', 20, 30),
+            )
+        }
+
+    def names(self, queryset):
+        return sorted(queryset.values_list('name', flat=True))
+
+    def test_product_override_beats_category(self):
+        self.assertEqual(self.products['Low'].effective_reorder_threshold, 10)
+        self.assertEqual(self.products['Override'].effective_reorder_threshold, 30)
+        self.assertEqual(self.products['Low'].stock_status, 'Low Stock')
+        self.assertEqual(self.products['Stocked'].stock_status, 'In Stock')
+        self.assertEqual(self.products['Override'].stock_status, 'Low Stock')
+
+    def test_querysets(self):
+        self.assertEqual(self.names(Product.objects.below_threshold()), ['Empty', 'Low', 'Override'])
+        self.assertEqual(self.names(Product.objects.low_stock()), ['Low', 'Override'])
+        self.assertEqual(self.names(Product.objects.out_of_stock()), ['Empty'])
+
+    def test_category_threshold_propagates_to_inheriting_products(self):
+        self.category.reorder_threshold = 25
+        self.category.save()
+        self.assertEqual(self.names(Product.objects.low_stock()), ['Low', 'Override', 'Stocked'])
+        self.assertEqual(
+            Product.objects.get(name='Override').effective_reorder_threshold, 30
+        )
+
+    def test_propagation_makes_loaded_products_stale(self):
+        loaded = Product.objects.get(name='Low')
+        self.category.reorder_threshold = 25
+        self.category.save()
+        loaded.stock = 6
+        with self.assertRaises(StaleProductError), transaction.atomic():
+            loaded.save()
+        self.assertEqual(Product.objects.get(name='Low').effective_reorder_threshold, 25)
+
+    def test_clearing_override_inherits_category(self):
+        product = self.products['Override']
+        product.reorder_threshold = None
+        product.save(update_fields=['reorder_threshold'])
+        product.refresh_from_db()
+        self.assertEqual(product.effective_reorder_threshold, 10)
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads the SQLite query plan')
+    def test_partial_index_covers_lookup(self):
+        with connection.cursor() as cursor:
+            sql, params = Product.objects.low_stock().values('id').query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('product_below_threshold_idx', plan)
+
+    def test_low_stock_endpoint(self):
+        response = self.client.get('/api/products/api/products/low_stock/')
+        self.assertEqual(sorted(product['name'] for product in response.json()), ['Low', 'Override'])
+        response = self.client.get('/api/products/api/products/out_of_stock/')
+        self.assertEqual([product['name'] for product in response.json()], ['Empty'])
+
+
+class FastProductListSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Épices \u2028 entières', reorder_threshold=5)
+        for i, stock in enumerate((0, 3, 5, 40)):
+            Product.objects.create(
+                name=f'Poivre {i} \U0001f336', description='Line\nbreak "quoted"',
+                category=category, price=Decimal('5.5'), retail_price=Decimal('7.25'),
+                wholesale_price=Decimal('120'), stock=stock, is_featured=bool(i % 2),
+                rating=Decimal('4.75'), image='products/pepper.webp' if i % 2 else None,
+                reorder_threshold=None if i < 3 else 50,
+            )
+
+    def assert_same_output(self, queryset, context):
+        expected = JSONRenderer().render(ProductListSerializer(queryset, many=True, context=context).data)
+        fast = FastProductListSerializer(context=context)
+        actual = ORJSONRenderer().render(fast.to_representation(fast.values(queryset)))
+        self.assertEqual(actual, expected)
+
+    def test_matches_product_list_serializer(self):
+        queryset = Product.objects.order_by('id')
+        self.assert_same_output(queryset, {})
+        request = APIRequestFactory().get('/api/products/api/products/')
+        self.assert_same_output(queryset, {'request': request})
+
+    def test_list_endpoint_uses_two_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products/api/products/')
+        self.assertEqual(response.json()['count'], 4)
+
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Whole')
+        cls.products = [
+            Product.objects.create(
+                name=f'Clove {i}', description='Long description ' * 20, category=category,
+                price=Decimal('5.00'), retail_price=Decimal('6.00'),
+                wholesale_price=Decimal('4.00'), stock=i,
+            )
+            for i in range(3)
+        ]
+        ProductImage.objects.create(product=cls.products[0], image='products/clove.jpg')
+
+    def test_fields_trim_output_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/products/api/products/?fields=id,name,retail_price,image'
+            )
+        for item in response.json()['results']:
+            self.assertEqual(list(item), ['id', 'name', 'retail_price', 'image'])
+        self.assertNotIn('description', queries[-1]['sql'])
+
+    def test_exclude_and_expand(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                '/api/products/api/products/?exclude=description,category_name&expand=images'
+            )
+        results = response.json()['results']
+        self.assertNotIn('description', results[0])
+        self.assertNotIn('category_name', results[0])
+        self.assertEqual([len(item['images']) for item in results], [0, 0, 1])
+
+    def test_detail_loads_only_what_the_fields_read(self):
+        pk = self.products[0].pk
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f'/api/products/api/products/{pk}/?fields=id,stock_status,review_count'
+            )
+        self.assertEqual(response.json(), {'id': pk, 'stock_status': 'Out of Stock', 'review_count': 0})
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/api/products/api/products/?fields=id,cost&expand=name')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            'fields': ['Unknown field: cost'], 'expand': ['Unknown field: name'],
+        })
+
+
+class CompressionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Ground')
+        for i in range(20):
+            Product.objects.create(
+                name=f'Cumin {i}', description='Earthy and warm', category=category,
+                price=Decimal('5.00'), retail_price=Decimal('6.00'),
+                wholesale_price=Decimal('4.00'), stock=i,
+            )
+
+    def setUp(self):
+        body_cache.clear()
+
+    def test_gzips_catalog_and_reuses_the_compressed_body(self):
+        plain = self.client.get('/api/products/api/products/')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        for _ in range(2):
+            response = self.client.get('/api/products/api/products/', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(int(response['Content-Length']), len(response.content))
+            self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual((body_cache.misses, body_cache.hits), (1, 1))
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(
+            '/api/products/api/products/?fields=id', HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_streams_are_compressed_as_they_go(self):
+        chunks = [b'id,name\n'] + [f'{i},Cumin {i}\n'.encode() for i in range(100)]
+        middleware = CompressionMiddleware(
+            lambda request: StreamingHttpResponse(iter(chunks), content_type='text/csv')
+        )
+        request = APIRequestFactory().get('/export.csv', HTTP_ACCEPT_ENCODING='gzip')
+        response = middleware(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        parts = list(response.streaming_content)
+        # Each chunk is flushed as it comes, plus the end of the gzip stream
+        self.assertEqual(len(parts), len(chunks) + 1)
+        self.assertEqual(gzip.decompress(b''.join(parts)), b''.join(chunks))
+
+    def test_event_streams_are_left_alone(self):
+        middleware = CompressionMiddleware(
+            lambda request: StreamingHttpResponse(iter([b'data: 1\n\n']), content_type='text/event-stream')
+        )
+        response = middleware(APIRequestFactory().get('/events', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertNotIn('Content-Encoding', response)
+
+
+def image_upload(name, size, mode='RGB', image_format='JPEG'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 80, 20, 128)[:len(mode)]).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ImageVariantsTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(
+            MEDIA_ROOT=media_root, IMAGE_VARIANTS={'thumb': 160, 'large': 1280}
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.category = Category.objects.create(name='Seeds')
+
+    def create_product(self, image):
+        return Product.objects.create(
+            name='Cardamom', description='Green pods', category=self.category,
+            price=Decimal('5.00'), retail_price=Decimal('6.00'),
+            wholesale_price=Decimal('4.00'), stock=10, image=image,
+        )
+
+    def test_upload_queues_rendering_of_content_hashed_variants(self):
+        product = self.create_product(image_upload('pods.jpg', (1600, 900)))
+        self.assertEqual(product.image_variants, {})
+        job = Job.objects.get(task='products.tasks.render_image_variants')
+        self.assertEqual(job.kwargs, {'model': 'product', 'pk': product.pk})
+
+        render_image_variants(**job.kwargs)
+        product.refresh_from_db()
+        variants = product.image_variants
+        self.assertEqual(variants['source'], product.image.name)
+        self.assertEqual(
+            [(v['width'], v['height']) for v in variants['variants'].values()],
+            [(160, 90), (1280, 720)]
+        )
+        webp = variants['variants']['thumb']['webp']
+        self.assertRegex(webp, r'^derivatives/[0-9a-f]{2}/[0-9a-f]{32}\.webp$')
+        with product.image.storage.open(webp) as rendered:
+            self.assertEqual(Image.open(rendered).format, 'WEBP')
+        self.assertTrue(variants['variants']['large']['jpeg'].endswith('.jpg'))
+
+        item = self.client.get('/api/products/api/products/').json()['results'][0]
+        self.assertEqual(
+            item['image_variants']['thumb']['webp'], f'http://testserver/media/{webp}'
+        )
+        self.assertEqual(item['image_variants']['thumb']['width'], 160)
+
+    def test_small_and_transparent_images_are_not_upscaled_and_keep_alpha(self):
+        image = ProductImage.objects.create(
+            product=self.create_product(None), image=image_upload('logo.png', (100, 50), 'RGBA', 'PNG')
+        )
+        render_image_variants('productimage', image.pk)
+        image.refresh_from_db()
+        thumb, large = image.image_variants['variants'].values()
+        self.assertEqual((thumb['width'], thumb['height']), (100, 50))
+        # Identical renders are stored once
+        self.assertEqual(thumb['webp'], large['webp'])
+        self.assertTrue(thumb['png'].endswith('.png'))
+
+    def test_replacing_the_image_drops_the_old_variants(self):
+        product = self.create_product(image_upload('pods.jpg', (400, 400)))
+        render_image_variants('product', product.pk)
+        product.refresh_from_db()
+        old_job = Job.objects.get()
+
+        # A stale copy saved for another reason keeps the rendered variants
+        stale = Product.objects.get(pk=product.pk)
+        stale.image_variants = {}
+        stale.stock = 5
+        stale.save()
+        self.assertTrue(Product.objects.get(pk=product.pk).image_variants)
+
+        product = Product.objects.get(pk=product.pk)
+        product.image = image_upload('ground.jpg', (300, 300))
+        product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).image_variants, {})
+        self.assertEqual(Job.objects.exclude(pk=old_job.pk).count(), 1)
+
+        product.image = None
+        product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).image_variants, {})
+
+    def test_backfill_command(self):
+        product = self.create_product(image_upload('pods.jpg', (400, 400)))
+        call_command('render_image_variants', '--now', stdout=io.StringIO())
+        product.refresh_from_db()
+        self.assertEqual(list(product.image_variants['variants']), ['thumb', 'large'])
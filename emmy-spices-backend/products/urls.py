@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    ProductViewSet, CategoryViewSet, ProductReviewViewSet, ProductImageViewSet
+    ProductViewSet, CategoryViewSet, ProductReviewViewSet, ProductImageViewSet,
+    async_product_list, async_featured_products, async_product_detail
 )
 
 router = DefaultRouter()
@@ -13,5 +14,9 @@ router.register(r'images', ProductImageViewSet)
 app_name = 'products'
 
 urlpatterns = [
+    # Async (ASGI) variants of the hottest catalog reads
+    path('api/async/products/', async_product_list, name='async-product-list'),
+    path('api/async/products/featured/', async_featured_products, name='async-product-featured'),
+    path('api/async/products/<int:pk>/', async_product_detail, name='async-product-detail'),
     path('api/', include(router.urls)),
 ] 
\ No newline at end of file
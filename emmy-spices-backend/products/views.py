@@ -1,21 +1,28 @@
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Avg, Count
+from django.db.models import Q, Avg, Count, Prefetch
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 
-from .models import Product, Category, ProductImage, ProductReview
+from emmy_spices_backend.async_api import afilter_queryset, apaginate, async_api_view
+from emmy_spices_backend.fastserializers import FastListMixin
+from emmy_spices_backend.metrics import SerializerTimingMixin
+
+from .models import Product, Category, ProductImage, ProductReview, StaleProductError
 from .serializers import (
     ProductSerializer, ProductListSerializer, ProductDetailSerializer,
     ProductCreateSerializer, ProductUpdateSerializer, CategorySerializer,
     CategoryDetailSerializer, ProductImageSerializer, ProductReviewSerializer,
-    ProductSearchSerializer
+    ProductSearchSerializer, FastProductListSerializer
 )
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for Category model"""
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -50,15 +57,23 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The product was changed by another request; reload it and retry.'
+    default_code = 'conflict'
+
+
+class ProductViewSet(SerializerTimingMixin, FastListMixin, viewsets.ModelViewSet):
     """ViewSet for Product model"""
     queryset = Product.objects.all()
+    fast_list_serializer_class = FastProductListSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'is_active', 'is_featured']
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'price', 'rating', 'created_at', 'stock']
     ordering = ['-created_at']
+    throttle_costs = {'search': 5, 'best_sellers': 3}
 
     def get_queryset(self):
         """Filter queryset based on user type"""
@@ -101,33 +116,36 @@ class ProductViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated()]
         return [IsAuthenticatedOrReadOnly()]
 
+    def perform_update(self, serializer):
+        """Save unless the product changed since it was read"""
+        try:
+            serializer.save()
+        except StaleProductError:
+            raise ProductConflict()
+
     @action(detail=False, methods=['get'])
     def featured(self, request):
         """Get featured products"""
         products = self.get_queryset().filter(is_featured=True)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return Response(self.list_data(products))
 
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
         """Get products with low stock"""
-        products = self.get_queryset().filter(stock__lt=50, stock__gt=0)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        products = self.get_queryset().low_stock().select_related('category')
+        return Response(self.list_data(products))
 
     @action(detail=False, methods=['get'])
     def out_of_stock(self, request):
         """Get out of stock products"""
-        products = self.get_queryset().filter(stock=0)
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        products = self.get_queryset().out_of_stock().select_related('category')
+        return Response(self.list_data(products))
 
     @action(detail=False, methods=['get'])
     def top_rated(self, request):
         """Get top rated products"""
         products = self.get_queryset().order_by('-rating')[:10]
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return Response(self.list_data(products))
 
     @action(detail=False, methods=['get'])
     def best_sellers(self, request):
@@ -135,8 +153,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         products = self.get_queryset().annotate(
             total_sold=Count('orderitem')
         ).order_by('-total_sold')[:10]
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return Response(self.list_data(products))
 
     @action(detail=False, methods=['post'])
     def search(self, request):
@@ -222,7 +239,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ProductReviewViewSet(viewsets.ModelViewSet):
+class ProductReviewViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     """ViewSet for ProductReview model"""
     queryset = ProductReview.objects.all()
     serializer_class = ProductReviewSerializer
@@ -253,7 +270,7 @@ class ProductReviewViewSet(viewsets.ModelViewSet):
         instance.delete()
 
 
-class ProductImageViewSet(viewsets.ModelViewSet):
+class ProductImageViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     """ViewSet for ProductImage model"""
     queryset = ProductImage.objects.all()
     serializer_class = ProductImageSerializer
@@ -275,3 +292,42 @@ class ProductImageViewSet(viewsets.ModelViewSet):
             serializer.save(product=product)
         else:
             serializer.save()
+
+
+@async_api_view(ProductViewSet, 'list')
+async def async_product_list(request, view):
+    """Async variant of the product list"""
+    queryset = await afilter_queryset(view, view.get_queryset().select_related('category'))
+    return await apaginate(view, queryset)
+
+
+@async_api_view(ProductViewSet, 'featured')
+async def async_featured_products(request, view):
+    """Async variant of the featured products"""
+    products = view.get_queryset().filter(is_featured=True).select_related('category')
+    return view.get_serializer([product async for product in products], many=True).data
+
+
+@async_api_view(ProductViewSet, 'retrieve')
+async def async_product_detail(request, view, pk):
+    """Async variant of the product detail"""
+    queryset = view.get_queryset().select_related('category').prefetch_related(
+        'images', Prefetch('reviews', ProductReview.objects.select_related('user'))
+    )
+    try:
+        product = await (await afilter_queryset(view, queryset)).aget(pk=pk)
+    except Product.DoesNotExist:
+        # As get_object_or_404 in the viewset
+        raise Http404('No Product matches the given query.')
+    related = Product.objects.filter(
+        category_id=product.category_id, is_active=True
+    ).exclude(id=product.id).select_related('category')[:4]
+    serializer = view.get_serializer(
+        product, context={
+            **view.get_serializer_context(),
+            'related_products': [item async for item in related],
+        }
+    )
+    # The nested category counts its products, the one query left to a thread
+    return await sync_to_async(lambda: serializer.data)()
+
@@ -0,0 +1,197 @@
+"""
+Write-behind logging for UserActivity.
+
+Requests enqueue unsaved UserActivity rows into a bounded in-process queue.
+A background thread drains the queue and writes rows with ``bulk_create``
+once a batch fills up or the flush interval elapses. When the queue is full
+new records are dropped (and counted) instead of blocking the request.
+"""
+import atexit
+import ipaddress
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from rest_framework.settings import api_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityWriter:
+    """Bounded queue of UserActivity rows drained by a writer thread"""
+
+    def __init__(self, maxsize, batch_size, flush_interval_ms):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def enqueue(self, activity):
+        """Queue an unsaved UserActivity; returns False when it was dropped"""
+        try:
+            self.queue.put_nowait(activity)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        self._ensure_started()
+        return True
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='user-activity-writer', daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self):
+        """Block for the first record, then collect until full or timed out"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                # Replace a connection broken by an earlier batch
+                close_old_connections()
+                self._write(batch)
+        close_old_connections()
+
+    def _write(self, batch):
+        from .models import UserActivity
+
+        try:
+            with transaction.atomic():
+                UserActivity.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            logger.exception('Could not write %d user activity records', len(batch))
+        else:
+            self.written += len(batch)
+            self.batches += 1
+            return
+        # Retry one by one, so a bad record does not lose the rest of the batch
+        failed = 0
+        for activity in batch:
+            try:
+                with transaction.atomic():
+                    activity.save(force_insert=True)
+            except Exception as exc:
+                failed += 1
+                error = exc
+        self.failed += failed
+        self.written += len(batch) - failed
+        if failed:
+            logger.error('Dropped %d of %d user activity records: %r', failed, len(batch), error)
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def stop(self):
+        """Stop the writer thread and flush what is left in the queue"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'capacity': self.queue.maxsize,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+
+def get_client_ip(request):
+    """
+    Get the client IP, or None when it is not a valid address.
+
+    X-Forwarded-For is only trusted behind REST_FRAMEWORK['NUM_PROXIES']
+    proxies, as DRF's throttles do: the address the outermost of them saw
+    is taken, and anything the client put before it is ignored.
+    """
+    address = request.META.get('REMOTE_ADDR')
+    num_proxies = api_settings.NUM_PROXIES
+    forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if num_proxies and forwarded_for:
+        hops = forwarded_for.split(',')
+        address = hops[-min(num_proxies, len(hops))]
+    try:
+        return str(ipaddress.ip_address((address or '').strip()))
+    except ValueError:
+        return None
+
+
+def log_activity(user, activity_type, description, request=None):
+    """Queue a UserActivity record without touching the database"""
+    from .models import UserActivity
+
+    activity = UserActivity(
+        user=user,
+        activity_type=activity_type[:50],
+        description=description,
+        ip_address=get_client_ip(request) if request is not None else None,
+        user_agent=request.META.get('HTTP_USER_AGENT', '') if request is not None else '',
+    )
+    return writer.enqueue(activity)
+
+
+def prune_activity(days=None, batch_size=1000):
+    """Delete UserActivity rows older than the retention window"""
+    from .models import UserActivity
+    from .retention import cutoff_for, prune_queryset
+
+    if days is None:
+        days = getattr(settings, 'USER_ACTIVITY_RETENTION_DAYS', 90)
+    return prune_queryset(
+        UserActivity.objects.all(), 'created_at', cutoff_for(days), batch_size
+    )
+
+
+writer = ActivityWriter(
+    maxsize=getattr(settings, 'USER_ACTIVITY_QUEUE_SIZE', 10000),
+    batch_size=getattr(settings, 'USER_ACTIVITY_BATCH_SIZE', 500),
+    flush_interval_ms=getattr(settings, 'USER_ACTIVITY_FLUSH_INTERVAL_MS', 200),
+)
+atexit.register(writer.stop)
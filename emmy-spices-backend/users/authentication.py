@@ -0,0 +1,220 @@
+"""
+Token authentication with an in-process cache of verified tokens.
+
+Verifying a token needs one indexed lookup instead of the PBKDF2 hash that
+BasicAuthentication runs on every request, and the cache removes even that
+lookup for tokens seen in the last TOKEN_AUTH_CACHE_TTL seconds. Cached
+entries hold a snapshot of the user's fields and permissions; each request
+gets a fresh User instance built from it, so nothing cached on the instance
+leaks between requests.
+
+Revocation goes through a per-user version counter kept in the Django cache
+named by TOKEN_AUTH_VERSION_CACHE. Deleting a token, or changing a user's
+password, active or staff flags, groups or permissions, bumps the user's
+version once the change commits, and cached entries recorded under an older
+version are rejected. With a shared cache backend (Redis, Memcached) a
+revocation therefore applies at once in every worker; with the local-memory
+backend only in the process that made the change, and elsewhere within the
+TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+
+def _snapshot(instance):
+    return {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+
+
+def _restore(model, snapshot):
+    instance = model(**snapshot)
+    instance._state.adding = False
+    instance._state.db = 'default'
+    return instance
+
+
+def _version_key(user_id):
+    return f'token-auth-version:{user_id}'
+
+
+class VerifiedTokenCache:
+    """Thread-safe LRU of token key -> (expiry, version, token, user, permissions)"""
+
+    def __init__(self, maxsize, ttl, version_cache='default'):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_cache = version_cache
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revoked = 0
+        self._lock = threading.Lock()
+
+    @property
+    def versions(self):
+        return caches[self.version_cache]
+
+    def user_version(self, user_id):
+        """The user's current version; read it before loading what is cached under it"""
+        return self.versions.get(_version_key(user_id), 0)
+
+    async def auser_version(self, user_id):
+        return await self.versions.aget(_version_key(user_id), 0)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def _check(self, key, entry, version):
+        with self._lock:
+            if entry[1] != version:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+                self.revoked += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def get(self, key):
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        return self._check(key, entry, self.user_version(entry[3]['id']))
+
+    async def aget(self, key):
+        """``get`` for async views, reading the version without blocking the loop"""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        return self._check(key, entry, await self.auser_version(entry[3]['id']))
+
+    def set(self, key, token, user, permissions, version):
+        with self._lock:
+            self.entries[key] = (
+                time.monotonic() + self.ttl, version, _snapshot(token), _snapshot(user),
+                frozenset(permissions)
+            )
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def revoke_user(self, user_id):
+        """Reject the user's cached tokens in every process sharing the version cache"""
+        key = _version_key(user_id)
+        # Outlives any entry cached under the old version; once it expires
+        # the version reads as 0 again, which only causes extra misses
+        timeout = self.ttl * 2 + 1
+        self.versions.add(key, 0, timeout)
+        try:
+            self.versions.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            self.versions.set(key, 1, timeout)
+        else:
+            self.versions.touch(key, timeout)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revoked': self.revoked,
+            }
+
+
+token_cache = VerifiedTokenCache(
+    maxsize=getattr(settings, 'TOKEN_AUTH_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_AUTH_CACHE_TTL', 60),
+    version_cache=getattr(settings, 'TOKEN_AUTH_VERSION_CACHE', 'default'),
+)
+
+
+def revoke_cached_tokens(user_id):
+    """Reject the user's cached tokens once the current transaction commits"""
+    transaction.on_commit(lambda: token_cache.revoke_user(user_id))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``Authorization: Token <key>`` authentication backed by ``token_cache``"""
+
+    def restore(self, entry):
+        """The ``(user, token)`` of a cache entry"""
+        _, _, token_snapshot, user_snapshot, permissions = entry
+        user = _restore(User, user_snapshot)
+        # What ModelBackend would load on the first has_perm() check
+        user._perm_cache = set(permissions)
+        token = _restore(self.get_model(), token_snapshot)
+        token.user = user
+        return (user, token)
+
+    def cached_credentials(self, key):
+        """The ``(user, token)`` of a cached token, or None"""
+        entry = token_cache.get(key)
+        return None if entry is None else self.restore(entry)
+
+    def authenticate_credentials(self, key):
+        credentials = self.cached_credentials(key)
+        if credentials is not None:
+            return credentials
+
+        user_id = self.get_model().objects.filter(key=key).values_list('user_id', flat=True).first()
+        version = token_cache.user_version(user_id)
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, token, user, user.get_all_permissions(), version)
+        return (user, token)
+
+    async def aauthenticate(self, request):
+        """``authenticate`` for async views; cached tokens are checked on the event loop"""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 2:
+            try:
+                entry = await token_cache.aget(auth[1].decode())
+            except UnicodeError:
+                entry = None
+            if entry is not None:
+                return self.restore(entry)
+        # Uncached and malformed tokens go through the database lookup and
+        # its error messages
+        return await sync_to_async(self.authenticate)(request)
+
+
+def requesting_user(request):
+    """
+    The active session or API token user of a Django ``request``, or None.
+
+    For middleware and plain Django views that must know the user before, or
+    without, DRF authenticating the request.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_active:
+        return user
+    try:
+        credentials = CachedTokenAuthentication().authenticate(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    return credentials[0] if credentials else None
@@ -0,0 +1,134 @@
+"""
+Bulk notification fan-out.
+
+A NotificationBroadcast is materialized into one Notification per recipient
+by walking the matching profiles in user-id order (keyset pagination) and
+inserting each chunk with a single ``bulk_create``. Progress, including the
+last recipient reached, is saved with every chunk, so the API can report it
+while the broadcast runs and an interrupted broadcast resumes where it
+stopped instead of starting over.
+
+Broadcasts started from the API run as jobs on the ``run_jobs`` workers
+(see ``users.tasks.send_broadcast``): a failed run is retried, and one whose
+worker died is requeued and resumed. Notifications are published from the
+worker process; with a broker that is not ``shared`` open streams pick them
+up from the table at their next heartbeat.
+"""
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from jobs.queue import enqueue
+from .notifications import get_broker, increment_unread_counts, notification_payload
+
+
+class BroadcastTakenOver(Exception):
+    """Another run of the same broadcast sent the chunk first"""
+
+
+def run_broadcast(broadcast, chunk_size=5000, progress=None):
+    """
+    Create the notifications for ``broadcast``, resuming a started one.
+
+    ``progress`` is called with ``(sent_count, total_recipients, rate)``
+    after each chunk. Returns the number of notifications created.
+    """
+    from .models import Notification, NotificationBroadcast
+
+    if broadcast.status == 'completed':
+        return broadcast.sent_count
+    recipients = broadcast.get_recipient_profiles().order_by('user_id')
+    # Every write below is conditional on the resume point, so a second run
+    # of the same broadcast (a job requeued while this one was still going)
+    # stops at its first write instead of sending chunks again
+    current = NotificationBroadcast.objects.filter(
+        pk=broadcast.pk, last_user_id=broadcast.last_user_id
+    )
+    fields = {
+        'status': 'running',
+        'error': '',
+        'total_recipients': broadcast.sent_count + recipients.filter(
+            user_id__gt=broadcast.last_user_id
+        ).count(),
+    }
+    if broadcast.started_at is None:
+        fields['started_at'] = timezone.now()
+    if not current.filter(status=broadcast.status).update(**fields):
+        broadcast.refresh_from_db()
+        return broadcast.sent_count
+    for name, value in fields.items():
+        setattr(broadcast, name, value)
+
+    started = time.perf_counter()
+    sent_before = broadcast.sent_count
+    try:
+        while True:
+            user_ids = list(
+                recipients.filter(user_id__gt=broadcast.last_user_id)
+                .values_list('user_id', flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+
+            with transaction.atomic():
+                # Claim the chunk by moving the resume point
+                claimed = current.update(
+                    last_user_id=user_ids[-1], sent_count=F('sent_count') + len(user_ids)
+                )
+                if not claimed:
+                    raise BroadcastTakenOver
+                notifications = Notification.objects.bulk_create([
+                    Notification(
+                        user_id=user_id,
+                        notification_type=broadcast.notification_type,
+                        title=broadcast.title,
+                        message=broadcast.message
+                    )
+                    for user_id in user_ids
+                ])
+                increment_unread_counts(user_ids)
+                # bulk_create bypasses post_save, so push to open streams here
+                transaction.on_commit(lambda batch=notifications: _publish(batch))
+            broadcast.last_user_id = user_ids[-1]
+            broadcast.sent_count += len(user_ids)
+            current = NotificationBroadcast.objects.filter(
+                pk=broadcast.pk, last_user_id=broadcast.last_user_id
+            )
+
+            if progress is not None:
+                elapsed = time.perf_counter() - started
+                rate = (broadcast.sent_count - sent_before) / elapsed if elapsed > 0 else 0
+                progress(broadcast.sent_count, broadcast.total_recipients, rate)
+    except BroadcastTakenOver:
+        broadcast.refresh_from_db()
+        return broadcast.sent_count
+    except Exception as exc:
+        broadcast.status = 'failed'
+        broadcast.error = str(exc)
+        broadcast.completed_at = timezone.now()
+        current.update(status='failed', error=broadcast.error, completed_at=broadcast.completed_at)
+        raise
+
+    broadcast.status = 'completed'
+    broadcast.completed_at = timezone.now()
+    current.update(status='completed', completed_at=broadcast.completed_at)
+    return broadcast.sent_count
+
+
+def _publish(notifications):
+    broker = get_broker()
+    for notification in notifications:
+        if notification.id is not None:
+            broker.publish(notification.user_id, notification_payload(notification))
+
+
+def start_broadcast(broadcast, chunk_size=5000):
+    """Queue a broadcast for the job workers; returns the Job"""
+    from .tasks import send_broadcast
+
+    return enqueue(
+        send_broadcast, {'broadcast_id': broadcast.pk, 'chunk_size': chunk_size},
+        key=f'notification-broadcast:{broadcast.pk}'
+    )
@@ -0,0 +1,67 @@
+import base64
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from users.authentication import CachedTokenAuthentication, token_cache
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request authentication cost of basic, token and cached token auth'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Authentications per scheme (basic auth uses at most 20)'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        try:
+            with transaction.atomic():
+                self.run(iterations)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, iterations):
+        password = 'benchmark-password'
+        user = User.objects.create_user('auth-benchmark', password=password)
+        token = Token.objects.create(user=user)
+        factory = APIRequestFactory()
+        basic = base64.b64encode(f'{user.username}:{password}'.encode()).decode()
+        token_cache.clear()
+
+        schemes = [
+            ('basic', BasicAuthentication(), f'Basic {basic}', min(iterations, 20)),
+            ('token', TokenAuthentication(), f'Token {token.key}', iterations),
+            ('cached token', CachedTokenAuthentication(), f'Token {token.key}', iterations),
+        ]
+        for name, authenticator, header, count in schemes:
+            timings = []
+            for _ in range(count):
+                request = Request(factory.get('/', HTTP_AUTHORIZATION=header))
+                started = time.perf_counter()
+                result = authenticator.authenticate(request)
+                timings.append(time.perf_counter() - started)
+                assert result is not None and result[0].pk == user.pk
+            timings.sort()
+            mean = sum(timings) / len(timings)
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(
+                f'{name:>13}: mean {mean * 1e6:10.1f} us  '
+                f'p95 {p95 * 1e6:10.1f} us  ({count} requests)'
+            )
+        token_cache.clear()
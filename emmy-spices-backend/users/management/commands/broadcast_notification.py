@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from users.models import Notification, NotificationBroadcast, UserProfile
+from users.broadcast import run_broadcast
+
+
+class Command(BaseCommand):
+    help = 'Create a notification for every user matching the given profile filters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('title')
+        parser.add_argument('message')
+        parser.add_argument(
+            '--type',
+            dest='notification_type',
+            choices=[choice for choice, _ in Notification.NOTIFICATION_TYPE_CHOICES],
+            default='promotion'
+        )
+        parser.add_argument(
+            '--user-type',
+            choices=[choice for choice, _ in UserProfile.USER_TYPE_CHOICES],
+            default=''
+        )
+        parser.add_argument('--city', default='')
+        parser.add_argument(
+            '--email-opt-in',
+            action='store_true',
+            help='Only users with email notifications enabled'
+        )
+        parser.add_argument(
+            '--sms-opt-in',
+            action='store_true',
+            help='Only users with SMS notifications enabled'
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        broadcast = NotificationBroadcast.objects.create(
+            notification_type=options['notification_type'],
+            title=options['title'],
+            message=options['message'],
+            user_type=options['user_type'],
+            city=options['city'],
+            email_notifications=True if options['email_opt_in'] else None,
+            sms_notifications=True if options['sms_opt_in'] else None,
+        )
+
+        def progress(sent, total, rate):
+            self.stdout.write(f'{sent}/{total} notifications ({rate:.0f}/s)')
+
+        sent = run_broadcast(broadcast, options['chunk_size'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Broadcast {broadcast.pk}: {sent} notifications at {broadcast.throughput}/s'
+        ))
@@ -0,0 +1,114 @@
+import gzip
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from jobs.models import Job
+from orders.models import OutboxEvent
+from users.models import UserActivity, UserSession, Notification
+from users.notifications import rebuild_unread_counts
+from users.retention import cutoff_for, prune_queryset
+
+
+# (name, model, timestamp field, retention setting, default days)
+HISTORY_TABLES = [
+    ('activity', UserActivity, 'created_at', 'USER_ACTIVITY_RETENTION_DAYS', 90),
+    ('sessions', UserSession, 'login_time', 'USER_SESSION_RETENTION_DAYS', 180),
+    ('notifications', Notification, 'created_at', 'NOTIFICATION_RETENTION_DAYS', 365),
+    # Queued and running jobs have no finished_at and are never pruned
+    ('jobs', Job, 'finished_at', 'JOB_RETENTION_DAYS', 7),
+    # Undelivered events have no published_at and are never pruned
+    ('events', OutboxEvent, 'published_at', 'OUTBOX_RETENTION_DAYS', 30),
+]
+
+
+class Command(BaseCommand):
+    help = 'Delete or archive user activity, session, notification, job and event history past its retention window'
+
+    def add_arguments(self, parser):
+        for name, _, _, setting, _ in HISTORY_TABLES:
+            parser.add_argument(
+                f'--{name}-days',
+                type=int,
+                help=f'Retention in days for {name} (default: settings.{setting})'
+            )
+        parser.add_argument(
+            '--only',
+            choices=[name for name, *_ in HISTORY_TABLES],
+            action='append',
+            help='Prune only the given table (may be repeated)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows deleted per statement'
+        )
+        parser.add_argument(
+            '--archive-dir',
+            help='Write pruned rows to gzip-compressed NDJSON files in this directory'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many rows would be pruned without deleting anything'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        archive_dir = options['archive_dir']
+        if archive_dir and not options['dry_run']:
+            os.makedirs(archive_dir, exist_ok=True)
+        
+        stamp = timezone.now().strftime('%Y%m%dT%H%M%S')
+        total_rows = 0
+        total_started = time.perf_counter()
+        
+        for name, model, field, setting, default_days in HISTORY_TABLES:
+            if options['only'] and name not in options['only']:
+                continue
+            
+            days = options[f'{name}_days']
+            if days is None:
+                days = getattr(settings, setting, default_days)
+            cutoff = cutoff_for(days)
+            queryset = model.objects.all()
+            
+            # Pruned notifications may have been unread
+            recount = {}
+            if name == 'notifications':
+                recount = {'after_delete': rebuild_unread_counts, 'after_delete_field': 'user_id'}
+            
+            started = time.perf_counter()
+            if options['dry_run']:
+                rows = queryset.filter(**{f'{field}__lt': cutoff}).count()
+                verb = 'would prune'
+            elif archive_dir:
+                path = os.path.join(archive_dir, f'{name}-{stamp}.ndjson.gz')
+                with gzip.open(path, 'wt', encoding='utf-8') as archive:
+                    rows = prune_queryset(
+                        queryset, field, cutoff, options['batch_size'], archive, **recount
+                    )
+                if not rows:
+                    os.remove(path)
+                verb = 'archived and pruned'
+            else:
+                rows = prune_queryset(queryset, field, cutoff, options['batch_size'], **recount)
+                verb = 'pruned'
+            elapsed = time.perf_counter() - started
+            total_rows += rows
+            
+            rate = rows / elapsed if elapsed > 0 else 0
+            self.stdout.write(
+                f'{name}: {verb} {rows} rows older than {days} days '
+                f'in {elapsed:.2f}s ({rate:.0f} rows/s)'
+            )
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {total_rows} rows in {time.perf_counter() - total_started:.2f}s'
+            + (' (dry run)' if options['dry_run'] else '')
+        ))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product, ProductImage
+from products.tasks import render_image_variants
+from users.models import UserProfile
+from users.tasks import render_profile_picture_variants
+
+
+# (name, model, image field, task rendering one row)
+IMAGE_FIELDS = [
+    ('products', Product, 'image', lambda pk: render_image_variants('product', pk)),
+    ('product-images', ProductImage, 'image', lambda pk: render_image_variants('productimage', pk)),
+    ('profile-pictures', UserProfile, 'profile_picture', render_profile_picture_variants),
+]
+
+
+class Command(BaseCommand):
+    help = 'Queue (or run) the rendering of image variants missing for product images and profile pictures'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only',
+            choices=[name for name, *_ in IMAGE_FIELDS],
+            action='append',
+            help='Render only the given images (may be repeated)'
+        )
+        parser.add_argument(
+            '--now',
+            action='store_true',
+            help='Render in this process instead of queueing jobs for the workers'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-render images that already have variants, e.g. after IMAGE_VARIANTS changed (implies --now)'
+        )
+
+    def handle(self, *args, **options):
+        now = options['now'] or options['all']
+        for name, model, field_name, render in IMAGE_FIELDS:
+            if options['only'] and name not in options['only']:
+                continue
+            queryset = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            if not options['all']:
+                queryset = queryset.filter(**{f'{field_name}_variants': {}})
+            count = 0
+            for instance in queryset.only('pk', field_name).iterator():
+                if now:
+                    render(instance.pk)
+                else:
+                    getattr(instance, f'render_{field_name}_variants')()
+                count += 1
+            action = 'Rendered' if now else 'Queued'
+            self.stdout.write(f'{action} variants of {count} {name}')
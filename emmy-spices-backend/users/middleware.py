@@ -0,0 +1,52 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
+
+from .activity import log_activity
+
+
+class UserActivityMiddleware:
+    """Record an activity entry for each authenticated API request"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.enabled = getattr(settings, 'USER_ACTIVITY_LOGGING', True)
+        self.path_prefixes = tuple(getattr(settings, 'USER_ACTIVITY_PATH_PREFIXES', ['/api/']))
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        
+        # DRF authenticates inside the view and copies the user back onto
+        # the Django request, so the user is only known after the response.
+        if self.enabled and request.path.startswith(self.path_prefixes):
+            self.log(request, response, getattr(request, 'user', None))
+        
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.enabled and request.path.startswith(self.path_prefixes):
+            user = getattr(request, 'user', None)
+            # Still the lazy session user: loading it would query from the event loop
+            if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+                user = await request.auser()
+            self.log(request, response, user)
+        return response
+
+    def log(self, request, response, user):
+        if user is not None and user.is_authenticated:
+            match = request.resolver_match
+            view_name = match.view_name if match else request.path
+            log_activity(
+                user,
+                f"{request.method} {view_name}",
+                f"{request.method} {request.get_full_path()} -> {response.status_code}",
+                request
+            )
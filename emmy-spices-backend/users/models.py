@@ -1,7 +1,12 @@
 from django.db import models
-from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
 from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from emmy_spices_backend.images import job_key, prepare_variants
+from jobs.queue import enqueue
 
 
 class UserProfile(models.Model):
@@ -38,6 +43,8 @@ class UserProfile(models.Model):
     
     # Profile picture
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    # Thumbnails and WebP renditions (see emmy_spices_backend.images)
+    profile_picture_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
@@ -45,6 +52,23 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.get_user_type_display()}"
 
+    def save(self, *args, **kwargs):
+        """Queue the rendering of a new profile picture's variants"""
+        update_fields = kwargs.get('update_fields')
+        render_picture = prepare_variants(self, 'profile_picture', update_fields)
+        if update_fields is not None and 'profile_picture' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'profile_picture_variants'}
+        super().save(*args, **kwargs)
+        if render_picture:
+            self.render_profile_picture_variants()
+
+    def render_profile_picture_variants(self):
+        from .tasks import render_profile_picture_variants
+        enqueue(
+            render_profile_picture_variants, {'pk': self.pk},
+            key=job_key(self, 'profile_picture')
+        )
+
     @property
     def is_distributor(self):
         """Check if user is a distributor"""
@@ -67,17 +91,93 @@ class UserProfile(models.Model):
 
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    """Create user profile when user is created"""
-    if created:
-        UserProfile.objects.create(user=instance)
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    """
+    Create the user's profile when the user is created.
+
+    Callers that know the profile fields up front (such as registration) can
+    set ``instance._profile_defaults`` before saving so the profile is written
+    once with its final values.
+    """
+    if created and not raw:
+        profile, _ = UserProfile.objects.get_or_create(
+            user=instance,
+            defaults=getattr(instance, '_profile_defaults', None) or {}
+        )
+        instance.profile = profile
+
+
+# Fields cached with verified tokens that decide what a token may do
+AUTH_FIELDS = ('password', 'is_active', 'is_staff', 'is_superuser')
+
+
+@receiver(post_init, sender=User)
+def remember_auth_fields(sender, instance, **kwargs):
+    instance._loaded_auth_fields = tuple(
+        instance.__dict__.get(field) for field in AUTH_FIELDS
+    )
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """Save user profile when user is saved"""
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
+def revoke_tokens_on_auth_change(sender, instance, created, update_fields=None, **kwargs):
+    """Reject cached tokens once the user's password or access flags change"""
+    if created or (update_fields is not None and not set(update_fields) & set(AUTH_FIELDS)):
+        return
+    current = tuple(getattr(instance, field) for field in AUTH_FIELDS)
+    if current != getattr(instance, '_loaded_auth_fields', None):
+        from .authentication import revoke_cached_tokens
+        revoke_cached_tokens(instance.pk)
+    instance._loaded_auth_fields = current
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    """Stop accepting a deleted token from the verified-token cache"""
+    from .authentication import revoke_cached_tokens
+    revoke_cached_tokens(instance.user_id)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def revoke_tokens_on_permission_change(sender, instance, action, model, pk_set, **kwargs):
+    """Reject cached permission snapshots of the users whose permissions change"""
+    # Before removals, while the relations to follow still exist
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    from .authentication import revoke_cached_tokens
+
+    if isinstance(instance, User):
+        user_ids = [instance.pk]
+    elif model is User:
+        # A group's or permission's users, changed from their side
+        user_ids = pk_set if pk_set is not None else instance.user_set.values_list('pk', flat=True)
+    elif isinstance(instance, Group):
+        user_ids = instance.user_set.values_list('pk', flat=True)
+    else:
+        # A permission's groups
+        groups = pk_set if pk_set is not None else instance.group_set.values_list('pk', flat=True)
+        user_ids = User.objects.filter(groups__in=groups).values_list('pk', flat=True)
+    for user_id in set(user_ids):
+        revoke_cached_tokens(user_id)
+
+
+def get_request_profile(request):
+    """
+    Get the profile of the request's user, creating it on first access.
+
+    The profile is cached on ``request.user`` so repeated lookups during the
+    same request don't query again.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    try:
+        return user.profile
+    except UserProfile.DoesNotExist:
+        profile, _ = UserProfile.objects.get_or_create(user=user)
+        user.profile = profile
+        return profile
 
 
 class DistributorApplication(models.Model):
@@ -126,6 +226,10 @@ class UserActivity(models.Model):
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = "User Activities"
+        indexes = [
+            models.Index(fields=['created_at'], name='useractivity_created_idx'),
+            models.Index(fields=['user', '-created_at'], name='useractivity_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.activity_type}"
@@ -150,11 +254,102 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='notification_created_idx'),
+            models.Index(
+                fields=['user', 'is_read', '-created_at'], name='notification_user_unread_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
 
 
+class NotificationCounter(models.Model):
+    """Per-user count of unread notifications, kept in step with Notification"""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter'
+    )
+    unread_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.unread_count} unread"
+
+
+class NotificationBroadcast(models.Model):
+    """A notification sent to every user matching a set of profile filters"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    notification_type = models.CharField(
+        max_length=20, choices=Notification.NOTIFICATION_TYPE_CHOICES, default='promotion'
+    )
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    
+    # Targeting (blank means no restriction)
+    user_type = models.CharField(max_length=20, choices=UserProfile.USER_TYPE_CHOICES, blank=True)
+    city = models.CharField(max_length=100, blank=True)
+    email_notifications = models.BooleanField(null=True, blank=True)
+    sms_notifications = models.BooleanField(null=True, blank=True)
+    
+    # Progress
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_recipients = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    # Recipients are walked in user-id order; the last one sent to, to resume from
+    last_user_id = models.PositiveIntegerField(default=0, editable=False)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='notification_broadcasts'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.title} - {self.get_status_display()}"
+
+    @property
+    def throughput(self):
+        """Notifications created per second so far"""
+        if not self.started_at:
+            return 0
+        end = self.completed_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        return round(self.sent_count / elapsed, 1) if elapsed > 0 else 0
+
+    def get_recipient_profiles(self):
+        """Profiles of the users this broadcast targets"""
+        profiles = UserProfile.objects.filter(user__is_active=True)
+        if self.user_type:
+            profiles = profiles.filter(user_type=self.user_type)
+        if self.city:
+            profiles = profiles.filter(city__iexact=self.city)
+        if self.email_notifications is not None:
+            profiles = profiles.filter(email_notifications=self.email_notifications)
+        if self.sms_notifications is not None:
+            profiles = profiles.filter(sms_notifications=self.sms_notifications)
+        return profiles
+
+
+@receiver(post_save, sender=Notification)
+def publish_new_notification(sender, instance, created, **kwargs):
+    """Count and push new notifications to the user's open streams"""
+    if created:
+        from .notifications import adjust_unread_count, publish_notification
+        if not instance.is_read:
+            adjust_unread_count(instance.user_id, 1)
+        publish_notification(instance)
+
+
 class UserSession(models.Model):
     """Model for tracking user sessions"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sessions')
@@ -167,6 +362,9 @@ class UserSession(models.Model):
 
     class Meta:
         ordering = ['-login_time']
+        indexes = [
+            models.Index(fields=['login_time'], name='usersession_login_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.login_time}"
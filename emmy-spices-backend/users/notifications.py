@@ -0,0 +1,202 @@
+"""
+Real-time notification fan-out.
+
+New Notification rows are published, once their transaction commits, to a
+broker that pushes them to every open Server-Sent Events stream of the
+notification's user. The broker is selected with the NOTIFICATION_BROKER
+setting; ``LocalBroker`` fans out inside this process, and any class with
+the same ``publish``/``subscribe``/``unsubscribe`` methods (for example one
+backed by Redis pub/sub) can replace it.
+
+Broadcasts are published from the ``run_jobs`` workers, which ``LocalBroker``
+cannot reach; streams on a broker that is not ``shared`` pick them up from
+the Notification table on every heartbeat instead.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.module_loading import import_string
+
+
+class NotificationBroker:
+    """Interface for delivering notification payloads to subscribers"""
+
+    # Whether payloads published in other processes reach this process's
+    # subscribers
+    shared = False
+
+    def publish(self, user_id, payload):
+        """Deliver ``payload`` to every subscriber of ``user_id``"""
+        raise NotImplementedError
+
+    def subscribe(self, user_id):
+        """Register a subscriber and return an ``asyncio.Queue`` it reads from"""
+        raise NotImplementedError
+
+    def unsubscribe(self, user_id, queue):
+        """Remove a subscriber returned by ``subscribe``"""
+        raise NotImplementedError
+
+
+class LocalBroker(NotificationBroker):
+    """In-process pub/sub hub; publish is safe to call from any thread"""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(dict)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, payload):
+        with self._lock:
+            subscribers = list(self.subscribers.get(user_id, {}).items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, payload)
+            except RuntimeError:
+                # The subscriber's event loop is closed; it will unsubscribe
+                # itself, or is already gone.
+                pass
+
+    def _put(self, queue, payload):
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self.subscribers[user_id][queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            user_subscribers = self.subscribers.get(user_id)
+            if user_subscribers is not None:
+                user_subscribers.pop(queue, None)
+                if not user_subscribers:
+                    del self.subscribers[user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(queues) for queues in self.subscribers.values())
+
+
+def get_broker():
+    """Get the configured broker instance"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_path = getattr(
+                    settings, 'NOTIFICATION_BROKER', 'users.notifications.LocalBroker'
+                )
+                _broker = import_string(broker_path)()
+    return _broker
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def notification_payload(notification):
+    return {
+        'id': notification.id,
+        'notification_type': notification.notification_type,
+        'title': notification.title,
+        'message': notification.message,
+        'is_read': notification.is_read,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+def publish_notification(notification):
+    """Push a saved notification to its user's streams after commit"""
+    payload = notification_payload(notification)
+    user_id = notification.user_id
+    transaction.on_commit(lambda: get_broker().publish(user_id, payload))
+
+
+def notify(user, notification_type, title, message):
+    """Create a notification for ``user``; delivery happens on commit"""
+    from .models import Notification
+
+    with transaction.atomic():
+        return Notification.objects.create(
+            user=user,
+            notification_type=notification_type,
+            title=title,
+            message=message
+        )
+
+
+def adjust_unread_count(user_id, delta):
+    """Add ``delta`` to a user's unread counter in the current transaction"""
+    from .models import NotificationCounter
+
+    updated = NotificationCounter.objects.filter(user_id=user_id).update(
+        unread_count=Greatest(F('unread_count') + delta, 0)
+    )
+    if not updated:
+        # Create the row empty and add to it, so a counter created
+        # concurrently still gets the delta
+        NotificationCounter.objects.bulk_create(
+            [NotificationCounter(user_id=user_id, unread_count=0)], ignore_conflicts=True
+        )
+        NotificationCounter.objects.filter(user_id=user_id).update(
+            unread_count=Greatest(F('unread_count') + delta, 0)
+        )
+
+
+def increment_unread_counts(user_ids):
+    """Add one unread notification for each of ``user_ids``"""
+    from .models import NotificationCounter
+
+    user_ids = list(user_ids)
+    # Missing rows are created empty first: an insert that conflicts with a
+    # concurrently created row is then harmless, and the single update below
+    # counts the notification for every user
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id, unread_count=0) for user_id in user_ids],
+        ignore_conflicts=True
+    )
+    NotificationCounter.objects.filter(user_id__in=user_ids).update(
+        unread_count=F('unread_count') + 1
+    )
+
+
+def get_unread_count(user_id):
+    """Get a user's unread count with a single primary-key lookup"""
+    from .models import NotificationCounter
+
+    count = NotificationCounter.objects.filter(user_id=user_id).values_list(
+        'unread_count', flat=True
+    ).first()
+    return count or 0
+
+
+def rebuild_unread_counts(user_ids=None):
+    """Recompute unread counters from the Notification table"""
+    from .models import Notification, NotificationCounter, User
+
+    users = User.objects.all() if user_ids is None else User.objects.filter(id__in=user_ids)
+    missing = users.filter(
+        notification_counter__isnull=True, notifications__is_read=False
+    ).distinct().values_list('id', flat=True)
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id) for user_id in missing],
+        ignore_conflicts=True
+    )
+    unread = Notification.objects.filter(
+        user_id=OuterRef('user_id'), is_read=False
+    ).order_by().values('user_id').annotate(total=Count('id')).values('total')
+    counters = NotificationCounter.objects.all()
+    if user_ids is not None:
+        counters = counters.filter(user_id__in=user_ids)
+    counters.update(unread_count=Coalesce(Subquery(unread), 0))
@@ -0,0 +1,53 @@
+"""
+Batched retention pruning for append-mostly history tables.
+
+Expired rows are removed oldest first, one day of the timestamp column at a
+time and in primary-key batches, so every statement only touches a narrow
+indexed range and no transaction holds locks for long.
+"""
+import json
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+
+def prune_queryset(queryset, field, cutoff, batch_size=1000, archive=None,
+                   after_delete=None, after_delete_field='pk'):
+    """
+    Delete rows of ``queryset`` whose ``field`` is older than ``cutoff``.
+
+    When ``archive`` is a writable text stream each row is written to it as
+    one JSON line before it is deleted. ``after_delete`` is called after each
+    batch with the set of the deleted rows' ``after_delete_field`` values.
+    Returns the number of rows deleted.
+    """
+    expired = queryset.filter(**{f'{field}__lt': cutoff})
+    deleted = 0
+    while True:
+        window_start = expired.order_by(field).values_list(field, flat=True).first()
+        if window_start is None:
+            break
+        window = expired.filter(**{
+            f'{field}__gte': window_start,
+            f'{field}__lt': window_start + timedelta(days=1),
+        }).order_by()
+        while True:
+            ids = list(window.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            batch = queryset.model._base_manager.filter(pk__in=ids)
+            if archive is not None:
+                for row in batch.values():
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+            if after_delete is not None:
+                values = set(batch.values_list(after_delete_field, flat=True))
+            deleted += batch.delete()[0]
+            if after_delete is not None:
+                after_delete(values)
+    return deleted
+
+
+def cutoff_for(days):
+    """Get the timestamp before which rows are older than ``days``"""
+    return timezone.now() - timedelta(days=days)
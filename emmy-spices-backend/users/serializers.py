@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import UserProfile, DistributorApplication, UserActivity, Notification
+from emmy_spices_backend.images import ImageVariantsField
+from .models import (
+    UserProfile, DistributorApplication, UserActivity, Notification, NotificationBroadcast
+)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -16,6 +19,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
     """Serializer for UserProfile model"""
     user = UserSerializer(read_only=True)
     user_id = serializers.IntegerField(write_only=True, required=False)
+    profile_picture_variants = ImageVariantsField()
 
     class Meta:
         model = UserProfile
@@ -23,7 +27,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
             'id', 'user', 'user_id', 'user_type', 'phone_number', 'address',
             'city', 'state', 'country', 'postal_code', 'company_name',
             'business_license', 'tax_id', 'email_notifications', 'sms_notifications',
-            'profile_picture', 'created_at', 'updated_at'
+            'profile_picture', 'profile_picture_variants', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
 
@@ -82,6 +86,24 @@ class NotificationSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'created_at']
 
 
+class NotificationBroadcastSerializer(serializers.ModelSerializer):
+    """Serializer for NotificationBroadcast model"""
+    throughput = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = NotificationBroadcast
+        fields = [
+            'id', 'notification_type', 'title', 'message', 'user_type', 'city',
+            'email_notifications', 'sms_notifications', 'status', 'total_recipients',
+            'sent_count', 'throughput', 'error', 'created_by', 'created_at',
+            'started_at', 'completed_at'
+        ]
+        read_only_fields = [
+            'status', 'total_recipients', 'sent_count', 'error', 'created_by',
+            'created_at', 'started_at', 'completed_at'
+        ]
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     """Serializer for user registration"""
     password = serializers.CharField(write_only=True)
@@ -111,22 +133,20 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         address = validated_data.pop('address', '')
         password_confirm = validated_data.pop('password_confirm')
         
-        # Create user
-        user = User.objects.create_user(
+        # Create user; the post_save signal writes the profile with these values
+        user = User(
             username=validated_data['username'],
             email=validated_data['email'],
-            password=validated_data['password'],
             first_name=validated_data.get('first_name', ''),
             last_name=validated_data.get('last_name', '')
         )
-        
-        # Create profile
-        UserProfile.objects.create(
-            user=user,
-            user_type=user_type,
-            phone_number=phone_number,
-            address=address
-        )
+        user.set_password(validated_data['password'])
+        user._profile_defaults = {
+            'user_type': user_type,
+            'phone_number': phone_number,
+            'address': address,
+        }
+        user.save()
         
         return user
 
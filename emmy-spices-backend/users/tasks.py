@@ -0,0 +1,25 @@
+from emmy_spices_backend.images import render_variants
+from jobs.queue import task
+from .models import NotificationBroadcast, UserProfile
+
+
+@task(priority=-5, max_attempts=3)
+def render_profile_picture_variants(pk):
+    """Render the thumbnails and WebP variants of a profile picture"""
+    profile = UserProfile.objects.filter(pk=pk).first()
+    if profile is None or not profile.profile_picture:
+        return
+    # A replaced picture has a job of its own
+    UserProfile.objects.filter(pk=pk, profile_picture=profile.profile_picture.name).update(
+        profile_picture_variants=render_variants(profile.profile_picture)
+    )
+
+
+@task(max_attempts=3)
+def send_broadcast(broadcast_id, chunk_size=5000):
+    """Create the notifications of a broadcast, resuming a run that was interrupted"""
+    from .broadcast import run_broadcast
+
+    broadcast = NotificationBroadcast.objects.filter(pk=broadcast_id).first()
+    if broadcast is not None:
+        run_broadcast(broadcast, chunk_size)
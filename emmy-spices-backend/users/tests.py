@@ -1,3 +1,370 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, Permission, User, update_last_login
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from jobs.models import Job
+from jobs.queue import Worker
+from .activity import ActivityWriter, get_client_ip, prune_activity
+from .authentication import CachedTokenAuthentication, VerifiedTokenCache, token_cache
+from .broadcast import run_broadcast
+from .models import (
+    Notification, NotificationBroadcast, NotificationCounter, UserActivity, UserProfile
+)
+from .notifications import (
+    adjust_unread_count, get_broker, get_unread_count, increment_unread_counts,
+    notification_payload
+)
+from .retention import prune_queryset
+from .views import _notification_events
+
+
+class ActivityWriterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.writer = ActivityWriter(maxsize=3, batch_size=10, flush_interval_ms=50)
+
+    def activity(self, description='GET /api/'):
+        return UserActivity(user=self.user, activity_type='GET', description=description)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        self.writer._ensure_started = lambda: None
+        results = [self.writer.enqueue(self.activity()) for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+        self.writer.flush()
+        self.assertEqual(UserActivity.objects.count(), 3)
+        self.assertEqual(self.writer.stats()['dropped'], 1)
+
+    def test_bad_record_does_not_lose_its_batch(self):
+        batch = [self.activity(), self.activity(description=None), self.activity()]
+        with self.assertLogs('users.activity', 'ERROR') as logs:
+            self.writer._write(batch)
+        self.assertEqual(UserActivity.objects.count(), 2)
+        self.assertEqual((self.writer.written, self.writer.failed), (2, 1))
+        self.assertIn('Dropped 1 of 3', logs.output[-1])
+
+    @override_settings(USER_ACTIVITY_LOGGING=True)
+    def test_middleware_logs_authenticated_api_requests(self):
+        self.client.force_login(self.user)
+        with mock.patch('users.middleware.log_activity') as log_activity:
+            self.client.get('/api/users/api/notifications/')
+            self.client.get('/admin/login/')
+        [call] = log_activity.call_args_list
+        self.assertEqual(call.args[0], self.user)
+        self.assertEqual(call.args[2], 'GET /api/users/api/notifications/ -> 200')
+
+
+class ClientIPTests(TestCase):
+    def get(self, **meta):
+        return APIRequestFactory().get('/api/', **meta)
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        request = self.get(REMOTE_ADDR='10.0.0.5', HTTP_X_FORWARDED_FOR='1.2.3.4')
+        self.assertEqual(get_client_ip(request), '10.0.0.5')
+
+    def test_forwarded_for_is_read_behind_configured_proxies(self):
+        request = self.get(REMOTE_ADDR='10.0.0.5', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.9')
+        with override_settings(REST_FRAMEWORK={'NUM_PROXIES': 1}):
+            self.assertEqual(get_client_ip(request), '203.0.113.9')
+
+    def test_invalid_addresses_are_dropped(self):
+        request = self.get(REMOTE_ADDR='10.0.0.5', HTTP_X_FORWARDED_FOR='<script>')
+        with override_settings(REST_FRAMEWORK={'NUM_PROXIES': 1}):
+            self.assertIsNone(get_client_ip(request))
+
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader')
+        self.client.force_login(self.user)
+
+    def notify(self, count=1):
+        for _ in range(count):
+            Notification.objects.create(
+                user=self.user, notification_type='system', title='Hi', message='Hello'
+            )
+
+    def test_counter_follows_reads(self):
+        self.notify(3)
+        self.assertEqual(get_unread_count(self.user.id), 3)
+        notification = Notification.objects.first()
+        self.client.post(f'/api/users/api/notifications/{notification.pk}/mark_read/')
+        self.assertEqual(get_unread_count(self.user.id), 2)
+
+    def test_mark_all_read_subtracts_only_what_it_marked(self):
+        self.notify(2)
+        # A notification counted but not yet visible to the update, as when
+        # created concurrently
+        adjust_unread_count(self.user.id, 1)
+        self.client.post('/api/users/api/notifications/mark_all_read/')
+        self.assertEqual(get_unread_count(self.user.id), 1)
+
+    def test_increment_counts_users_with_and_without_counters(self):
+        other = User.objects.create_user('other')
+        self.notify()
+        increment_unread_counts([self.user.id, other.id])
+        self.assertEqual(
+            dict(NotificationCounter.objects.values_list('user_id', 'unread_count')),
+            {self.user.id: 2, other.id: 1}
+        )
+
+
+class NotificationStreamTests(TestCase):
+    async def test_token_clients_can_subscribe(self):
+        user = await User.objects.acreate(username='listener')
+        token = await Token.objects.acreate(user=user)
+        path = '/api/users/api/notifications/stream/'
+        self.assertEqual((await self.async_client.get(path)).status_code, 401)
+        response = await self.async_client.get(path, headers={'Authorization': 'Token bogus'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(path, headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+    async def read_events(self, events, count):
+        return [await anext(events) for _ in range(count)]
+
+    @override_settings(NOTIFICATION_STREAM_HEARTBEAT=0.01)
+    async def test_local_streams_pick_up_notifications_from_other_processes(self):
+        user = await User.objects.acreate(username='listener')
+        events = _notification_events(user.id, None)
+        try:
+            self.assertEqual(
+                await self.read_events(events, 2), ['retry: 3000\n\n', ': keep-alive\n\n']
+            )
+            # Written without publishing, as a broadcast in a job worker is
+            [broadcast, live] = await Notification.objects.abulk_create([
+                Notification(user=user, notification_type='promotion', title=title, message='Hi')
+                for title in ('Broadcast', 'Live')
+            ])
+            get_broker().publish(user.id, notification_payload(live))
+            received = [
+                event for event in await self.read_events(events, 6) if event.startswith('id:')
+            ]
+        finally:
+            await events.aclose()
+        self.assertEqual(
+            sorted(event.split('\n')[0] for event in received),
+            [f'id: {broadcast.id}', f'id: {live.id}']
+        )
+
+
+class BroadcastTests(TestCase):
+    def setUp(self):
+        self.recipients = [User.objects.create_user(f'customer{i}') for i in range(5)]
+        self.admin = User.objects.create_user('admin', is_staff=True)
+        UserProfile.objects.filter(user=self.admin).update(user_type='admin')
+
+    def create_broadcast(self):
+        return NotificationBroadcast.objects.create(
+            title='Sale', message='20% off', user_type='customer'
+        )
+
+    def test_api_queues_a_job(self):
+        self.client.force_login(self.admin)
+        response = self.client.post('/api/users/api/notification-broadcasts/', {
+            'title': 'Sale', 'message': '20% off', 'user_type': 'customer',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        job = Job.objects.get(task='users.tasks.send_broadcast')
+        self.assertEqual(job.kwargs['broadcast_id'], response.json()['id'])
+
+        self.assertTrue(Worker().run_job(Worker().claim()))
+        broadcast = NotificationBroadcast.objects.get()
+        self.assertEqual((broadcast.status, broadcast.sent_count), ('completed', 5))
+        self.assertEqual(Notification.objects.count(), 5)
+
+    def test_interrupted_broadcast_resumes(self):
+        broadcast = self.create_broadcast()
+        calls = []
+
+        def flaky_increment(user_ids):
+            calls.append(user_ids)
+            if len(calls) == 2:
+                raise OSError('down')
+            increment_unread_counts(user_ids)
+
+        with mock.patch('users.broadcast.increment_unread_counts', flaky_increment):
+            with self.assertRaises(OSError):
+                run_broadcast(broadcast, chunk_size=2)
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.sent_count), ('failed', 2))
+
+        self.assertEqual(run_broadcast(broadcast, chunk_size=2), 5)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('user_id', flat=True)),
+            [user.id for user in self.recipients]
+        )
+        self.assertEqual(get_unread_count(self.recipients[0].id), 1)
+
+    def test_a_second_run_does_not_resend_chunks(self):
+        broadcast = self.create_broadcast()
+        stale = NotificationBroadcast.objects.get(pk=broadcast.pk)
+        run_broadcast(broadcast, chunk_size=2)
+        self.assertEqual(run_broadcast(stale, chunk_size=2), 5)
+        self.assertEqual(Notification.objects.count(), 5)
+        self.assertEqual(NotificationBroadcast.objects.get().status, 'completed')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = User.objects.create_user('api-client', password='old-password')
+        self.token = Token.objects.create(user=self.user)
+
+    def authenticate(self):
+        request = Request(APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {self.token.key}'))
+        return CachedTokenAuthentication().authenticate(request)
+
+    def assert_cached(self, cached):
+        with CaptureQueriesContext(connection) as queries:
+            self.authenticate()
+        self.assertEqual(not queries, cached)
+
+    def test_verified_tokens_are_served_from_the_cache(self):
+        self.authenticate()
+        self.assert_cached(True)
+
+    def test_entries_expire_after_the_ttl(self):
+        self.authenticate()
+        with mock.patch('users.authentication.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_permissions_are_cached_with_the_user(self):
+        permission = Permission.objects.get(codename='view_notification')
+        self.user.user_permissions.add(permission)
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+            self.assertTrue(user.has_perm('users.view_notification'))
+            self.assertFalse(user.has_perm('users.delete_notification'))
+
+    def test_auth_changes_revoke_cached_tokens(self):
+        changes = [
+            lambda user: user.set_password('new-password'),
+            lambda user: setattr(user, 'is_staff', True),
+        ]
+        for change in changes:
+            self.authenticate()
+            user = User.objects.get(pk=self.user.pk)
+            change(user)
+            with self.captureOnCommitCallbacks(execute=True):
+                user.save()
+            self.assert_cached(False)
+
+    def test_permission_changes_revoke_cached_tokens(self):
+        group = Group.objects.create(name='editors')
+        self.user.groups.add(group)
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            group.permissions.add(Permission.objects.get(codename='change_notification'))
+        user, _ = self.authenticate()
+        self.assertTrue(user.has_perm('users.change_notification'))
+
+    def test_unrelated_saves_keep_cached_tokens(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, User.objects.get(pk=self.user.pk))
+            user = User.objects.get(pk=self.user.pk)
+            user.first_name = 'Ada'
+            user.save()
+        self.assert_cached(True)
+
+    def test_deleted_tokens_are_rejected_by_every_worker(self):
+        self.authenticate()
+        # Another worker's cache, sharing the version counters
+        other_worker = VerifiedTokenCache(maxsize=10, ttl=60)
+        other_worker.revoke_user(self.user.pk)
+        self.assertIsNone(token_cache.get(self.token.key))
+
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class PruneHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('visitor')
+        now = timezone.now()
+        # Two expired days, and rows inside the retention window
+        for days_ago in (100, 100, 100, 95, 10, 0):
+            activity = UserActivity.objects.create(
+                user=self.user, activity_type='page_view', description=f'{days_ago} days ago'
+            )
+            UserActivity.objects.filter(pk=activity.pk).update(
+                created_at=now - timedelta(days=days_ago)
+            )
+
+    def remaining(self):
+        return sorted(UserActivity.objects.values_list('description', flat=True))
+
+    def test_prunes_rows_older_than_cutoff_in_batches(self):
+        archive = io.StringIO()
+        cutoff = timezone.now() - timedelta(days=90)
+        deleted = prune_queryset(UserActivity.objects.all(), 'created_at', cutoff, 2, archive)
+        self.assertEqual(deleted, 4)
+        self.assertEqual(self.remaining(), ['0 days ago', '10 days ago'])
+        rows = [json.loads(line) for line in archive.getvalue().splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[-1]['description'], '95 days ago')
+
+    def test_prune_activity_uses_retention_days(self):
+        self.assertEqual(prune_activity(days=98), 3)
+        self.assertEqual(prune_activity(days=5), 2)
+        self.assertEqual(self.remaining(), ['0 days ago'])
+
+    def test_dry_run_deletes_nothing(self):
+        out = io.StringIO()
+        call_command('prune_history', '--only', 'activity', '--dry-run', stdout=out)
+        self.assertIn('activity: would prune 4 rows older than 90 days', out.getvalue())
+        self.assertEqual(UserActivity.objects.count(), 6)
+
+    def test_archive_dir(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        call_command(
+            'prune_history', '--only', 'activity', '--only', 'sessions',
+            '--archive-dir', archive_dir, stdout=io.StringIO()
+        )
+        # Nothing expired in sessions, so it leaves no file behind
+        [name] = os.listdir(archive_dir)
+        self.assertTrue(name.startswith('activity-'))
+        with gzip.open(os.path.join(archive_dir, name), 'rt') as archive:
+            self.assertEqual(len(archive.readlines()), 4)
+        self.assertEqual(self.remaining(), ['0 days ago', '10 days ago'])
+
+    def test_pruning_notifications_rebuilds_unread_counts(self):
+        for days_ago in (400, 0):
+            notification = Notification.objects.create(
+                user=self.user, notification_type='system', title='Hi', message='Hello'
+            )
+            Notification.objects.filter(pk=notification.pk).update(
+                created_at=timezone.now() - timedelta(days=days_ago)
+            )
+        self.assertEqual(get_unread_count(self.user.id), 2)
+        # Counters of users with nothing pruned are left alone
+        bystander = User.objects.create_user('bystander')
+        adjust_unread_count(bystander.id, 5)
+        call_command('prune_history', '--only', 'notifications', stdout=io.StringIO())
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(get_unread_count(self.user.id), 1)
+        self.assertEqual(get_unread_count(bystander.id), 5)
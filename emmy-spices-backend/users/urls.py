@@ -1,13 +1,26 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserProfileViewSet, DistributorApplicationViewSet
+from .views import (
+    UserProfileViewSet, DistributorApplicationViewSet, UserActivityViewSet,
+    NotificationViewSet, NotificationBroadcastViewSet, AuthTokenViewSet, notification_stream,
+    async_unread_notifications
+)
 
 router = DefaultRouter()
 router.register(r'profiles', UserProfileViewSet)
 router.register(r'distributor-applications', DistributorApplicationViewSet)
+router.register(r'activities', UserActivityViewSet)
+router.register(r'notifications', NotificationViewSet)
+router.register(r'notification-broadcasts', NotificationBroadcastViewSet)
+router.register(r'auth/token', AuthTokenViewSet, basename='auth-token')
 
 app_name = 'users'
 
 urlpatterns = [
+    path('api/notifications/stream/', notification_stream, name='notification-stream'),
+    path(
+        'api/async/notifications/unread/', async_unread_notifications,
+        name='async-notification-unread'
+    ),
     path('api/', include(router.urls)),
 ] 
\ No newline at end of file
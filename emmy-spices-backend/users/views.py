@@ -1,19 +1,44 @@
+import asyncio
+import json
+import time
+
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.permissions import (
+    IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser, AllowAny
+)
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.serializers import AuthTokenSerializer
 
-from .models import UserProfile, DistributorApplication, UserActivity, Notification
+from emmy_spices_backend.async_api import aauthenticate, async_api_view
+from emmy_spices_backend.metrics import SerializerTimingMixin
+
+from .models import (
+    UserProfile, DistributorApplication, UserActivity, Notification, NotificationBroadcast,
+    get_request_profile
+)
+from . import activity
+from .notifications import (
+    get_broker, notification_payload, adjust_unread_count, get_unread_count,
+    rebuild_unread_counts
+)
+from .broadcast import start_broadcast
+from .authentication import token_cache
 from .serializers import (
     UserProfileSerializer, DistributorApplicationSerializer,
-    UserActivitySerializer, NotificationSerializer
+    UserActivitySerializer, NotificationSerializer, NotificationBroadcastSerializer
 )
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     """ViewSet for UserProfile model"""
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
@@ -24,7 +49,7 @@ class UserProfileViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Filter queryset based on user"""
-        queryset = UserProfile.objects.all()
+        queryset = UserProfile.objects.select_related('user')
         
         # If user is not admin, only show their own profile
         if not self.request.user.is_staff:
@@ -38,35 +63,33 @@ class UserProfileViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated()]
         return [IsAuthenticatedOrReadOnly()]
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def my_profile(self, request):
         """Get current user's profile"""
-        try:
-            profile = UserProfile.objects.get(user=request.user)
-            serializer = self.get_serializer(profile)
-            return Response(serializer.data)
-        except UserProfile.DoesNotExist:
-            return Response(
-                {'error': 'Profile not found'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
+        profile = get_request_profile(request)
+        serializer = self.get_serializer(profile)
+        return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def distributors(self, request):
         """Get all distributor profiles"""
-        distributor_profiles = UserProfile.objects.filter(user_type='distributor')
+        distributor_profiles = UserProfile.objects.filter(
+            user_type='distributor'
+        ).select_related('user')
         serializer = self.get_serializer(distributor_profiles, many=True)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def customers(self, request):
         """Get all customer profiles"""
-        customer_profiles = UserProfile.objects.filter(user_type='customer')
+        customer_profiles = UserProfile.objects.filter(
+            user_type='customer'
+        ).select_related('user')
         serializer = self.get_serializer(customer_profiles, many=True)
         return Response(serializer.data)
 
 
-class DistributorApplicationViewSet(viewsets.ModelViewSet):
+class DistributorApplicationViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     """ViewSet for DistributorApplication model"""
     queryset = DistributorApplication.objects.all()
     serializer_class = DistributorApplicationSerializer
@@ -110,12 +133,14 @@ class DistributorApplicationViewSet(viewsets.ModelViewSet):
         application.save()
         
         # Update user profile to distributor
-        user_profile = application.user.profile
+        user_profile, _ = UserProfile.objects.get_or_create(user_id=application.user_id)
         user_profile.user_type = 'distributor'
         user_profile.company_name = application.company_name
         user_profile.business_license = application.business_license
         user_profile.tax_id = application.tax_id
-        user_profile.save()
+        user_profile.save(update_fields=[
+            'user_type', 'company_name', 'business_license', 'tax_id', 'updated_at'
+        ])
         
         serializer = self.get_serializer(application)
         return Response(serializer.data)
@@ -145,7 +170,7 @@ class DistributorApplicationViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class UserActivityViewSet(viewsets.ReadOnlyModelViewSet):
+class UserActivityViewSet(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for UserActivity model"""
     queryset = UserActivity.objects.all()
     serializer_class = UserActivitySerializer
@@ -168,8 +193,18 @@ class UserActivityViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(activities, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def queue_stats(self, request):
+        """Get activity write-behind queue statistics"""
+        if not request.user.is_staff:
+            return Response(
+                {'error': 'Only admins can view activity queue statistics'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return Response(activity.writer.stats())
+
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     """ViewSet for Notification model"""
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
@@ -185,25 +220,225 @@ class NotificationViewSet(viewsets.ModelViewSet):
         
         return queryset
 
+    def perform_update(self, serializer):
+        """Save the notification and resync the owner's unread counter"""
+        with transaction.atomic():
+            notification = serializer.save()
+            rebuild_unread_counts([notification.user_id])
+
+    def perform_destroy(self, instance):
+        """Delete the notification and keep the unread counter in step"""
+        with transaction.atomic():
+            instance.delete()
+            if not instance.is_read:
+                adjust_unread_count(instance.user_id, -1)
+
     @action(detail=False, methods=['get'])
     def unread(self, request):
         """Get unread notifications"""
-        unread_notifications = self.get_queryset().filter(is_read=False)
+        unread_notifications = self.get_queryset().filter(is_read=False).select_related('user')
         serializer = self.get_serializer(unread_notifications, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """Get the number of unread notifications for the header badge"""
+        return Response({'unread_count': get_unread_count(request.user.id)})
+
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """Mark notification as read"""
         notification = self.get_object()
+        with transaction.atomic():
+            updated = Notification.objects.filter(pk=notification.pk, is_read=False).update(
+                is_read=True
+            )
+            if updated:
+                adjust_unread_count(notification.user_id, -1)
         notification.is_read = True
-        notification.save()
         
         serializer = self.get_serializer(notification)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], url_path='mark_read', url_name='mark-read-bulk')
+    def mark_read_bulk(self, request):
+        """Mark a list of the current user's notifications as read"""
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return Response(
+                {'error': 'ids must be a list of notification IDs'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        with transaction.atomic():
+            updated = Notification.objects.filter(
+                user=request.user, id__in=ids, is_read=False
+            ).update(is_read=True)
+            if updated:
+                adjust_unread_count(request.user.id, -updated)
+        return Response({'marked_read': updated})
+
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
-        """Mark all notifications as read"""
-        self.get_queryset().update(is_read=True)
+        """Mark all of the current user's notifications as read"""
+        with transaction.atomic():
+            updated = Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+            if updated:
+                adjust_unread_count(request.user.id, -updated)
         return Response({'message': 'All notifications marked as read'})
+
+
+class AuthTokenViewSet(viewsets.ViewSet):
+    """Issue and revoke API tokens"""
+    permission_classes = [IsAuthenticated]
+
+    def get_permissions(self):
+        if self.action == 'create':
+            return [AllowAny()]
+        return super().get_permissions()
+
+    def create(self, request):
+        """Exchange a username and password for an API token"""
+        serializer = AuthTokenSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        token, created = Token.objects.get_or_create(user=serializer.validated_data['user'])
+        return Response(
+            {'token': token.key},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['post'])
+    def revoke(self, request):
+        """Revoke the token used for this request"""
+        if not isinstance(request.auth, Token):
+            return Response(
+                {'error': 'This request was not authenticated with a token'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        Token.objects.filter(key=request.auth.key).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Get verified-token cache statistics"""
+        if not request.user.is_staff:
+            return Response(
+                {'error': 'Only admins can view token cache statistics'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return Response(token_cache.stats())
+
+
+class NotificationBroadcastViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    """ViewSet for NotificationBroadcast model"""
+    queryset = NotificationBroadcast.objects.all()
+    serializer_class = NotificationBroadcastSerializer
+    permission_classes = [IsAdminUser]
+    http_method_names = ['get', 'post', 'head', 'options']
+
+    def perform_create(self, serializer):
+        """Save the broadcast and fan it out in the background"""
+        broadcast = serializer.save(created_by=self.request.user)
+        start_broadcast(broadcast)
+
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """Get broadcast progress"""
+        broadcast = self.get_object()
+        return Response({
+            'status': broadcast.status,
+            'sent_count': broadcast.sent_count,
+            'total_recipients': broadcast.total_recipients,
+            'throughput': broadcast.throughput,
+        })
+
+
+def _sse_event(payload):
+    return f"id: {payload['id']}\nevent: notification\ndata: {json.dumps(payload)}\n\n"
+
+
+async def _notification_events(user_id, last_event_id):
+    """Yield missed notifications, then live ones as they are published"""
+    broker = get_broker()
+    queue = broker.subscribe(user_id)
+    heartbeat = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT', 15)
+    # Unless the broker spans processes, notifications published by other
+    # processes (broadcasts from the job workers) are read from the table
+    poll = not broker.shared
+    # Live notifications sent past last_event_id, skipped by the next replay
+    sent = set()
+    try:
+        yield 'retry: 3000\n\n'
+        
+        if last_event_id is None and poll:
+            last_event_id = await Notification.objects.filter(user_id=user_id).order_by(
+                '-id'
+            ).values_list('id', flat=True).afirst() or 0
+        # Replay anything created while the client was disconnected, then,
+        # when polling, whatever was created since once per heartbeat
+        next_replay = 0 if last_event_id is not None else None
+        
+        while True:
+            if next_replay is not None and time.monotonic() >= next_replay:
+                missed = Notification.objects.filter(
+                    user_id=user_id, id__gt=last_event_id
+                ).order_by('id')
+                async for notification in missed:
+                    last_event_id = notification.id
+                    if notification.id not in sent:
+                        yield _sse_event(notification_payload(notification))
+                sent = {sent_id for sent_id in sent if sent_id > last_event_id}
+                next_replay = time.monotonic() + heartbeat if poll else None
+            try:
+                payload = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if last_event_id is not None:
+                if payload['id'] <= last_event_id or payload['id'] in sent:
+                    continue
+                if poll:
+                    sent.add(payload['id'])
+            yield _sse_event(payload)
+    finally:
+        broker.unsubscribe(user_id, queue)
+
+
+async def notification_stream(request):
+    """
+    Server-Sent Events stream of the current user's new notifications.
+
+    Clients authenticate as with the API, by session or ``Authorization:
+    Token`` header. Serve it under ASGI: under WSGI every open stream holds
+    a worker thread for as long as the client stays connected.
+    """
+    try:
+        user, _ = await aauthenticate(request)
+    except AuthenticationFailed as exc:
+        return JsonResponse({'detail': exc.detail}, status=status.HTTP_401_UNAUTHORIZED)
+    if not user.is_authenticated:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    last_event_id = request.headers.get('Last-Event-ID')
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    
+    response = StreamingHttpResponse(
+        _notification_events(user.id, last_event_id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@async_api_view(NotificationViewSet, 'unread')
+async def async_unread_notifications(request, view):
+    """Async variant of the unread notifications"""
+    notifications = view.get_queryset().filter(is_read=False).select_related('user')
+    return view.get_serializer(
+        [notification async for notification in notifications], many=True
+    ).data
+